@@ -1,3 +1,10 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import Tache
+
+
+@admin.register(Tache)
+class TacheAdmin(admin.ModelAdmin):
+    list_display = ('id', 'nom', 'file', 'etat', 'tentatives', 'executer_apres', 'date_add')
+    list_filter = ('etat', 'file', 'nom')
+    readonly_fields = ('derniere_erreur',)
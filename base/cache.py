@@ -0,0 +1,108 @@
+"""
+Cache de pages pour les visiteurs anonymes.
+
+Les pages sont mises en cache sous une clé qui inclut la version de chaque tag
+dont elles dépendent ('produits', 'website', ...). Modifier un modèle lié à un
+tag change sa version : les anciennes entrées ne sont plus jamais lues et
+expirent d'elles-mêmes. Le panier, seule partie propre au visiteur, est chargé
+ensuite par la requête mini_panier.
+"""
+import hashlib
+import uuid
+from functools import wraps
+
+from django.apps import apps
+from django.contrib import messages
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.http import HttpResponse
+
+
+DUREE_PAGE = 60 * 15
+
+# Modèles dont la modification invalide les pages marquées du tag correspondant
+TAGS_MODELES = {
+    'produits': (
+        'shop.Produit', 'shop.CategorieProduit', 'shop.CategorieEtablissement', 'shop.Etablissement',
+    ),
+    'website': (
+        'website.Banniere', 'website.Partenaire', 'website.Appreciation', 'website.About', 'website.WhyChooseUs',
+    ),
+    'site': (
+        'website.SiteInfo', 'website.Galerie', 'website.Horaire',
+    ),
+    # Menus du header (fragments de base.html)
+    'categories': (
+        'shop.CategorieProduit', 'shop.CategorieEtablissement',
+    ),
+}
+
+
+def version(tag):
+    cle = 'tag:%s' % tag
+    valeur = cache.get(cle)
+    if valeur is None:
+        valeur = uuid.uuid4().hex
+        # add() : si un autre worker vient de créer la version, on garde la sienne
+        if not cache.add(cle, valeur, None):
+            valeur = cache.get(cle, valeur)
+    return valeur
+
+
+def invalider(*tags):
+    for tag in tags:
+        cache.set('tag:%s' % tag, uuid.uuid4().hex, None)
+
+
+def _cle_page(request, tags):
+    versions = ':'.join(version(tag) for tag in tags)
+    url = hashlib.md5(request.build_absolute_uri().encode('utf-8')).hexdigest()
+    return 'page:%s:%s' % (url, hashlib.md5(versions.encode('ascii')).hexdigest())
+
+
+def _cachable(request):
+    return (
+        request.method == 'GET'
+        and not request.user.is_authenticated
+        and not len(messages.get_messages(request))
+    )
+
+
+def cache_page_anonyme(*tags, duree=DUREE_PAGE):
+    """
+    Met en cache la réponse d'une vue pour les visiteurs anonymes.
+
+    Seuls le contenu et le type de la réponse sont conservés (pas les cookies) :
+    la page ne doit rien contenir de propre au visiteur.
+    """
+    def decorateur(vue):
+        @wraps(vue)
+        def wrapper(request, *args, **kwargs):
+            if not _cachable(request):
+                return vue(request, *args, **kwargs)
+            cle = _cle_page(request, tags)
+            entree = cache.get(cle)
+            if entree is not None:
+                contenu, content_type = entree
+                response = HttpResponse(contenu, content_type=content_type)
+                response['X-Cache'] = 'HIT'
+                return response
+            response = vue(request, *args, **kwargs)
+            if response.status_code == 200 and not response.streaming:
+                cache.set(cle, (response.content, response['Content-Type']), duree)
+                response['X-Cache'] = 'MISS'
+            return response
+        return wrapper
+    return decorateur
+
+
+def connecter_signaux():
+    for tag, labels in TAGS_MODELES.items():
+        for label in labels:
+            modele = apps.get_model(label)
+
+            def recepteur(sender, tag=tag, **kwargs):
+                invalider(tag)
+
+            post_save.connect(recepteur, sender=modele, weak=False, dispatch_uid='cache:%s:%s:save' % (tag, label))
+            post_delete.connect(recepteur, sender=modele, weak=False, dispatch_uid='cache:%s:%s:delete' % (tag, label))
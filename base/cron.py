@@ -0,0 +1,20 @@
+from django_cron import CronJobBase, Schedule
+
+from base import taches
+
+
+class TraiterTachesCronJob(CronJobBase):
+    # Vide toutes les files (e-mails...) jusqu'à ce qu'aucune tâche ne soit prête
+    RUN_EVERY_MINS = 1
+
+    schedule = Schedule(run_every_mins=RUN_EVERY_MINS)
+    code = 'base.traiter_taches'
+
+    def do(self):
+        total = 0
+        while True:
+            reservees = taches.traiter(taches.files_connues())
+            if not reservees:
+                break
+            total += reservees
+        print(f"{total} tâches exécutées.")
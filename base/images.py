@@ -0,0 +1,169 @@
+"""
+Variantes redimensionnées des images téléversées.
+
+Les photos des produits, établissements et bannières sont souvent des photos
+de téléphone de plusieurs mégaoctets, affichées en vignettes. Dès qu'une image
+est enregistrée, un pool de processus en crée des variantes WebP et JPEG aux
+largeurs LARGEURS (jamais agrandies), à côté de l'original :
+produis/images/mangue.jpg donne produis/images/mangue-640w.webp, etc. Les
+gabarits les servent via les filtres srcset et variante et la balise
+image_responsive (base.templatetags.images) ; tant qu'elles n'existent pas,
+l'original est servi. Les largeurs disponibles de chaque image sont gardées en
+cache. La commande generer_variantes crée celles des images existantes.
+"""
+import hashlib
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.apps import apps
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_save, pre_save
+from PIL import Image, ImageOps
+
+
+LARGEURS = (320, 640, 1280)
+
+# Format : (extension, options d'enregistrement Pillow)
+FORMATS = {
+    'webp': ('webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+# Champs dont les images ont des variantes
+CHAMPS = {
+    'shop.Produit': ('image', 'image_2', 'image_3'),
+    'shop.Etablissement': ('logo', 'couverture'),
+    'website.Banniere': ('couverture',),
+    'website.Partenaire': ('image',),
+    'website.Galerie': ('image',),
+}
+
+PROCESSUS = 2
+
+DUREE_CACHE = 60 * 60 * 24
+
+
+def nom_variante(nom, largeur, format):
+    racine = os.path.splitext(nom)[0]
+    return '%s-%dw.%s' % (racine, largeur, FORMATS[format][0])
+
+
+def generer(chemin, forcer=False):
+    """
+    Crée les variantes du fichier image chemin ; retourne {format: [largeurs]}.
+
+    Exécutée dans un processus du pool : ni base de données ni stockage Django,
+    seulement des chemins du disque. Les variantes existantes sont gardées, sauf forcer.
+    """
+    disponibles = {format: [] for format in FORMATS}
+    with Image.open(chemin) as original:
+        # Orientation des photos de téléphone (EXIF), appliquée une fois pour toutes
+        image = ImageOps.exif_transpose(original)
+        transparente = 'A' in image.mode or 'transparency' in image.info
+        image = image.convert('RGBA' if transparente else 'RGB')
+    for largeur in LARGEURS:
+        if largeur >= image.width:
+            break
+        reduite = None
+        for format, (extension, options) in FORMATS.items():
+            destination = nom_variante(chemin, largeur, format)
+            if forcer or not os.path.exists(destination):
+                if reduite is None:
+                    reduite = image.resize((largeur, round(image.height * largeur / image.width)), Image.LANCZOS)
+                _enregistrer(reduite, destination, format, options)
+            disponibles[format].append(largeur)
+    return disponibles
+
+
+def _enregistrer(image, destination, format, options):
+    if format == 'jpeg' and image.mode == 'RGBA':
+        # Pas de transparence en JPEG : fond blanc
+        fond = Image.new('RGB', image.size, 'white')
+        fond.paste(image, mask=image.getchannel('A'))
+        image = fond
+    # Fichier temporaire puis renommage : une page ne sert jamais une variante à moitié écrite
+    temporaire = destination + '.tmp'
+    image.save(temporaire, format=format.upper(), **options)
+    os.replace(temporaire, destination)
+
+
+def cle_cache(nom):
+    return 'variantes:%s' % hashlib.md5(nom.encode('utf-8')).hexdigest()
+
+
+def variantes(fichier):
+    """Largeurs disponibles de l'image ({format: [largeurs]}), lues sur le stockage puis gardées en cache."""
+    if not fichier:
+        return {}
+    cle = cle_cache(fichier.name)
+    disponibles = cache.get(cle)
+    if disponibles is None:
+        disponibles = {
+            format: [l for l in LARGEURS if fichier.storage.exists(nom_variante(fichier.name, l, format))]
+            for format in FORMATS
+        }
+        # Sans variante, relu bientôt : elles sont peut-être en cours de création
+        cache.set(cle, disponibles, DUREE_CACHE if any(disponibles.values()) else 60)
+    return disponibles
+
+
+_pool = None
+_verrou = threading.Lock()
+
+
+def pool():
+    """Pool du processus, créé à la première image ('spawn' : rien n'est hérité du serveur web)."""
+    global _pool
+    with _verrou:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(PROCESSUS, mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+
+def soumettre(fichier, forcer=False):
+    """Fait créer en arrière-plan les variantes de l'image ; retourne le Future, ou None (stockage distant)."""
+    global _pool
+    try:
+        chemin = fichier.path
+    except NotImplementedError:
+        return None
+    try:
+        futur = pool().submit(generer, chemin, forcer)
+    except BrokenProcessPool:
+        # Processus du pool tué (image géante, mémoire) : un nouveau pool
+        with _verrou:
+            _pool = None
+        futur = pool().submit(generer, chemin, forcer)
+    cle = cle_cache(fichier.name)
+
+    def terminer(futur):
+        if futur.exception() is None:
+            cache.set(cle, futur.result(), DUREE_CACHE)
+    futur.add_done_callback(terminer)
+    return futur
+
+
+def _avant_enregistrement(sender, instance, **kwargs):
+    # Fichiers téléversés par cet enregistrement (pas encore écrits sur le stockage)
+    instance._images_televersees = [
+        champ for champ in CHAMPS[sender._meta.label]
+        if getattr(instance, champ) and not getattr(instance, champ)._committed
+    ]
+
+
+def _apres_enregistrement(sender, instance, **kwargs):
+    for champ in getattr(instance, '_images_televersees', ()):
+        # Après validation : la transaction ne sera plus annulée
+        transaction.on_commit(lambda fichier=getattr(instance, champ): soumettre(fichier))
+    instance._images_televersees = []
+
+
+def connecter_signaux():
+    for label in CHAMPS:
+        modele = apps.get_model(label)
+        pre_save.connect(_avant_enregistrement, sender=modele, dispatch_uid='images:%s:pre' % label)
+        post_save.connect(_apres_enregistrement, sender=modele, dispatch_uid='images:%s:post' % label)
@@ -0,0 +1,50 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.apps import apps
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+
+from base import images
+
+
+class Command(BaseCommand):
+    help = (
+        "Crée les variantes redimensionnées (WebP, JPEG) des images déjà enregistrées, "
+        "sur --processus processus ; les variantes existantes sont gardées sauf --forcer"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processus', type=int, default=os.cpu_count() or 2)
+        parser.add_argument('--forcer', action='store_true', help="Recrée les variantes existantes")
+
+    def handle(self, *args, **options):
+        fichiers = {}
+        for label, champs in images.CHAMPS.items():
+            modele = apps.get_model(label)
+            for champ in champs:
+                stockage = modele._meta.get_field(champ).storage
+                noms = modele.objects.filter(**{champ + '__gt': ''}).values_list(champ, flat=True).distinct()
+                for nom in noms:
+                    try:
+                        fichiers[stockage.path(nom)] = nom
+                    except NotImplementedError:
+                        pass
+
+        presents = {chemin: nom for chemin, nom in fichiers.items() if os.path.isfile(chemin)}
+        variantes = erreurs = 0
+        with ProcessPoolExecutor(options['processus'], mp_context=multiprocessing.get_context('spawn')) as pool:
+            futurs = {pool.submit(images.generer, chemin, options['forcer']): chemin for chemin in presents}
+            for futur in as_completed(futurs):
+                try:
+                    disponibles = futur.result()
+                except Exception as e:
+                    erreurs += 1
+                    self.stderr.write(f"{futurs[futur]} : {e}")
+                    continue
+                cache.set(images.cle_cache(presents[futurs[futur]]), disponibles, images.DUREE_CACHE)
+                variantes += sum(len(largeurs) for largeurs in disponibles.values())
+
+        self.stdout.write(f"{len(fichiers) - len(presents)} image(s) introuvable(s), {erreurs} erreur(s).")
+        self.stdout.write(self.style.SUCCESS(f"{len(presents) - erreurs} images traitées, {variantes} variantes disponibles."))
@@ -0,0 +1,59 @@
+import threading
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils.module_loading import autodiscover_modules
+
+from base import taches
+
+
+class Command(BaseCommand):
+    help = (
+        "Exécute les tâches différées (e-mails...) ; avec --continu, tourne comme worker "
+        "sur --concurrence threads"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--files', nargs='*', help="Files traitées (toutes par défaut)")
+        parser.add_argument('--lot', type=int, default=taches.TAILLE_LOT, help="Tâches réservées à la fois")
+        parser.add_argument('--continu', action='store_true', help="Ne s'arrête pas quand la file est vide")
+        parser.add_argument('--concurrence', type=int, default=2, help="Threads du worker (avec --continu)")
+        parser.add_argument('--intervalle', type=float, default=1, help="Secondes entre deux scrutations de la file vide")
+
+    def handle(self, *args, **options):
+        # Enregistre les tâches déclarées dans les modules taches des applications
+        autodiscover_modules('taches')
+        files = options['files'] or taches.files_connues()
+        if not options['continu']:
+            total = 0
+            while True:
+                reservees = taches.traiter(files, options['lot'])
+                if not reservees:
+                    break
+                total += reservees
+            self.stdout.write(self.style.SUCCESS(f"{total} tâches exécutées."))
+            return
+
+        arret = threading.Event()
+        threads = [
+            threading.Thread(target=self._boucle, args=(files, options, arret), daemon=True)
+            for _ in range(options['concurrence'])
+        ]
+        for thread in threads:
+            thread.start()
+        self.stdout.write(self.style.SUCCESS(f"Worker démarré sur {', '.join(files)}"))
+        try:
+            while any(thread.is_alive() for thread in threads):
+                for thread in threads:
+                    thread.join(1)
+        except KeyboardInterrupt:
+            arret.set()
+            for thread in threads:
+                thread.join()
+
+    def _boucle(self, files, options, arret):
+        while not arret.is_set():
+            reservees = taches.traiter(files, options['lot'])
+            close_old_connections()
+            if not reservees:
+                arret.wait(options['intervalle'])
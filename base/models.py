@@ -1,3 +1,33 @@
 from django.db import models
 
-# Create your models here.
+
+class Tache(models.Model):
+    """Tâche différée (e-mail, effet de bord lent), exécutée par la commande traiter_taches (base.taches)."""
+
+    EN_ATTENTE, EN_COURS, ECHOUEE = 'en_attente', 'en_cours', 'echouee'
+    ETATS = (
+        (EN_ATTENTE, "En attente"),
+        (EN_COURS, "En cours"),
+        (ECHOUEE, "Échouée"),
+    )
+
+    nom = models.CharField(max_length=100)
+    file = models.CharField(max_length=50, default='defaut')
+    arguments = models.JSONField(default=dict)
+    etat = models.CharField(max_length=20, choices=ETATS, default=EN_ATTENTE)
+    tentatives = models.PositiveIntegerField(default=0)
+    executer_apres = models.DateTimeField()
+    reservee_le = models.DateTimeField(null=True, blank=True)
+    derniere_erreur = models.TextField(blank=True)
+    date_add = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Tâche'
+        verbose_name_plural = 'Tâches'
+        indexes = [
+            # Tâches dues d'une file, dans l'ordre
+            models.Index(fields=['file', 'etat', 'executer_apres'], name='tache_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.nom} ({self.get_etat_display()})"
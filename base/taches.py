@@ -0,0 +1,196 @@
+"""
+File de tâches en base de données.
+
+Les effets de bord lents (e-mails SMTP, notifications) sont enregistrés dans
+Tache au lieu d'être exécutés dans la requête, puis exécutés par la commande
+traiter_taches. Une tâche est une fonction décorée par @tache ; on la met en
+file avec fonction.differer(**arguments), dans la transaction de la requête :
+elle n'existe que si la requête est validée.
+
+Le worker réserve les tâches dues par lots (SELECT ... FOR UPDATE SKIP LOCKED,
+plusieurs workers se partagent la file), regroupe celles d'un même nom, et
+passe un lot entier aux tâches par_lot : envoyer_email réutilise ainsi une
+seule connexion SMTP par lot. Un échec est réessayé avec un délai doublé à
+chaque tentative, jusqu'à max_tentatives ; une tâche réservée depuis plus de
+DUREE_BAIL (worker arrêté en cours de route) est reprise.
+"""
+import datetime
+import threading
+import traceback
+
+from django.conf import settings
+from django.core import mail
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Tache
+
+
+TAILLE_LOT = 20
+
+DELAI_BASE = datetime.timedelta(seconds=30)
+DELAI_MAX = datetime.timedelta(hours=1)
+
+DUREE_BAIL = datetime.timedelta(minutes=10)
+
+# Lots d'une file exécutés en même temps par un worker (défaut : 1) ; le serveur
+# SMTP limite le nombre de connexions simultanées d'un compte
+LIMITES_FILES = {'emails': 2}
+
+REGISTRE = {}
+
+
+class _Definition:
+    def __init__(self, fonction, file, max_tentatives, par_lot):
+        self.fonction = fonction
+        self.file = file
+        self.max_tentatives = max_tentatives
+        self.par_lot = par_lot
+
+
+def tache(nom=None, file='defaut', max_tentatives=5, par_lot=False):
+    """
+    Déclare une tâche ; la fonction décorée gagne differer(**arguments).
+
+    Les arguments sont stockés en JSON. Une tâche par_lot reçoit la liste des
+    arguments d'un lot et retourne, pour chacun, None ou l'exception levée.
+    """
+    def decorateur(fonction):
+        cle = nom or '%s.%s' % (fonction.__module__, fonction.__name__)
+        REGISTRE[cle] = _Definition(fonction, file, max_tentatives, par_lot)
+
+        def differer(**arguments):
+            return Tache.objects.create(nom=cle, file=file, arguments=arguments, executer_apres=timezone.now())
+
+        fonction.differer = differer
+        return fonction
+    return decorateur
+
+
+def delai(tentatives):
+    """Attente avant l'essai suivant : DELAI_BASE doublé à chaque tentative, borné à DELAI_MAX."""
+    return min(DELAI_BASE * 2 ** min(max(tentatives - 1, 0), 20), DELAI_MAX)
+
+
+def reserver(files, limite=TAILLE_LOT):
+    """Réserve jusqu'à limite tâches dues des files données et les passe en cours."""
+    maintenant = timezone.now()
+    with transaction.atomic():
+        ids = list(
+            Tache.objects.select_for_update(skip_locked=True)
+            .filter(file__in=files)
+            .filter(
+                Q(etat=Tache.EN_ATTENTE, executer_apres__lte=maintenant)
+                | Q(etat=Tache.EN_COURS, reservee_le__lt=maintenant - DUREE_BAIL)
+            )
+            .order_by('executer_apres').values_list('id', flat=True)[:limite]
+        )
+        Tache.objects.filter(id__in=ids).update(
+            etat=Tache.EN_COURS, reservee_le=maintenant, tentatives=F('tentatives') + 1,
+        )
+    return list(Tache.objects.filter(id__in=ids).order_by('executer_apres'))
+
+
+def _echec(tache_, erreur, definition):
+    message = ''.join(traceback.format_exception(type(erreur), erreur, erreur.__traceback__))[-4000:]
+    if definition is None or tache_.tentatives >= definition.max_tentatives:
+        Tache.objects.filter(id=tache_.id).update(etat=Tache.ECHOUEE, derniere_erreur=message)
+    else:
+        Tache.objects.filter(id=tache_.id).update(
+            etat=Tache.EN_ATTENTE, executer_apres=timezone.now() + delai(tache_.tentatives), derniere_erreur=message,
+        )
+
+
+def executer(taches):
+    """Exécute des tâches réservées ; retourne le nombre de réussites. Les réussies sont supprimées."""
+    groupes = {}
+    for tache_ in taches:
+        groupes.setdefault(tache_.nom, []).append(tache_)
+
+    reussies = []
+    for nom, groupe in groupes.items():
+        definition = REGISTRE.get(nom)
+        if definition is None:
+            for tache_ in groupe:
+                _echec(tache_, LookupError("Tâche inconnue : %s" % nom), None)
+            continue
+        if definition.par_lot:
+            try:
+                erreurs = definition.fonction([tache_.arguments for tache_ in groupe])
+            except Exception as e:
+                erreurs = [e] * len(groupe)
+        else:
+            erreurs = []
+            for tache_ in groupe:
+                try:
+                    definition.fonction(**tache_.arguments)
+                    erreurs.append(None)
+                except Exception as e:
+                    erreurs.append(e)
+        for tache_, erreur in zip(groupe, erreurs):
+            if erreur is None:
+                reussies.append(tache_.id)
+            else:
+                _echec(tache_, erreur, definition)
+
+    Tache.objects.filter(id__in=reussies).delete()
+    return len(reussies)
+
+
+_semaphores = {}
+_verrou = threading.Lock()
+
+
+def _semaphore(file):
+    with _verrou:
+        if file not in _semaphores:
+            _semaphores[file] = threading.BoundedSemaphore(LIMITES_FILES.get(file, 1))
+        return _semaphores[file]
+
+
+def traiter(files, taille_lot=TAILLE_LOT):
+    """
+    Réserve et exécute un lot de chaque file dont la limite de concurrence le permet.
+
+    Appelée en boucle par chaque thread du worker ; retourne le nombre de tâches réservées.
+    """
+    reservees = 0
+    for file in files:
+        semaphore = _semaphore(file)
+        if not semaphore.acquire(blocking=False):
+            continue
+        try:
+            lot = reserver([file], taille_lot)
+            reservees += len(lot)
+            executer(lot)
+        finally:
+            semaphore.release()
+    return reservees
+
+
+def files_connues():
+    return sorted({definition.file for definition in REGISTRE.values()})
+
+
+@tache('envoyer_email', file='emails', par_lot=True)
+def envoyer_email(lot):
+    """Envoie un lot d'e-mails sur une seule connexion SMTP."""
+    erreurs = []
+    with mail.get_connection() as connexion:
+        for arguments in lot:
+            try:
+                mail.EmailMessage(
+                    arguments['sujet'], arguments['message'],
+                    arguments.get('expediteur') or settings.DEFAULT_FROM_EMAIL,
+                    arguments['destinataires'], connection=connexion,
+                ).send()
+                erreurs.append(None)
+            except Exception as e:
+                erreurs.append(e)
+    return erreurs
+
+
+def differer_email(sujet, message, destinataires, expediteur=None):
+    """Met un e-mail en file ; il partira avec le prochain lot du worker."""
+    return envoyer_email.differer(sujet=sujet, message=message, destinataires=list(destinataires), expediteur=expediteur)
@@ -0,0 +1,42 @@
+from django import template
+
+from base import images
+
+
+register = template.Library()
+
+
+def _url(fichier, largeur, format):
+    return fichier.storage.url(images.nom_variante(fichier.name, largeur, format))
+
+
+@register.filter
+def srcset(fichier, format='jpeg'):
+    """Attribut srcset des variantes de l'image ('' tant qu'il n'y en a pas)."""
+    return ', '.join(
+        '%s %dw' % (_url(fichier, largeur, format), largeur) for largeur in images.variantes(fichier).get(format, ())
+    )
+
+
+@register.filter
+def variante(fichier, largeur):
+    """URL de la plus petite variante JPEG d'au moins largeur pixels, sinon de l'original."""
+    if not fichier:
+        return ''
+    for disponible in images.variantes(fichier).get('jpeg', ()):
+        if disponible >= int(largeur):
+            return _url(fichier, disponible, 'jpeg')
+    return fichier.url
+
+
+@register.inclusion_tag('partials/image-responsive.html')
+def image_responsive(fichier, alt='', sizes='100vw', lazy=True):
+    """<picture> : variantes WebP, puis JPEG, l'original en dernier recours."""
+    return {
+        'fichier': fichier,
+        'alt': alt,
+        'sizes': sizes,
+        'lazy': lazy,
+        'webp': srcset(fichier, 'webp') if fichier else '',
+        'jpeg': srcset(fichier, 'jpeg') if fichier else '',
+    }
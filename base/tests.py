@@ -1,3 +1,227 @@
-from django.test import TestCase
+from django.test import TestCase, Client, override_settings
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.urls import reverse
+from shop.models import CategorieEtablissement, CategorieProduit, Etablissement, Produit
+from customer.models import Panier, ProduitPanier
+from django.utils import timezone
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.template import Context, Template
+from unittest.mock import patch
+from PIL import Image
+from . import images, taches
+from .models import Tache
+import datetime
+import io
+import json
+import os
+import shutil
+import tempfile
 
-# Create your tests here.
+
+class BaseCachePageTest(TestCase):
+    """Tests du cache de pages anonymes et du mini-panier chargé à part"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        owner = User.objects.create_user(username="owner", password="test")
+        cat_etab = CategorieEtablissement.objects.create(nom="Resto", description="D")
+        self.cat_prod = CategorieProduit.objects.create(nom="Plats", description="D", categorie=cat_etab)
+        self.etab = Etablissement.objects.create(
+            user=owner, nom="Resto Test", description="D", categorie=cat_etab,
+            nom_du_responsable="T", prenoms_duresponsable="U", adresse="A", pays="CI", contact_1="0", email="t@t.com"
+        )
+        self.produit = Produit.objects.create(nom="Attiéké", prix=500, quantite=100, categorie=self.cat_prod, etablissement=self.etab)
+
+    def test_page_servie_depuis_le_cache(self):
+        """La deuxième visite anonyme ne touche ni l'ORM ni les templates"""
+        url = reverse('product_detail', args=[self.produit.slug])
+        self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertContains(response, 'Attiéké')
+
+    def test_invalidation_par_modification(self):
+        """Modifier un produit invalide les pages qui dépendent du tag produits"""
+        url = reverse('shop')
+        self.client.get(url)
+        self.produit.nom = "Garba"
+        self.produit.save()
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertContains(response, 'Garba')
+
+    def test_utilisateur_connecte_non_mis_en_cache(self):
+        """Les pages des utilisateurs connectés ne passent pas par le cache"""
+        User.objects.create_user(username="client", password="password123")
+        self.client.login(username="client", password="password123")
+        self.client.get(reverse('shop'))
+        self.assertNotIn('X-Cache', self.client.get(reverse('shop')))
+
+    def test_mini_panier_et_ajout(self):
+        """Le mini-panier suit le panier de la session et pose le cookie CSRF"""
+        response = self.client.get(reverse('mini_panier'))
+        self.assertEqual(response.json()['nombre'], 0)
+        self.assertIn('csrftoken', response.cookies)
+        self.client.post(reverse('add_to_cart'), json.dumps({'produit': self.produit.id, 'quantite': 2}),
+                         content_type='application/json')
+        data = self.client.get(reverse('mini_panier')).json()
+        self.assertEqual(data['nombre'], 1)
+        self.assertIn('Attiéké', data['html'])
+        self.assertEqual(Panier.objects.count(), 1)
+        self.assertEqual(ProduitPanier.objects.get().quantite, 2)
+
+
+class CompteurConnexions(EmailBackend):
+    """Backend de test qui compte les connexions ouvertes"""
+    ouvertures = 0
+
+    def open(self):
+        CompteurConnexions.ouvertures += 1
+        return True
+
+
+@taches.tache('tests.echec', max_tentatives=2)
+def tache_en_echec():
+    raise RuntimeError("serveur indisponible")
+
+
+class BaseTachesTest(TestCase):
+    """File de tâches en base : envoi différé, lots, nouvelles tentatives"""
+
+    def traiter(self):
+        return taches.traiter(taches.files_connues())
+
+    @override_settings(EMAIL_BACKEND='base.tests.CompteurConnexions')
+    def test_emails_en_lot(self):
+        """Les e-mails d'un lot partent sur une seule connexion SMTP"""
+        CompteurConnexions.ouvertures = 0
+        for i in range(5):
+            taches.differer_email("Sujet %d" % i, "Message", ["client%d@test.com" % i])
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(self.traiter(), 5)
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(CompteurConnexions.ouvertures, 1)
+        self.assertFalse(Tache.objects.exists())
+
+    def test_nouvelles_tentatives(self):
+        """Un échec est réessayé plus tard, puis la tâche est marquée échouée"""
+        tache_en_echec.differer()
+        self.traiter()
+        tache = Tache.objects.get()
+        self.assertEqual((tache.etat, tache.tentatives), (Tache.EN_ATTENTE, 1))
+        self.assertGreater(tache.executer_apres, timezone.now())
+        self.assertIn("serveur indisponible", tache.derniere_erreur)
+        # Pas encore due
+        self.assertEqual(self.traiter(), 0)
+
+        Tache.objects.update(executer_apres=timezone.now())
+        self.traiter()
+        tache.refresh_from_db()
+        self.assertEqual((tache.etat, tache.tentatives), (Tache.ECHOUEE, 2))
+
+    def test_delai_croissant(self):
+        """Le délai double à chaque tentative, dans la limite de DELAI_MAX"""
+        self.assertEqual(taches.delai(2), 2 * taches.delai(1))
+        self.assertEqual(taches.delai(50), taches.DELAI_MAX)
+
+    def test_tache_abandonnee_reprise(self):
+        """Une tâche restée en cours au-delà du bail (worker arrêté) est reprise"""
+        taches.differer_email("Sujet", "Message", ["client@test.com"])
+        Tache.objects.update(etat=Tache.EN_COURS, reservee_le=timezone.now() - datetime.timedelta(hours=1))
+        self.assertEqual(self.traiter(), 1)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_reinitialisation_mot_de_passe_differee(self):
+        """La demande de réinitialisation ne parle pas au serveur SMTP"""
+        User.objects.create_user(username="client", email="client@test.com", password="password123")
+        self.client.post(reverse('request_reset_password'), {'email': 'client@test.com'})
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(Tache.objects.filter(nom='envoyer_email').count(), 1)
+        self.traiter()
+        self.assertEqual(mail.outbox[0].to, ['client@test.com'])
+
+
+class BaseImagesTest(TestCase):
+    """Variantes redimensionnées des images : création, signaux, gabarits, commande de rattrapage"""
+
+    def setUp(self):
+        cache.clear()
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        reglages = override_settings(MEDIA_ROOT=self.media)
+        reglages.enable()
+        self.addCleanup(reglages.disable)
+        owner = User.objects.create_user(username="owner", password="test")
+        cat_etab = CategorieEtablissement.objects.create(nom="Resto", description="D")
+        self.cat_prod = CategorieProduit.objects.create(nom="Plats", description="D", categorie=cat_etab)
+        self.etab = Etablissement.objects.create(
+            user=owner, nom="Resto Test", description="D", categorie=cat_etab,
+            nom_du_responsable="T", prenoms_duresponsable="U", adresse="A", pays="CI", contact_1="0", email="t@t.com"
+        )
+
+    def image(self, nom='photo.jpg', taille=(1600, 900), mode='RGB', format='JPEG'):
+        contenu = io.BytesIO()
+        Image.new(mode, taille, (200, 100, 50, 128) if mode == 'RGBA' else (200, 100, 50)).save(contenu, format=format)
+        return SimpleUploadedFile(nom, contenu.getvalue(), content_type='image/jpeg')
+
+    def produit(self, **images_):
+        return Produit.objects.create(
+            nom="Attiéké", prix=500, quantite=100, categorie=self.cat_prod, etablissement=self.etab, **images_
+        )
+
+    def test_generer(self):
+        """Variantes WebP et JPEG aux largeurs inférieures à l'original, sans agrandissement"""
+        produit = self.produit(image=self.image(taille=(1000, 500)))
+        self.assertEqual(images.generer(produit.image.path), {'webp': [320, 640], 'jpeg': [320, 640]})
+        with Image.open(os.path.join(self.media, images.nom_variante(produit.image.name, 640, 'webp'))) as variante:
+            self.assertEqual((variante.format, variante.size), ('WEBP', (640, 320)))
+        self.assertFalse(os.path.exists(os.path.join(self.media, images.nom_variante(produit.image.name, 1280, 'jpeg'))))
+
+        logo = self.produit(image=self.image('logo.png', (800, 800), 'RGBA', 'PNG'))
+        images.generer(logo.image.path)
+        with Image.open(os.path.join(self.media, images.nom_variante(logo.image.name, 320, 'jpeg'))) as variante:
+            self.assertEqual(variante.mode, 'RGB')
+
+    def test_televersement_soumet_les_variantes(self):
+        """Seules les images téléversées sont soumises, après validation de la transaction"""
+        with patch('base.images.soumettre') as soumettre:
+            with self.captureOnCommitCallbacks(execute=True):
+                produit = self.produit(image=self.image(), image_2=self.image('deux.jpg'))
+            self.assertEqual(sorted(appel.args[0].name for appel in soumettre.call_args_list), sorted([produit.image.name, produit.image_2.name]))
+
+            soumettre.reset_mock()
+            with self.captureOnCommitCallbacks(execute=True):
+                produit.nom = "Garba"
+                produit.save()
+            soumettre.assert_not_called()
+
+    def test_pool_et_gabarits(self):
+        """Le pool crée les variantes ; les gabarits servent alors srcset et <picture>"""
+        produit = self.produit(image=self.image())
+        rendu = Template('{% load images %}{% image_responsive produit.image "Attiéké" "360px" %}')
+        self.assertNotIn('srcset', rendu.render(Context({'produit': produit})))
+
+        images.soumettre(produit.image).result(timeout=60)
+        html = rendu.render(Context({'produit': produit}))
+        self.assertIn('<source type="image/webp" srcset="/media/produis/images/photo-320w.webp 320w', html)
+        self.assertIn('/media/produis/images/photo-1280w.jpg 1280w" sizes="360px"', html)
+        self.assertEqual(
+            Template('{% load images %}{{ produit.image|variante:500 }}').render(Context({'produit': produit})),
+            '/media/produis/images/photo-640w.jpg',
+        )
+
+    def test_commande_generer_variantes(self):
+        """La commande crée les variantes des images existantes et signale les fichiers manquants"""
+        with patch('base.images.soumettre'):
+            produit = self.produit(image=self.image(), image_2=self.image('deux.jpg', (500, 500)))
+        sortie = io.StringIO()
+        call_command('generer_variantes', processus=2, stdout=sortie, stderr=io.StringIO())
+        self.assertIn("2 images traitées, 8 variantes disponibles", sortie.getvalue())
+        self.assertIn("1 image(s) introuvable(s)", sortie.getvalue())
+        self.assertEqual(images.variantes(produit.image)['webp'], [320, 640, 1280])
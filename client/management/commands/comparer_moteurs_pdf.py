@@ -0,0 +1,161 @@
+import glob
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+from django.test import override_settings
+from pypdf import PdfReader
+
+from client import moteurs_pdf, recus, rendu_pdf
+from customer.models import Commande, Customer, ProduitPanier
+from shop import models
+from website.models import SiteInfo
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare les moteurs de rendu des reçus PDF : latence (médiane, p95), pic de mémoire "
+        "(RSS du processus et de ses descendants, navigateur compris) et pages par seconde. "
+        "Chaque moteur est mesuré dans son propre processus ; les données créées sont annulées"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--moteurs', nargs='+', default=list(moteurs_pdf.MOTEURS), choices=list(moteurs_pdf.MOTEURS))
+        parser.add_argument('--recus', type=int, default=50, help="Reçus rendus par moteur")
+        parser.add_argument('--lignes', type=int, default=5, help="Lignes par reçu")
+        parser.add_argument('--concurrence', type=int, default=1, help="Rendus simultanés")
+        parser.add_argument('--pages', type=int, default=4, help="Pages chaudes du service (playwright)")
+
+    def handle(self, *args, **options):
+        contexte = self._contexte(options['lignes'])
+        # Les processus de mesure ne touchent pas à la base : aucune connexion héritée
+        connections.close_all()
+
+        fork = multiprocessing.get_context('fork')
+        for nom in options['moteurs']:
+            lecture, ecriture = fork.Pipe(duplex=False)
+            processus = fork.Process(target=_mesurer, args=(ecriture, nom, contexte, options))
+            processus.start()
+            ecriture.close()
+            resultat = lecture.recv()
+            processus.join()
+            if 'erreur' in resultat:
+                self.stdout.write(self.style.ERROR(f"{nom:<10} échec : {resultat['erreur']}"))
+                continue
+            memoire = f"{resultat['memoire'] / 1024:.0f} Mo" if resultat['memoire'] else "n/d"
+            self.stdout.write(
+                f"{nom:<10} {resultat['reussis']}/{options['recus']} reçus ({resultat['pages']} page(s), "
+                f"{resultat['taille'] / 1024:.0f} Ko) ; médiane {resultat['mediane'] * 1000:.0f} ms, "
+                f"p95 {resultat['p95'] * 1000:.0f} ms ; mémoire max {memoire}"
+            )
+            self.stdout.write(self.style.SUCCESS(f"{nom:<10} {resultat['pages_par_seconde']:.1f} pages par seconde"))
+
+    def _contexte(self, lignes):
+        # Reçu d'une commande de mesure, entièrement chargé avant l'annulation
+        with transaction.atomic():
+            proprietaire = User.objects.create_user(username='mesure-moteurs-proprietaire')
+            categorie_etab = models.CategorieEtablissement.objects.create(nom="Mesure", description="Mesure")
+            categorie = models.CategorieProduit.objects.create(nom="Mesure", description="Mesure", categorie=categorie_etab)
+            etablissement = models.Etablissement.objects.create(
+                user=proprietaire, nom="Mesure", description="Mesure", categorie=categorie_etab,
+                nom_du_responsable="M", prenoms_duresponsable="M", adresse="M", pays="CI", contact_1="0", email="m@m.com",
+            )
+            user = User.objects.create_user(username='mesure-moteurs')
+            customer = Customer.objects.create(user=user, adresse="M", contact_1="0")
+            commande = Commande.objects.create(
+                customer=customer, prix_total=1000 * lignes, transaction_id='mesure-moteurs', id_paiment='mesure',
+            )
+            for i in range(lignes):
+                produit = models.Produit.objects.create(
+                    nom="Produit de mesure %d" % i, prix=1000, quantite=10, categorie=categorie, etablissement=etablissement,
+                )
+                ProduitPanier.objects.create(produit=produit, commande=commande, quantite=1)
+            site = SiteInfo.objects.order_by('-date_add').first()
+            logo = 'http://localhost' + site.logo.url if site else ''
+            contexte = recus.contexte(commande, 'http://localhost/commande-detail/%d/' % commande.id, logo)
+            transaction.set_rollback(True)
+        return contexte
+
+
+def _memoire(pid):
+    """RSS (Ko) du processus et de ses descendants, lu dans /proc (Linux) ; 0 ailleurs."""
+    try:
+        with open('/proc/%d/status' % pid) as status:
+            total = next((int(ligne.split()[1]) for ligne in status if ligne.startswith('VmRSS:')), 0)
+        enfants = []
+        for fichier in glob.glob('/proc/%d/task/*/children' % pid):
+            with open(fichier) as f:
+                enfants += f.read().split()
+    except OSError:
+        return 0
+    return total + sum(_memoire(int(enfant)) for enfant in enfants)
+
+
+def _mesurer(ecriture, nom, contexte, options):
+    service = None
+    pic = [0]
+    fin = threading.Event()
+
+    def surveiller():
+        while not fin.wait(0.05):
+            pic[0] = max(pic[0], _memoire(os.getpid()))
+
+    # Un avertissement par reçu quand le logo manque
+    logging.getLogger('xhtml2pdf').setLevel(logging.ERROR)
+    try:
+        moteur = moteurs_pdf.moteur(nom)
+        if nom == 'playwright':
+            service = rendu_pdf.ServiceRendu(pages=options['pages'], file=options['recus']).demarrer()
+            override_settings(RENDU_PDF=dict(settings.RENDU_PDF, **service.config)).enable()
+
+        def rendre():
+            return moteur.rendre(contexte)
+
+        threading.Thread(target=surveiller, daemon=True).start()
+        # Premier rendu hors mesure (polices, gabarits, pages chaudes)
+        pdf = rendre()
+        pages = len(PdfReader(BytesIO(pdf)).pages)
+
+        durees = []
+
+        def un_recu(_):
+            debut = time.perf_counter()
+            try:
+                rendre()
+                return True
+            except Exception:
+                return False
+            finally:
+                durees.append(time.perf_counter() - debut)
+
+        debut = time.perf_counter()
+        with ThreadPoolExecutor(options['concurrence']) as executeur:
+            reussis = sum(executeur.map(un_recu, range(options['recus'])))
+        duree = time.perf_counter() - debut
+        fin.set()
+
+        durees.sort()
+        ecriture.send({
+            'reussis': reussis,
+            'pages': pages,
+            'taille': len(pdf),
+            'mediane': durees[len(durees) // 2],
+            'p95': durees[int(len(durees) * 0.95)],
+            'memoire': pic[0],
+            'pages_par_seconde': reussis * pages / duree,
+        })
+    except Exception as e:
+        ecriture.send({'erreur': str(e).splitlines()[0] if str(e) else type(e).__name__})
+    finally:
+        fin.set()
+        if service is not None:
+            service.arreter()
+        ecriture.close()
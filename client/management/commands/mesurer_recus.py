@@ -0,0 +1,93 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.template.loader import render_to_string
+from playwright.sync_api import sync_playwright
+
+from client import rendu_pdf
+from client.utils import qrcode_base64
+from customer.models import Commande, Customer
+
+
+class Command(BaseCommand):
+    help = (
+        "Mesure le débit (reçus par seconde) de téléchargements de reçus PDF simultanés, "
+        "par le service de rendu lancé dans le processus, ou avec --ancien en lançant "
+        "Chromium à chaque reçu comme le faisait invoice_pdf"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recus', type=int, default=100, help="Nombre de reçus rendus")
+        parser.add_argument('--concurrence', type=int, default=8, help="Téléchargements simultanés")
+        parser.add_argument('--pages', type=int, default=4, help="Pages chaudes du service")
+        parser.add_argument('--ancien', action='store_true', help="Un Chromium lancé par reçu")
+
+    def handle(self, *args, **options):
+        html = self._html()
+        if options['ancien']:
+            rendre = _rendre_sans_service
+            service = None
+        else:
+            service = rendu_pdf.ServiceRendu(pages=options['pages'], file=options['recus']).demarrer()
+            config = service.config
+
+            def rendre(html):
+                return rendu_pdf.rendre(html, config)
+        try:
+            self._mesurer(rendre, html, options['recus'], options['concurrence'])
+        finally:
+            if service is not None:
+                service.arreter()
+
+    def _mesurer(self, rendre, html, nombre, concurrence):
+        durees = []
+
+        def telecharger(_):
+            debut = time.perf_counter()
+            try:
+                rendre(html)
+                return True
+            except Exception:
+                return False
+            finally:
+                durees.append(time.perf_counter() - debut)
+
+        debut = time.perf_counter()
+        with ThreadPoolExecutor(concurrence) as executeur:
+            reussis = sum(executeur.map(telecharger, range(nombre)))
+        duree = time.perf_counter() - debut
+
+        durees.sort()
+        self.stdout.write(
+            f"{reussis}/{nombre} reçus en {duree:.2f}s, {concurrence} simultanés ; "
+            f"médiane {durees[len(durees) // 2] * 1000:.0f} ms, p95 {durees[int(len(durees) * 0.95)] * 1000:.0f} ms"
+        )
+        self.stdout.write(self.style.SUCCESS(f"{nombre / duree:.1f} reçus par seconde"))
+
+    def _html(self):
+        # Reçu d'une commande de mesure, annulée une fois le HTML construit
+        with transaction.atomic():
+            user = User.objects.create_user(username='mesure-recu')
+            customer = Customer.objects.create(user=user, adresse="M", contact_1="0")
+            commande = Commande.objects.create(customer=customer, prix_total=1000, transaction_id='mesure-recu')
+            html = render_to_string("receipt.html", {
+                "order_id": commande,
+                "produits_commande": commande.produit_commande.all(),
+                "qr_code": qrcode_base64('http://localhost/commande-detail/%d/' % commande.id),
+                "logo": '',
+            })
+            transaction.set_rollback(True)
+        return html
+
+
+def _rendre_sans_service(html):
+    with sync_playwright() as p:
+        navigateur = p.chromium.launch()
+        page = navigateur.new_page()
+        page.set_content(html, wait_until='load')
+        pdf = page.pdf(**rendu_pdf.OPTIONS_PDF)
+        navigateur.close()
+    return pdf
@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from client.rendu_pdf import ServiceRendu
+
+
+class Command(BaseCommand):
+    help = (
+        "Lance le service de rendu des reçus PDF (Chromium gardé ouvert, pool de pages chaudes) ; "
+        "la vue invoice_pdf le joint à l'adresse de settings.RENDU_PDF"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=settings.RENDU_PDF['PORT'])
+        parser.add_argument('--pages', type=int, default=settings.RENDU_PDF['PAGES'], help="Rendus simultanés")
+        parser.add_argument('--file', type=int, default=settings.RENDU_PDF['FILE'], help="Demandes en attente acceptées")
+        parser.add_argument('--timeout', type=float, default=settings.RENDU_PDF['TIMEOUT'], help="Secondes par reçu")
+
+    def handle(self, *args, **options):
+        service = ServiceRendu(
+            hote=settings.RENDU_PDF['HOTE'], port=options['port'], pages=options['pages'],
+            file=options['file'], timeout=options['timeout'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Service de rendu des reçus sur {service.hote}:{service.port} ({options['pages']} pages)"
+        ))
+        try:
+            service.servir()
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,136 @@
+"""
+Moteurs de rendu des reçus PDF, choisis par settings.RENDU_PDF['MOTEUR'].
+
+- playwright : receipt.html imprimé par Chromium, via le service de rendu
+  (client.rendu_pdf) ; rendu fidèle, mais un navigateur à faire tourner.
+- xhtml2pdf : receipt.html converti en Python pur, dans le processus web.
+- reportlab : mise en page directe du contenu du reçu, sans HTML ; le plus
+  léger en mémoire et en temps.
+
+Chaque moteur reçoit le contexte de recus.contexte() et retourne les octets du
+PDF, ou lève ErreurRendu. La commande comparer_moteurs_pdf mesure latence,
+mémoire et pages par seconde de chacun.
+"""
+import base64
+import os
+from io import BytesIO
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.template.loader import render_to_string
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.units import mm
+from reportlab.platypus import Image, Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+from xhtml2pdf import pisa
+
+from . import rendu_pdf
+from .rendu_pdf import ErreurRendu
+
+
+def chemin_local(uri):
+    """Fichier local d'une URL statique ou média (absolue ou non), ou None."""
+    chemin = urlsplit(uri).path
+    if chemin.startswith(settings.STATIC_URL):
+        return finders.find(chemin[len(settings.STATIC_URL):])
+    if chemin.startswith(settings.MEDIA_URL):
+        fichier = os.path.join(settings.MEDIA_ROOT, chemin[len(settings.MEDIA_URL):])
+        return fichier if os.path.isfile(fichier) else None
+    return None
+
+
+class MoteurPlaywright:
+    nom = 'playwright'
+
+    def rendre(self, contexte):
+        return rendu_pdf.rendre(render_to_string("receipt.html", contexte))
+
+
+# Feuille de style vide (/**/) : une chaîne vide fait journaliser une erreur par feuille
+FEUILLE_VIDE = 'data:text/css;base64,LyoqLw=='
+
+
+class MoteurXhtml2pdf:
+    nom = 'xhtml2pdf'
+
+    def rendre(self, contexte):
+        def lien(uri, base):
+            # Images lues sur le disque, jamais par HTTP ; les feuilles de style de Bootstrap
+            # font échouer la mise en page des tableaux de xhtml2pdf, seul le <style> du gabarit est gardé
+            if uri.startswith('data:'):
+                return uri
+            if urlsplit(uri).path.endswith('.css'):
+                return FEUILLE_VIDE
+            return chemin_local(uri) or ''
+
+        resultat = BytesIO()
+        pdf = pisa.CreatePDF(render_to_string("receipt.html", contexte), dest=resultat, link_callback=lien, encoding='utf-8')
+        if pdf.err:
+            raise ErreurRendu("Le reçu n'a pas pu être généré")
+        return resultat.getvalue()
+
+
+class MoteurReportlab:
+    nom = 'reportlab'
+
+    def rendre(self, contexte):
+        commande = contexte['order_id']
+        styles = getSampleStyleSheet()
+        elements = []
+
+        logo = chemin_local(contexte['logo'])
+        if logo:
+            try:
+                elements.append(Image(logo, width=30 * mm, height=30 * mm, kind='proportional'))
+            except OSError:
+                pass
+        elements.append(Paragraph("Reçu de Commande", styles['Title']))
+        for libelle, valeur in (
+            ("ID Opération", commande.id_paiment),
+            ("ID Transaction", commande.transaction_id),
+            ("Date de Paiement", commande.date_add.strftime('%d/%m/%Y %H:%M')),
+            ("Total Payé", "%.0f F CFA" % commande.prix_total),
+        ):
+            elements.append(Paragraph("<b>%s :</b> %s" % (libelle, _echapper(valeur)), styles['Normal']))
+        elements += [Spacer(0, 6 * mm), Paragraph("Produits de la commande", styles['Heading4'])]
+
+        lignes = [["Produit", "Quantité", "Prix Unitaire", "Total"]] + [
+            [
+                Paragraph(_echapper(ligne.produit.nom), styles['Normal']), ligne.quantite,
+                "%.0f F CFA" % ligne.produit.prix, "%.0f F CFA" % ligne.total,
+            ]
+            for ligne in contexte['produits_commande']
+        ]
+        tableau = Table(lignes, colWidths=[76 * mm, 38 * mm, 38 * mm, 38 * mm], repeatRows=1)
+        tableau.setStyle(TableStyle([
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('LINEBELOW', (0, 0), (-1, -1), 0.25, colors.lightgrey),
+            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ]))
+        elements += [tableau, Spacer(0, 8 * mm), Paragraph("Scannez pour vérifier :", styles['Normal'])]
+        elements.append(Image(BytesIO(base64.b64decode(contexte['qr_code'])), width=50 * mm, height=50 * mm))
+
+        resultat = BytesIO()
+        SimpleDocTemplate(
+            resultat, pagesize=A4, leftMargin=10 * mm, rightMargin=10 * mm, topMargin=10 * mm, bottomMargin=10 * mm,
+            title="Reçu %s" % (commande.transaction_id or ''),
+        ).build(elements)
+        return resultat.getvalue()
+
+
+def _echapper(valeur):
+    return str('' if valeur is None else valeur).replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+MOTEURS = {moteur.nom: moteur for moteur in (MoteurPlaywright, MoteurXhtml2pdf, MoteurReportlab)}
+
+
+def moteur(nom=None):
+    """Moteur configuré (settings.RENDU_PDF['MOTEUR']) ou celui nommé."""
+    nom = nom or settings.RENDU_PDF['MOTEUR']
+    try:
+        return MOTEURS[nom]()
+    except KeyError:
+        raise ValueError("Moteur de rendu PDF inconnu : %s (choix : %s)" % (nom, ', '.join(MOTEURS)))
@@ -0,0 +1,84 @@
+"""
+Reçus PDF rendus une seule fois.
+
+Le reçu d'une commande est enregistré dans Commande.recu_paiement sous le nom
+de l'empreinte (SHA-256) de tout ce qu'il affiche : commande, lignes, logo,
+URL du QR code et moteur de rendu. Un téléchargement recalcule l'empreinte (une
+requête) et sert le fichier enregistré quand elle n'a pas changé ; sinon le
+reçu est rendu de nouveau et l'ancien fichier supprimé. Modifier receipt.html impose d'augmenter
+VERSION. Les QR codes sont mis en cache par URL.
+"""
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+
+from customer.models import Commande
+
+from .utils import qrcode_base64
+
+
+VERSION = 1
+
+DOSSIER = 'fichiers/paiements'
+
+DUREE_QR = 60 * 60 * 24 * 30
+
+
+def qrcode(url):
+    """QR code de l'URL en base64 (PNG), mis en cache."""
+    cle = 'qr:%s' % hashlib.sha256(url.encode('utf-8')).hexdigest()
+    return cache.get_or_set(cle, lambda: qrcode_base64(url), DUREE_QR)
+
+
+def empreinte(commande, detail_url, logo_url):
+    """Empreinte du contenu du reçu ; elle change avec la commande, ses lignes ou le logo."""
+    lignes = commande.produit_commande.select_related('produit').order_by('id')
+    contenu = {
+        'version': VERSION,
+        'moteur': settings.RENDU_PDF['MOTEUR'],
+        'commande': [
+            commande.id, commande.id_paiment, commande.transaction_id,
+            commande.date_add.isoformat(), commande.prix_total,
+        ],
+        'lignes': [[l.produit.nom, l.quantite, l.produit.prix, l.total] for l in lignes],
+        'detail_url': detail_url,
+        'logo': logo_url,
+    }
+    return hashlib.sha256(json.dumps(contenu, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def contexte(commande, detail_url, logo_url):
+    """Contexte de receipt.html, lu par tous les moteurs de rendu (client.moteurs_pdf)."""
+    return {
+        "order_id": commande,
+        "produits_commande": list(commande.produit_commande.select_related('produit').order_by('id')),
+        "qr_code": qrcode(detail_url),
+        "logo": logo_url,
+    }
+
+
+def nom_fichier(empreinte):
+    return '%s/%s.pdf' % (DOSSIER, empreinte)
+
+
+def a_jour(commande, empreinte):
+    """Vrai si le reçu enregistré correspond à l'empreinte et que son fichier existe."""
+    fichier = commande.recu_paiement
+    return bool(fichier) and fichier.name == nom_fichier(empreinte) and fichier.storage.exists(fichier.name)
+
+
+def enregistrer(commande, empreinte, pdf):
+    """Enregistre le PDF du reçu sous son empreinte et supprime le précédent."""
+    fichier = commande.recu_paiement
+    ancien = fichier.name
+    nom = nom_fichier(empreinte)
+    if not fichier.storage.exists(nom):
+        nom = fichier.storage.save(nom, ContentFile(pdf))
+    # update() : un enregistrement complet écraserait les champs modifiés entre-temps (statut de paiement)
+    Commande.objects.filter(id=commande.id).update(recu_paiement=nom)
+    fichier.name = nom
+    if ancien and ancien != nom:
+        fichier.storage.delete(ancien)
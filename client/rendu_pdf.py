@@ -0,0 +1,254 @@
+"""
+Service de rendu des reçus PDF.
+
+Lancer Chromium coûte plusieurs centaines de millisecondes et autant de mémoire
+à chaque téléchargement ; le service, lancé à part (commande service_rendu_pdf),
+garde un navigateur ouvert et un pool de PAGES pages chaudes, chacune dans son
+propre contexte. Les vues lui soumettent le HTML du reçu avec rendre() et
+reçoivent le PDF.
+
+Au plus PAGES rendus sont faits en même temps ; au-delà, les demandes attendent
+une page libre, et le service refuse aussitôt celles qui dépasseraient FILE
+demandes en attente. Chaque demande dispose de TIMEOUT secondes, attente
+comprise ; une page dont le rendu a échoué ou expiré est remplacée.
+
+Protocole (TCP local) : chaque message est précédé de sa longueur sur 4 octets.
+La demande est un JSON {'html': ...} ; la réponse un JSON {'success', 'message'},
+suivi du PDF quand success est vrai.
+"""
+import asyncio
+import json
+import socket
+import struct
+import threading
+import time
+
+from django.conf import settings
+from playwright.async_api import async_playwright
+
+
+OPTIONS_PDF = {
+    'format': 'A4',
+    'print_background': True,
+    'margin': {'top': '10mm', 'right': '10mm', 'bottom': '10mm', 'left': '10mm'},
+}
+
+# Une page est remplacée après ce nombre de rendus (mémoire retenue par Chromium)
+RENDUS_PAR_PAGE = 200
+
+# Marge laissée au service pour répondre après son propre timeout
+MARGE_CLIENT = 5
+
+_ENTETE = struct.Struct('>I')
+
+
+class ErreurRendu(Exception):
+    """Rendu refusé, expiré ou service injoignable."""
+
+
+class MoteurChromium:
+    """Chromium headless (Playwright) : un navigateur, une page par contexte."""
+
+    async def demarrer(self):
+        self._playwright = await async_playwright().start()
+        self._navigateur = await self._playwright.chromium.launch()
+
+    async def ouvrir(self):
+        if not self._navigateur.is_connected():
+            # Navigateur tombé : on le relance plutôt que d'échouer tous les rendus suivants
+            self._navigateur = await self._playwright.chromium.launch()
+        contexte = await self._navigateur.new_context()
+        return await contexte.new_page()
+
+    async def rendre(self, page, html):
+        await page.set_content(html, wait_until='load')
+        return await page.pdf(**OPTIONS_PDF)
+
+    async def fermer(self, page):
+        try:
+            await page.context.close()
+        except Exception:
+            pass
+
+    async def arreter(self):
+        await self._navigateur.close()
+        await self._playwright.stop()
+
+
+class _Page:
+    def __init__(self, page):
+        self.page = page
+        self.rendus = 0
+
+
+class ServiceRendu:
+    """Service de rendu ; demarrer() le lance dans un thread (tests, mesures), servir() bloque (commande)."""
+
+    def __init__(self, hote='127.0.0.1', port=0, pages=4, file=32, timeout=15, moteur=MoteurChromium):
+        self.hote = hote
+        self.port = port
+        self.pages = pages
+        self.file = file
+        self.timeout = timeout
+        self.moteur = moteur()
+        # Demandes acceptées, en attente d'une page ou en cours de rendu
+        self.en_cours = 0
+        self._libres = None
+        self._boucle = None
+        self._serveur = None
+        self._pret = threading.Event()
+        self._thread = None
+        self._erreur = None
+
+    @property
+    def config(self):
+        """Configuration client, à mettre dans settings.RENDU_PDF."""
+        return {'HOTE': self.hote, 'PORT': self.port, 'TIMEOUT': self.timeout}
+
+    async def _demarrer(self):
+        await self.moteur.demarrer()
+        self._libres = asyncio.Queue()
+        for _ in range(self.pages):
+            self._libres.put_nowait(_Page(await self.moteur.ouvrir()))
+        self._serveur = await asyncio.start_server(self._servir_client, self.hote, self.port)
+        self.port = self._serveur.sockets[0].getsockname()[1]
+
+    async def _arreter(self):
+        self._serveur.close()
+        await self._serveur.wait_closed()
+        while not self._libres.empty():
+            await self.moteur.fermer(self._libres.get_nowait().page)
+        await self.moteur.arreter()
+
+    async def _servir_client(self, lecteur, ecrivain):
+        try:
+            while True:
+                try:
+                    demande = json.loads(await _lire(lecteur))
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except ValueError:
+                    await _ecrire(ecrivain, {'success': False, 'message': "Demande invalide"})
+                    break
+                try:
+                    pdf = await self._rendre(demande.get('html') or '')
+                except ErreurRendu as e:
+                    await _ecrire(ecrivain, {'success': False, 'message': str(e)})
+                else:
+                    await _ecrire(ecrivain, {'success': True, 'message': ''}, pdf)
+        except ConnectionError:
+            pass
+        finally:
+            ecrivain.close()
+
+    async def _rendre(self, html):
+        if self.en_cours >= self.pages + self.file:
+            raise ErreurRendu("Le service de rendu est saturé, merci de réessayer")
+        self.en_cours += 1
+        fin = time.monotonic() + self.timeout
+        try:
+            try:
+                page = await asyncio.wait_for(self._libres.get(), self.timeout)
+            except asyncio.TimeoutError:
+                raise ErreurRendu("Le reçu n'a pas pu être généré à temps")
+            remplacer = False
+            try:
+                pdf = await asyncio.wait_for(self.moteur.rendre(page.page, html), max(fin - time.monotonic(), 0))
+                page.rendus += 1
+                remplacer = page.rendus >= RENDUS_PAR_PAGE
+                return pdf
+            except asyncio.TimeoutError:
+                remplacer = True
+                raise ErreurRendu("Le reçu n'a pas pu être généré à temps")
+            except Exception:
+                remplacer = True
+                raise ErreurRendu("Le reçu n'a pas pu être généré")
+            finally:
+                if remplacer:
+                    page = await self._remplacer(page)
+                self._libres.put_nowait(page)
+        finally:
+            self.en_cours -= 1
+
+    async def _remplacer(self, page):
+        await self.moteur.fermer(page.page)
+        try:
+            return _Page(await self.moteur.ouvrir())
+        except Exception:
+            # Réessayé au prochain échec ; la page, même hors d'usage, garde sa place dans le pool
+            return page
+
+    def _executer(self):
+        self._boucle = asyncio.new_event_loop()
+        try:
+            self._boucle.run_until_complete(self._demarrer())
+        except Exception as e:
+            self._erreur = e
+            return
+        finally:
+            self._pret.set()
+        try:
+            self._boucle.run_forever()
+        finally:
+            self._boucle.run_until_complete(self._arreter())
+            self._boucle.close()
+
+    def demarrer(self):
+        self._thread = threading.Thread(target=self._executer, daemon=True)
+        self._thread.start()
+        self._pret.wait()
+        if self._serveur is None:
+            raise ErreurRendu("Le service de rendu n'a pas démarré : %s" % str(self._erreur).strip().split('\n')[0])
+        return self
+
+    def servir(self):
+        self._executer()
+        if self._erreur is not None:
+            raise self._erreur
+
+    def arreter(self):
+        self._boucle.call_soon_threadsafe(self._boucle.stop)
+        if self._thread is not None:
+            self._thread.join()
+
+
+async def _lire(lecteur):
+    longueur, = _ENTETE.unpack(await lecteur.readexactly(_ENTETE.size))
+    return await lecteur.readexactly(longueur)
+
+
+async def _ecrire(ecrivain, entete, corps=None):
+    for message in (json.dumps(entete).encode('utf-8'), corps):
+        if message is not None:
+            ecrivain.write(_ENTETE.pack(len(message)) + message)
+    await ecrivain.drain()
+
+
+def _recevoir(connexion):
+    def lire(taille):
+        morceaux = []
+        while taille:
+            morceau = connexion.recv(min(taille, 1 << 20))
+            if not morceau:
+                raise ConnectionError("Connexion fermée par le service de rendu")
+            morceaux.append(morceau)
+            taille -= len(morceau)
+        return b''.join(morceaux)
+    longueur, = _ENTETE.unpack(lire(_ENTETE.size))
+    return lire(longueur)
+
+
+def rendre(html, config=None):
+    """Fait rendre le HTML en PDF par le service ; retourne les octets du PDF ou lève ErreurRendu."""
+    config = config or settings.RENDU_PDF
+    demande = json.dumps({'html': html}).encode('utf-8')
+    try:
+        with socket.create_connection((config['HOTE'], config['PORT']), timeout=config['TIMEOUT'] + MARGE_CLIENT) as connexion:
+            connexion.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            connexion.sendall(_ENTETE.pack(len(demande)) + demande)
+            reponse = json.loads(_recevoir(connexion))
+            if not reponse['success']:
+                raise ErreurRendu(reponse['message'])
+            return _recevoir(connexion)
+    except OSError:
+        raise ErreurRendu("Le service de rendu des reçus est injoignable, merci de réessayer")
@@ -2,10 +2,18 @@ from django.test import TestCase, Client
 from django.contrib.auth.models import User
 from django.urls import reverse
 from shop.models import CategorieEtablissement, CategorieProduit, Etablissement, Produit
-from customer.models import Customer, Commande
+from customer.models import Customer, Commande, ProduitPanier
 from website.models import SiteInfo
 from unittest.mock import patch
+from concurrent.futures import ThreadPoolExecutor
+from client import moteurs_pdf, recus, rendu_pdf
+from django.core.cache import cache
+from django.conf import settings
+from io import BytesIO
+from pypdf import PdfReader
+import asyncio
 import datetime
+import time
 
 from django.core.files.uploadedfile import SimpleUploadedFile
 
@@ -69,14 +77,14 @@ class ClientConsolidatedTest(TestCase):
         response = self.client.get(reverse('profil'))
         self.assertEqual(response.status_code, 302)
 
-    @patch('client.views.sync_playwright')
-    @patch('client.views.qrcode_base64')
+    @patch('client.rendu_pdf.rendre')
+    @patch('client.recus.qrcode_base64')
     @patch('website.models.SiteInfo.objects.latest')
-    def test_invoice_pdf_generation(self, mock_latest, mock_qrcode, mock_playwright):
+    def test_invoice_pdf_generation(self, mock_latest, mock_qrcode, mock_rendre):
         """Génération simulée d'un reçu PDF"""
         mock_latest.return_value.logo.url = '/media/logo.png'
         mock_qrcode.return_value = 'fake_base64'
-        mock_playwright.return_value.__enter__.return_value.chromium.launch.return_value.new_page.return_value.pdf.return_value = b'fake-pdf'
+        mock_rendre.return_value = b'fake-pdf'
         
         self.client.login(username="client1", password="password123")
         response = self.client.get(reverse('invoice_pdf', args=[self.commande.id]))
@@ -104,3 +112,220 @@ class ClientConsolidatedTest(TestCase):
         
         with self.assertRaises(ValueError):
             Produit.objects.create(nom="Err", prix=1, quantite=-1, categorie=cp, etablissement=etab)
+
+
+class MoteurFactice:
+    """Moteur de rendu sans navigateur : 'lent' dans le HTML fait durer le rendu."""
+
+    def __init__(self):
+        self.ouvertures = 0
+        self.simultanes = 0
+        self.max_simultanes = 0
+
+    async def demarrer(self):
+        pass
+
+    async def ouvrir(self):
+        self.ouvertures += 1
+        return self.ouvertures
+
+    async def rendre(self, page, html):
+        self.simultanes += 1
+        self.max_simultanes = max(self.max_simultanes, self.simultanes)
+        try:
+            await asyncio.sleep(0.5 if 'lent' in html else 0.02)
+            if 'erreur' in html:
+                raise RuntimeError(html)
+            return b'%PDF-' + html.encode('utf-8')
+        finally:
+            self.simultanes -= 1
+
+    async def fermer(self, page):
+        pass
+
+    async def arreter(self):
+        pass
+
+
+class ClientRenduPdfTest(TestCase):
+    """Service de rendu des reçus : pool de pages, file bornée, timeouts"""
+
+    def _service(self, **options):
+        service = rendu_pdf.ServiceRendu(moteur=MoteurFactice, **options).demarrer()
+        self.addCleanup(service.arreter)
+        return service
+
+    def test_rendu_par_le_service(self):
+        """Le PDF rendu par le service est renvoyé au client"""
+        service = self._service(pages=2)
+        self.assertEqual(rendu_pdf.rendre('<p>Reçu</p>', service.config), '%PDF-<p>Reçu</p>'.encode('utf-8'))
+        self.assertEqual(service.moteur.ouvertures, 2)
+
+    def test_concurrence_bornee(self):
+        """Jamais plus de rendus simultanés que de pages chaudes"""
+        service = self._service(pages=2)
+        with ThreadPoolExecutor(6) as executeur:
+            pdfs = list(executeur.map(lambda i: rendu_pdf.rendre('recu %d' % i, service.config), range(12)))
+        self.assertEqual(len(pdfs), 12)
+        self.assertEqual(service.moteur.max_simultanes, 2)
+
+    def test_service_sature(self):
+        """Au-delà des pages et de la file, le service refuse aussitôt"""
+        service = self._service(pages=1, file=0)
+        with ThreadPoolExecutor(1) as executeur:
+            en_cours = executeur.submit(rendu_pdf.rendre, 'lent', service.config)
+            time.sleep(0.1)
+            with self.assertRaisesMessage(rendu_pdf.ErreurRendu, "saturé"):
+                rendu_pdf.rendre('rapide', service.config)
+            self.assertTrue(en_cours.result().startswith(b'%PDF-'))
+
+    def test_timeout_et_remplacement_de_page(self):
+        """Un rendu trop long expire et sa page est remplacée ; le service continue de rendre"""
+        service = self._service(pages=1, timeout=0.2)
+        with self.assertRaisesMessage(rendu_pdf.ErreurRendu, "à temps"):
+            rendu_pdf.rendre('lent', service.config)
+        with self.assertRaisesMessage(rendu_pdf.ErreurRendu, "n'a pas pu être généré"):
+            rendu_pdf.rendre('erreur', service.config)
+        self.assertEqual(service.moteur.ouvertures, 3)
+        self.assertEqual(rendu_pdf.rendre('ok', service.config), b'%PDF-ok')
+
+    @patch('client.recus.qrcode_base64')
+    @patch('website.models.SiteInfo.objects.latest')
+    def test_service_injoignable(self, mock_latest, mock_qrcode):
+        """Service arrêté : la vue répond 503 au lieu de lancer un navigateur"""
+        mock_latest.return_value.logo.url = '/media/logo.png'
+        mock_qrcode.return_value = 'fake_base64'
+        service = rendu_pdf.ServiceRendu(moteur=MoteurFactice).demarrer()
+        service.arreter()
+        user = User.objects.create_user(username="client-recu", password="password123")
+        commande = Commande.objects.create(customer=Customer.objects.create(user=user, adresse="A", contact_1="0"), prix_total=100)
+
+        self.client.login(username="client-recu", password="password123")
+        with self.settings(RENDU_PDF=dict(settings.RENDU_PDF, **service.config)):
+            response = self.client.get(reverse('invoice_pdf', args=[commande.id]))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '5')
+
+
+@patch('client.rendu_pdf.rendre', side_effect=lambda html: b'%PDF-' + str(len(html)).encode())
+class ClientRecuTest(TestCase):
+    """Reçus rendus une fois, enregistrés sous leur empreinte et régénérés quand leur contenu change"""
+
+    def setUp(self):
+        cache.clear()
+        self.site = SiteInfo.objects.create(
+            titre="CoolDeal", slogan="S", description="D", horaire_description="D",
+            text_pourquoi_nous_choisir="D", contact_1="1", contact_2="2", email="t@t.com",
+            adresse="A", map_url="h", facebook_url="h", instagram_url="h", twitter_url="h", whatsapp="h"
+        )
+        owner = User.objects.create_user(username="vendeur-recu", password="p")
+        cat = CategorieEtablissement.objects.create(nom="C", description="D")
+        cp = CategorieProduit.objects.create(nom="P", description="D", categorie=cat)
+        etab = Etablissement.objects.create(
+            user=owner, nom="E", description="D", categorie=cat, nom_du_responsable="R", prenoms_duresponsable="R",
+            adresse="A", pays="CI", contact_1="0", email="e@e.com",
+        )
+        self.produit = Produit.objects.create(nom="Mangue", prix=500, quantite=10, categorie=cp, etablissement=etab)
+
+        self.user = User.objects.create_user(username="client-recu", password="password123")
+        customer = Customer.objects.create(user=self.user, adresse="A", contact_1="0")
+        self.commande = Commande.objects.create(customer=customer, prix_total=1000, transaction_id="recu-1")
+        self.ligne = ProduitPanier.objects.create(produit=self.produit, commande=self.commande, quantite=2)
+        self.client.login(username="client-recu", password="password123")
+
+    def _telecharger(self):
+        response = self.client.get(reverse('invoice_pdf', args=[self.commande.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        contenu = b''.join(response.streaming_content)
+        response.close()
+        self.commande.refresh_from_db()
+        self.addCleanup(self.commande.recu_paiement.storage.delete, self.commande.recu_paiement.name)
+        return contenu
+
+    def test_recu_rendu_une_seule_fois(self, mock_rendre):
+        """Le second téléchargement sert le fichier enregistré sans nouveau rendu"""
+        premier = self._telecharger()
+        self.assertEqual(self._telecharger(), premier)
+        self.assertEqual(mock_rendre.call_count, 1)
+        self.assertTrue(self.commande.recu_paiement.name.startswith(recus.DOSSIER + '/'))
+
+    def test_regenere_si_ligne_modifiee(self, mock_rendre):
+        """Modifier une ligne change l'empreinte : nouveau rendu, ancien fichier supprimé"""
+        self._telecharger()
+        ancien = self.commande.recu_paiement.name
+        ProduitPanier.objects.filter(id=self.ligne.id).update(quantite=3)
+        self._telecharger()
+        self.assertEqual(mock_rendre.call_count, 2)
+        self.assertNotEqual(self.commande.recu_paiement.name, ancien)
+        self.assertFalse(self.commande.recu_paiement.storage.exists(ancien))
+
+    def test_regenere_si_logo_modifie(self, mock_rendre):
+        """Changer le logo du site régénère le reçu"""
+        self._telecharger()
+        SiteInfo.objects.filter(id=self.site.id).update(logo='site/info/nouveau.png')
+        self._telecharger()
+        self.assertEqual(mock_rendre.call_count, 2)
+
+    def test_qrcode_en_cache(self, mock_rendre):
+        """Le QR code d'une URL n'est généré qu'une fois"""
+        with patch('client.recus.qrcode_base64', return_value='qr') as mock_qrcode:
+            self.assertEqual(recus.qrcode('http://testserver/recu/1/'), 'qr')
+            self.assertEqual(recus.qrcode('http://testserver/recu/1/'), 'qr')
+        self.assertEqual(mock_qrcode.call_count, 1)
+
+
+class ClientMoteursPdfTest(TestCase):
+    """Moteurs de rendu des reçus choisis par settings.RENDU_PDF['MOTEUR']"""
+
+    def setUp(self):
+        cache.clear()
+        self.site = SiteInfo.objects.create(
+            titre="CoolDeal", slogan="S", description="D", horaire_description="D",
+            text_pourquoi_nous_choisir="D", contact_1="1", contact_2="2", email="t@t.com",
+            adresse="A", map_url="h", facebook_url="h", instagram_url="h", twitter_url="h", whatsapp="h"
+        )
+        owner = User.objects.create_user(username="vendeur-moteurs", password="p")
+        cat = CategorieEtablissement.objects.create(nom="C", description="D")
+        cp = CategorieProduit.objects.create(nom="P", description="D", categorie=cat)
+        etab = Etablissement.objects.create(
+            user=owner, nom="E", description="D", categorie=cat, nom_du_responsable="R", prenoms_duresponsable="R",
+            adresse="A", pays="CI", contact_1="0", email="e@e.com",
+        )
+        produit = Produit.objects.create(nom="Ananas & Co", prix=750, quantite=10, categorie=cp, etablissement=etab)
+        self.user = User.objects.create_user(username="client-moteurs", password="password123")
+        customer = Customer.objects.create(user=self.user, adresse="A", contact_1="0")
+        self.commande = Commande.objects.create(customer=customer, prix_total=1500, transaction_id="moteurs-1")
+        ProduitPanier.objects.create(produit=produit, commande=self.commande, quantite=2)
+
+    def _texte(self, pdf):
+        self.assertTrue(pdf.startswith(b'%PDF-'))
+        return ''.join(page.extract_text() for page in PdfReader(BytesIO(pdf)).pages)
+
+    def test_moteurs_python(self):
+        """xhtml2pdf et reportlab rendent le contenu du reçu sans navigateur"""
+        contexte = recus.contexte(self.commande, 'http://testserver/recu/1/', '')
+        for nom in ('xhtml2pdf', 'reportlab'):
+            with self.subTest(moteur=nom):
+                texte = self._texte(moteurs_pdf.moteur(nom).rendre(contexte))
+                self.assertIn("moteurs-1", texte)
+                self.assertIn("Ananas & Co", texte)
+                self.assertIn("1500 F CFA", texte)
+
+    def test_moteur_choisi_par_settings(self):
+        """Le moteur vient des settings ; un nom inconnu est refusé"""
+        with self.settings(RENDU_PDF=dict(settings.RENDU_PDF, MOTEUR='reportlab')):
+            self.assertIsInstance(moteurs_pdf.moteur(), moteurs_pdf.MoteurReportlab)
+        with self.assertRaises(ValueError):
+            moteurs_pdf.moteur('inconnu')
+
+    def test_telechargement_avec_reportlab(self):
+        """La vue rend le reçu avec le moteur configuré, sans service de rendu"""
+        self.client.login(username="client-moteurs", password="password123")
+        with self.settings(RENDU_PDF=dict(settings.RENDU_PDF, MOTEUR='reportlab')):
+            response = self.client.get(reverse('invoice_pdf', args=[self.commande.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("moteurs-1", self._texte(b''.join(response.streaming_content)))
+        response.close()
+        self.commande.refresh_from_db()
+        self.addCleanup(self.commande.recu_paiement.storage.delete, self.commande.recu_paiement.name)
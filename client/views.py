@@ -6,13 +6,11 @@ from shop.models import  Favorite, Produit
 from django.core.paginator import Paginator
 from django.db.models import Q
 from cities_light.models import City
-from django.template.loader import render_to_string
-from django.http import HttpResponse
+from django.http import FileResponse, HttpResponse
 from .utils import render_to_pdf
-from .utils import qrcode_base64
+from . import moteurs_pdf, recus
 from website.models import SiteInfo
 import qrcode
-from playwright.sync_api import sync_playwright
 import base64
 from io import BytesIO
 
@@ -215,38 +213,28 @@ def invoice_pdf(request, order_id):
     if not hasattr(request.user, "customer") or order.customer_id != request.user.customer.id:
         return redirect("commande")
 
-    # 1. Générer le QR code en base64
-
     detail_url = request.build_absolute_uri(
         reverse("commande-reçu-detail", args=[order.id])  # ou une URL publique de vérif
     )
-    qr_b64 = qrcode_base64(detail_url)
-
-    # 2. Construire le HTML à partir du template
-    html = render_to_string("receipt.html", {
-        "order_id": order,
-        "produits_commande": order.produit_commande.all(),
-        "qr_code": qr_b64,
-        "logo": request.build_absolute_uri(SiteInfo.objects.latest('date_add').logo.url)
-    }, request=request)
-
-    # 3. Lancer Playwright et générer le PDF
-    with sync_playwright() as p:
-        browser = p.chromium.launch()
-        page = browser.new_page()
-        page.set_content(html, wait_until="load")  # on imprime directement le HTML rendu
-        pdf_bytes = page.pdf(
-            format="A4",
-            print_background=True,
-            margin={"top": "10mm", "right": "10mm", "bottom": "10mm", "left": "10mm"}
-        )
-        browser.close()
-
-    # 4. Forcer le téléchargement du PDF
-    filename = f"Recu_{order.transaction_id}.pdf"
-    response = HttpResponse(pdf_bytes, content_type="application/pdf")
-    response["Content-Disposition"] = f'attachment; filename="{filename}"'
-    return response
+    logo_url = request.build_absolute_uri(SiteInfo.objects.latest('date_add').logo.url)
+
+    # 1. Reçu déjà rendu et toujours à jour : on sert le fichier enregistré
+    empreinte = recus.empreinte(order, detail_url, logo_url)
+    if not recus.a_jour(order, empreinte):
+        # 2. Rendre le PDF avec le moteur configuré (settings.RENDU_PDF['MOTEUR'])
+        try:
+            pdf_bytes = moteurs_pdf.moteur().rendre(recus.contexte(order, detail_url, logo_url))
+        except moteurs_pdf.ErreurRendu as e:
+            response = HttpResponse(str(e), status=503, content_type="text/plain; charset=utf-8")
+            response["Retry-After"] = "5"
+            return response
+        recus.enregistrer(order, empreinte, pdf_bytes)
+
+    # 3. Forcer le téléchargement du PDF
+    return FileResponse(
+        order.recu_paiement.open('rb'), as_attachment=True,
+        filename=f"Recu_{order.transaction_id}.pdf", content_type="application/pdf",
+    )
 
 #
 # @login_required
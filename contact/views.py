@@ -6,6 +6,8 @@ from django.contrib.auth import authenticate, login as login_request, logout
 import json
 from django.http import JsonResponse
 from django.contrib.auth.models import User
+from django.conf import settings
+from base import taches
 
 
 # Create your views here.
@@ -37,6 +39,12 @@ def post_contact(request):
         contact.sujet = sujet
         contact.message = messages
         contact.save()
+        # Prévient l'équipe sans faire attendre le visiteur (base.taches)
+        taches.differer_email(
+            f"Nouveau message de contact : {sujet}",
+            f"{nom} <{email}> a écrit :\n\n{messages}",
+            [settings.CONTACT_EMAIL],
+        )
         isSuccess = True
         message = "Merci pour votre message"
     else:
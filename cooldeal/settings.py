@@ -95,10 +95,66 @@ MIDDLEWARE = [
 
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedStaticFilesStorage'
 
+# Cache partagé entre les workers gunicorn en production, en mémoire sinon
+if os.environ.get('ENV') == 'PRODUCTION':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': BASE_DIR / 'cache',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
 CRON_CLASSES = [
+    "base.cron.TraiterTachesCronJob",
     "customer.cron.CleanExpiredTokensCronJob",
+    "customer.cron.NettoyerPaniersCronJob",
+    "customer.cron.PurgerReponsesIdempotentesCronJob",
+    "shop.cron.BasculerPromotionsCronJob",
+    "shop.cron.RecalculerFacettesCronJob",
+    "shop.cron.CalculerSimilairesCronJob",
+    "shop.cron.LibererReservationsCronJob",
+    "shop.cron.TraiterNotificationsCronJob",
 ]
 
+# Passerelle de paiement (shop.paiement) ; hors production, le serveur factice :
+# python manage.py serveur_paiement_factice
+CINETPAY = {
+    'URL': os.environ.get(
+        'CINETPAY_URL',
+        'https://api-checkout.cinetpay.com/v2' if os.environ.get('ENV') == 'PRODUCTION' else 'http://127.0.0.1:8001/v2',
+    ),
+    'APIKEY': os.environ.get('CINETPAY_APIKEY', ''),
+    'SITE_ID': os.environ.get('CINETPAY_SITE_ID', ''),
+    # Secondes ; la lecture borne le temps qu'un worker peut passer à attendre le fournisseur
+    'TIMEOUT_CONNEXION': 3.05,
+    'TIMEOUT_LECTURE': 10,
+    'TENTATIVES': 2,
+    'CONNEXIONS': 10,
+    'SEUIL_DISJONCTEUR': 5,
+    'DELAI_DISJONCTEUR': 30,
+}
+
+# Rendu des reçus PDF (client.moteurs_pdf) : 'playwright' (service lancé par
+# python manage.py service_rendu_pdf), 'xhtml2pdf' ou 'reportlab'
+RENDU_PDF = {
+    'MOTEUR': os.environ.get('RENDU_PDF_MOTEUR', 'playwright'),
+    'HOTE': os.environ.get('RENDU_PDF_HOTE', '127.0.0.1'),
+    'PORT': int(os.environ.get('RENDU_PDF_PORT', 8002)),
+    # Rendus simultanés (pages Chromium chaudes) et demandes en attente au-delà desquelles le service refuse
+    'PAGES': 4,
+    'FILE': 32,
+    # Secondes par reçu, attente d'une page libre comprise
+    'TIMEOUT': 15,
+    # Processus de rendu des exports de reçus (shop.export_recus)
+    'PROCESSUS': 2,
+}
+
 
 REST_FRAMEWORK = {
     # Use Django's standard `django.contrib.auth` permissions,
@@ -127,10 +183,10 @@ TEMPLATES = [
                 'django.contrib.messages.context_processors.messages',
                 'website.context_processors.categories',
                 'website.context_processors.site_infos',
-                'website.context_processors.cities',
                 'website.context_processors.cart',
                 'website.context_processors.galeries',
                 'website.context_processors.horaires',
+                'website.context_processors.versions_cache',
             ],
         },
     },
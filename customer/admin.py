@@ -71,6 +71,8 @@ class PanierAdmin(admin.ModelAdmin):
         'customer',
         'date_add',
         'coupon',
+        'nb_articles',
+        'total_remise',
         'date_update',
         'status',
     )
@@ -0,0 +1,91 @@
+"""
+Validation des commandes.
+
+passer_commande() transforme un panier en commande dans une seule transaction,
+en un nombre fixe de requêtes quel que soit le nombre de lignes : total calculé
+en SQL, stock décrémenté par un UPDATE conditionnel, lignes rattachées à la
+commande par un UPDATE en masse. enregistrer_paiement() applique ensuite l'issue
+du paiement notifiée par le fournisseur.
+"""
+from django.db import transaction
+from django.db.models import Count, F, FloatField, OuterRef, Q, Subquery, Sum
+
+from shop import models as shop_models
+from shop import reservations
+
+from . import models
+
+
+def passer_commande(panier_id, customer, montant=None, **champs):
+    """
+    Crée la commande du panier panier_id du client et vide le panier.
+
+    champs renseigne la Commande (transaction_id, payment_url...). montant est
+    celui annoncé au fournisseur de paiement : la commande est refusée si le
+    total a changé depuis. Lève ValueError (panier introuvable ou vide, stock
+    insuffisant, montant changé) : rien n'est alors modifié.
+    """
+    with transaction.atomic():
+        panier = (
+            models.Panier.objects.select_for_update().select_related('coupon')
+            .filter(id=panier_id, customer=customer).first()
+        )
+        if panier is None:
+            raise ValueError("Panier introuvable")
+        lignes = models.ProduitPanier.objects.filter(panier=panier)
+        resume = lignes.aggregate(
+            nombre=Count('id'),
+            sous_total=Sum(F('produit__prix_effectif') * F('quantite'), output_field=FloatField()),
+        )
+        if not resume['nombre']:
+            raise ValueError("Panier vide")
+        prix_total = panier.appliquer_coupon(resume['sous_total'] or 0)
+        if montant is not None and round(prix_total) != round(montant):
+            raise ValueError("Le montant du panier a changé, merci de réessayer")
+
+        # Un seul UPDATE pour tous les produits ; un produit sans stock suffisant
+        # (stock moins ce que retiennent les autres paniers) n'est pas mis à jour,
+        # ce qui se voit au nombre de lignes modifiées
+        quantite_commandee = Subquery(lignes.filter(produit_id=OuterRef('pk')).values('quantite')[:1])
+        decrementes = shop_models.Produit.objects.filter(
+            Q(quantite__isnull=True)
+            | Q(quantite__gte=quantite_commandee + reservations.retenu_ailleurs(panier)),
+            id__in=lignes.values('produit_id'), status=True,
+        ).update(quantite=F('quantite') - quantite_commandee)
+        if decrementes != resume['nombre']:
+            # L'exception annule la transaction, donc les décréments déjà faits
+            raise ValueError("Stock insuffisant")
+
+        commande = models.Commande.objects.create(customer=customer, prix_total=prix_total, **champs)
+        lignes.update(panier=None, commande=commande)
+        # Supprime aussi ses réservations : le stock est désormais décrémenté
+        panier.delete()
+    return commande
+
+
+def enregistrer_paiement(transaction_id, accepte):
+    """
+    Passe la commande en attente de transaction_id à payée, ou à refusée.
+
+    Un paiement refusé rend au stock les quantités commandées. Retourne la
+    commande, ou None si aucune commande de cette transaction n'attend son
+    paiement (notification déjà appliquée).
+    """
+    with transaction.atomic():
+        commande = (
+            models.Commande.objects.select_for_update()
+            .filter(transaction_id=transaction_id, statut_paiement=models.Commande.EN_ATTENTE).first()
+        )
+        if commande is None:
+            return None
+        if accepte:
+            commande.statut_paiement = models.Commande.PAYEE
+        else:
+            lignes = models.ProduitPanier.objects.filter(commande=commande)
+            quantite_commandee = Subquery(lignes.filter(produit_id=OuterRef('pk')).values('quantite')[:1])
+            shop_models.Produit.objects.filter(
+                id__in=lignes.values('produit_id'), quantite__isnull=False,
+            ).update(quantite=F('quantite') + quantite_commandee)
+            commande.statut_paiement = models.Commande.REFUSEE
+        commande.save(update_fields=['statut_paiement', 'date_update'])
+    return commande
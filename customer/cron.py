@@ -1,5 +1,6 @@
 from django_cron import CronJobBase, Schedule
 from customer.models import PasswordResetToken
+from customer import idempotence, panier
 from django.utils.timezone import now
 from datetime import timedelta
 
@@ -15,3 +16,26 @@ class CleanExpiredTokensCronJob(CronJobBase):
         count = expired_tokens.count()
         expired_tokens.delete()
         print(f"{count} tokens expirés supprimés.")
+
+
+class NettoyerPaniersCronJob(CronJobBase):
+    # Les paniers anonymes perdent leur session à son expiration (clearsessions)
+    RUN_AT_TIMES = ['03:00']
+
+    schedule = Schedule(run_at_times=RUN_AT_TIMES)
+    code = 'customer.nettoyer_paniers'
+
+    def do(self):
+        orphelins = panier.supprimer_paniers_orphelins()
+        print(f"{orphelins} paniers orphelins supprimés.")
+
+
+class PurgerReponsesIdempotentesCronJob(CronJobBase):
+    RUN_EVERY_MINS = 60
+
+    schedule = Schedule(run_every_mins=RUN_EVERY_MINS)
+    code = 'customer.purger_reponses_idempotentes'
+
+    def do(self):
+        supprimees = idempotence.purger_expirees()
+        print(f"{supprimees} réponses idempotentes expirées supprimées.")
@@ -0,0 +1,142 @@
+"""
+Requêtes rejouables sans effet en double.
+
+Un client qui renvoie la même requête de paiement (réseau lent, double clic)
+reçoit la réponse enregistrée la première fois, sans que la commande soit
+repassée. La clé est l'en-tête Idempotency-Key, ou à défaut le transaction_id ;
+les réponses sont conservées DUREE_CONSERVATION puis purgées par lots.
+"""
+import datetime
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from . import models
+
+
+DUREE_CONSERVATION = datetime.timedelta(hours=24)
+
+# Réponses expirées supprimées par transaction
+TAILLE_LOT = 1000
+
+LONGUEUR_CLE = 100
+
+
+# Clé réservée par une requête dont la réponse n'est pas encore connue
+EN_COURS = {}
+
+# Au-delà, une réservation sans réponse (processus interrompu) est abandonnée
+DUREE_RESERVATION = datetime.timedelta(minutes=5)
+
+
+class _Echec(Exception):
+    # Annule la transaction d'executer() sans enregistrer la réponse
+    def __init__(self, reponse):
+        super().__init__()
+        self.reponse = reponse
+
+
+def cle(request, transaction_id=None):
+    """Clé d'idempotence de la requête ('' si elle n'en a pas)."""
+    valeur = request.headers.get('Idempotency-Key') or transaction_id or ''
+    return str(valeur).strip()[:LONGUEUR_CLE]
+
+
+def reponse_en_cours():
+    return {'success': False, 'message': "Cette requête est déjà en cours de traitement, merci de patienter"}
+
+
+def reponse_enregistree(customer, cle):
+    """
+    Réponse enregistrée pour (customer, cle), ou None.
+
+    Une clé réservée par une requête encore en cours donne reponse_en_cours() ;
+    une réponse ou une réservation expirée est supprimée.
+    """
+    enregistree = models.ReponseIdempotente.objects.filter(customer=customer, cle=cle).first()
+    if enregistree is None:
+        return None
+    if enregistree.expire_le > timezone.now():
+        return reponse_en_cours() if enregistree.reponse == EN_COURS else enregistree.reponse
+    enregistree.delete()
+    return None
+
+
+def reponse_erreur():
+    return {'success': False, 'message': "Une erreur s'est produite, merci de rééssayer"}
+
+
+def executer(cle, customer, traitement, preparer=None, duree=DUREE_CONSERVATION):
+    """
+    Exécute traitement() une seule fois pour (customer, cle) et retourne sa réponse.
+
+    La clé est d'abord réservée (ligne ReponseIdempotente sans réponse, validée
+    aussitôt) : de deux requêtes identiques, simultanées ou non, une seule va plus
+    loin, l'autre reçoit la réponse enregistrée ou reponse_en_cours(). preparer(),
+    l'appel à un service externe, n'est fait qu'ensuite, hors transaction ; son
+    résultat est passé à traitement. traitement retourne un dict JSON portant
+    'success' et s'exécute dans la transaction qui enregistre la réponse.
+
+    Sans preparer, seules les réponses réussies sont gardées : après un échec la
+    réservation est supprimée et la même clé peut être retentée. Une fois
+    preparer() réussi, l'effet externe a eu lieu : la réponse est gardée même en
+    échec (reponse_erreur() si traitement lève une exception, relancée), et une
+    requête rejouée la reçoit sans rappeler le service. Si preparer() lève, la
+    réservation est supprimée.
+    """
+    if not cle:
+        return traitement(preparer()) if preparer else traitement()
+    enregistree = reponse_enregistree(customer, cle)
+    if enregistree is not None:
+        return enregistree
+    try:
+        with transaction.atomic():
+            reservee = models.ReponseIdempotente.objects.create(
+                customer=customer, cle=cle, reponse=EN_COURS, expire_le=timezone.now() + DUREE_RESERVATION,
+            )
+    except IntegrityError:
+        # Réservée entre-temps par une requête identique
+        return reponse_enregistree(customer, cle) or reponse_en_cours()
+
+    def terminer(reponse):
+        if preparer is None and not reponse.get('success'):
+            reservee.delete()
+        else:
+            models.ReponseIdempotente.objects.filter(id=reservee.id).update(
+                reponse=reponse, expire_le=timezone.now() + duree,
+            )
+        return reponse
+
+    try:
+        arguments = (preparer(),) if preparer else ()
+    except BaseException:
+        reservee.delete()
+        raise
+    try:
+        with transaction.atomic():
+            reponse = traitement(*arguments)
+            if not reponse.get('success'):
+                raise _Echec(reponse)
+            terminer(reponse)
+    except _Echec as echec:
+        return terminer(echec.reponse)
+    except IntegrityError:
+        # Le transaction_id de la commande a déjà été traité sous une autre clé
+        return terminer({'success': False, 'message': "Cette transaction a déjà été traitée"})
+    except BaseException:
+        terminer(reponse_erreur())
+        raise
+    return reponse
+
+
+def purger_expirees(taille_lot=TAILLE_LOT):
+    """Supprime par lots les réponses expirées. Retourne le nombre supprimé."""
+    supprimees = 0
+    while True:
+        ids = list(
+            models.ReponseIdempotente.objects.filter(expire_le__lte=timezone.now())
+            .values_list('id', flat=True)[:taille_lot]
+        )
+        if not ids:
+            return supprimees
+        supprimees += models.ReponseIdempotente.objects.filter(id__in=ids).delete()[0]
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from customer import panier
+
+
+class Command(BaseCommand):
+    help = "Fusionne les paniers d'un même client en son panier canonique et supprime les paniers anonymes orphelins"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lot', type=int, default=panier.TAILLE_LOT, help="Clients traités par transaction")
+
+    def handle(self, *args, **options):
+        fusionnes = panier.regrouper_paniers(taille_lot=options['lot'])
+        orphelins = panier.supprimer_paniers_orphelins()
+        self.stdout.write(self.style.SUCCESS(f"{fusionnes} paniers fusionnés, {orphelins} paniers orphelins supprimés."))
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.9 on 2026-10-18 15:29
+
+from django.db import migrations, models
+from django.db.models import Count, F, Sum
+
+
+def remplir_resumes(apps, schema_editor):
+    Panier = apps.get_model('customer', 'Panier')
+    ProduitPanier = apps.get_model('customer', 'ProduitPanier')
+    for panier in Panier.objects.select_related('coupon'):
+        valeurs = ProduitPanier.objects.filter(panier_id=panier.id).aggregate(
+            nb_articles=Count('id'),
+            sous_total=Sum(F('produit__prix_effectif') * F('quantite'), output_field=models.FloatField()),
+        )
+        sous_total = valeurs['sous_total'] or 0
+        total_remise = sous_total
+        if panier.coupon:
+            total_remise = sous_total - panier.coupon.reduction * sous_total
+        Panier.objects.filter(id=panier.id).update(
+            nb_articles=valeurs['nb_articles'], sous_total=sous_total, total_remise=total_remise,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customer', '0008_customer_ville'),
+        ('shop', '0021_produit_promotion_materialisee'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='panier',
+            name='nb_articles',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='panier',
+            name='sous_total',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='panier',
+            name='total_remise',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.RunPython(remplir_resumes, migrations.RunPython.noop),
+    ]
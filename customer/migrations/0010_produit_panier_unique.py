@@ -0,0 +1,41 @@
+# Generated by Django 4.2.9 on 2026-10-18 15:33
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def fusionner_doublons(apps, schema_editor):
+    # Les doublons créés par des ajouts simultanés sont fusionnés sur la plus ancienne ligne
+    ProduitPanier = apps.get_model('customer', 'ProduitPanier')
+    Panier = apps.get_model('customer', 'Panier')
+    doublons = (
+        ProduitPanier.objects.filter(panier__isnull=False).values('panier_id', 'produit_id')
+        .annotate(nombre=Count('id'), premiere=Min('id'), quantite=Sum('quantite')).filter(nombre__gt=1)
+    )
+    paniers = set()
+    for doublon in doublons:
+        ProduitPanier.objects.filter(id=doublon['premiere']).update(quantite=doublon['quantite'])
+        ProduitPanier.objects.filter(
+            panier_id=doublon['panier_id'], produit_id=doublon['produit_id']
+        ).exclude(id=doublon['premiere']).delete()
+        paniers.add(doublon['panier_id'])
+    # Le nombre de lignes stocké sur le panier a changé
+    for panier_id in paniers:
+        Panier.objects.filter(id=panier_id).update(
+            nb_articles=ProduitPanier.objects.filter(panier_id=panier_id).count()
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customer', '0009_panier_resume'),
+    ]
+
+    operations = [
+        migrations.RunPython(fusionner_doublons, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='produitpanier',
+            constraint=models.UniqueConstraint(condition=models.Q(('panier__isnull', False)), fields=('panier', 'produit'), name='produit_panier_unique'),
+        ),
+    ]
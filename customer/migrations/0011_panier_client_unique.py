@@ -0,0 +1,66 @@
+# Generated by Django 4.2.9 on 2026-10-18 15:36
+
+from django.db import migrations, models
+from django.db.models import Count, F, Sum
+import django.db.models.deletion
+
+
+def regrouper(apps, schema_editor):
+    # Un seul panier par client : le plus récemment modifié reçoit les lignes des autres.
+    # Sur une grosse table, lancer d'abord la commande regrouper_paniers : il ne restera rien à faire ici
+    Panier = apps.get_model('customer', 'Panier')
+    ProduitPanier = apps.get_model('customer', 'ProduitPanier')
+    clients = (
+        Panier.objects.filter(customer__isnull=False).values('customer_id')
+        .annotate(nombre=Count('id')).filter(nombre__gt=1).values_list('customer_id', flat=True)
+    )
+    for customer_id in list(clients):
+        cible, *sources = Panier.objects.filter(customer_id=customer_id).order_by('-date_update', '-id')
+        lignes = {ligne.produit_id: ligne for ligne in ProduitPanier.objects.filter(panier_id=cible.id)}
+        for source in sources:
+            for ligne in ProduitPanier.objects.filter(panier_id=source.id):
+                if ligne.produit_id in lignes:
+                    lignes[ligne.produit_id].quantite += ligne.quantite
+                    lignes[ligne.produit_id].save(update_fields=['quantite'])
+                    ligne.delete()
+                else:
+                    ligne.panier_id = cible.id
+                    ligne.save(update_fields=['panier'])
+                    lignes[ligne.produit_id] = ligne
+            if cible.coupon_id is None and source.coupon_id is not None:
+                cible.coupon_id = source.coupon_id
+                cible.save(update_fields=['coupon'])
+            source.delete()
+
+        valeurs = ProduitPanier.objects.filter(panier_id=cible.id).aggregate(
+            nb_articles=Count('id'),
+            sous_total=Sum(F('produit__prix_effectif') * F('quantite'), output_field=models.FloatField()),
+        )
+        sous_total = valeurs['sous_total'] or 0
+        total_remise = sous_total
+        if cible.coupon_id:
+            total_remise = sous_total - cible.coupon.reduction * sous_total
+        Panier.objects.filter(id=cible.id).update(
+            nb_articles=valeurs['nb_articles'], sous_total=sous_total, total_remise=total_remise,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sessions', '0001_initial'),
+        ('customer', '0010_produit_panier_unique'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='panier',
+            name='session_id',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='session_panier', to='sessions.session'),
+        ),
+        migrations.RunPython(regrouper, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='panier',
+            constraint=models.UniqueConstraint(condition=models.Q(('customer__isnull', False)), fields=('customer',), name='panier_client_unique'),
+        ),
+    ]
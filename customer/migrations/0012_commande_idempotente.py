@@ -0,0 +1,53 @@
+# Generated by Django 4.2.9 on 2026-10-18 15:50
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count, Min
+
+
+def detacher_doublons(apps, schema_editor):
+    # Commandes créées en double par des paiements rejoués : la plus ancienne garde la clé
+    Commande = apps.get_model('customer', 'Commande')
+    Commande.objects.filter(transaction_id='').update(transaction_id=None)
+    doublons = (
+        Commande.objects.filter(transaction_id__isnull=False).values('transaction_id')
+        .annotate(nombre=Count('id'), premiere=Min('id')).filter(nombre__gt=1)
+    )
+    for doublon in doublons:
+        Commande.objects.filter(transaction_id=doublon['transaction_id']).exclude(
+            id=doublon['premiere']
+        ).update(transaction_id=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customer', '0011_panier_client_unique'),
+    ]
+
+    operations = [
+        migrations.RunPython(detacher_doublons, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='commande',
+            name='transaction_id',
+            field=models.CharField(max_length=100, null=True, unique=True),
+        ),
+        migrations.CreateModel(
+            name='ReponseIdempotente',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cle', models.CharField(max_length=100)),
+                ('reponse', models.JSONField(default=dict)),
+                ('expire_le', models.DateTimeField(db_index=True)),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reponses_idempotentes', to='customer.customer')),
+            ],
+            options={
+                'verbose_name': 'Réponse idempotente',
+                'verbose_name_plural': 'Réponses idempotentes',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='reponseidempotente',
+            constraint=models.UniqueConstraint(fields=('customer', 'cle'), name='reponse_idempotente_unique'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.9 on 2026-10-18 16:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customer', '0012_commande_idempotente'),
+    ]
+
+    operations = [
+        # Les commandes existantes ont été validées sans suivi du paiement : on les considère payées
+        migrations.AddField(
+            model_name='commande',
+            name='statut_paiement',
+            field=models.CharField(choices=[('en_attente', 'En attente de paiement'), ('payee', 'Payée'), ('refusee', 'Paiement refusé')], default='payee', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='commande',
+            name='statut_paiement',
+            field=models.CharField(choices=[('en_attente', 'En attente de paiement'), ('payee', 'Payée'), ('refusee', 'Paiement refusé')], default='en_attente', max_length=20),
+        ),
+    ]
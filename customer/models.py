@@ -1,7 +1,8 @@
 from django.db import models
+from django.db.models import Count, F, Sum
+from django.utils.functional import cached_property
 from django.contrib.auth.models import User
 from django.contrib.sessions.models import Session
-from cinetpay_sdk.s_d_k import Cinetpay
 from shop import models as Produit
 from django.utils.timezone import now
 from datetime import timedelta
@@ -69,55 +70,108 @@ class Panier(models.Model):
     """Model definition for Panier."""
 
     # TODO: Define fields here
-    session_id = models.ForeignKey(Session, on_delete=models.CASCADE, related_name="session_panier", null=True , blank=True)
+    # SET_NULL : login() supprime l'ancienne session, le panier anonyme doit lui survivre pour être rattaché
+    session_id = models.ForeignKey(Session, on_delete=models.SET_NULL, related_name="session_panier", null=True , blank=True)
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name="user_panier", null=True , blank=True)
     date_add = models.DateTimeField(auto_now_add=True)
     coupon = models.ForeignKey(CodePromotionnel, on_delete=models.CASCADE, related_name="code_use", null=True , blank=True)
     date_update = models.DateTimeField(auto_now=True)
     status = models.BooleanField(default=True)
+    # Résumé tenu à jour à chaque modification des lignes (customer.signals)
+    nb_articles = models.PositiveIntegerField(default=0, editable=False)
+    sous_total = models.FloatField(default=0, editable=False)
+    total_remise = models.FloatField(default=0, editable=False)
 
     class Meta:
         """Meta definition for Panier."""
         verbose_name = 'Panier'
         verbose_name_plural = 'Paniers'
+        constraints = [
+            # Un seul panier par client, quel que soit le nombre de sessions ou d'appareils
+            models.UniqueConstraint(
+                fields=['customer'], condition=models.Q(customer__isnull=False), name='panier_client_unique',
+            ),
+        ]
 
     def __str__(self):
         """Unicode representation of Panier."""
         return "panier"
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._coupon_enregistre = self.coupon_id
+
+    def save(self, *args, **kwargs):
+        creation = self._state.adding
+        super().save(*args, **kwargs)
+        # Seul le coupon, parmi les champs du panier, entre dans le résumé
+        if not creation and self.coupon_id != self._coupon_enregistre:
+            self.recalculer()
+        self._coupon_enregistre = self.coupon_id
+
+    def appliquer_coupon(self, sous_total):
+        if self.coupon_id:
+            return sous_total - self.coupon.reduction * sous_total
+        return sous_total
+
+    def resume(self):
+        """Nombre de lignes, sous-total et total après coupon, calculés en une requête d'agrégat (pour recalculer())."""
+        valeurs = ProduitPanier.objects.filter(panier_id=self.id).aggregate(
+            nb_articles=Count('id'),
+            sous_total=Sum(F('produit__prix_effectif') * F('quantite'), output_field=models.FloatField()),
+        )
+        sous_total = valeurs['sous_total'] or 0
+        return {
+            'nb_articles': valeurs['nb_articles'],
+            'sous_total': sous_total,
+            'total_remise': self.appliquer_coupon(sous_total),
+        }
+
+    def recalculer(self):
+        """Recalcule et enregistre le résumé sans passer par save()."""
+        resume = self.resume()
+        Panier.objects.filter(id=self.id).update(**resume)
+        for champ, valeur in resume.items():
+            setattr(self, champ, valeur)
+
+    @cached_property
+    def lignes(self):
+        # Un seul queryset par instance : parcouru plusieurs fois, il n'est chargé qu'une fois
+        return self.produit_panier.select_related('produit')
+
+    # Lus sur le résumé stocké : aucune requête
     @property
     def total(self):
-        panier = Panier.objects.get(id=self.id)
-        sum = 0
-        for i in panier.produit_panier.all():
-            sum = sum + i.total
-        return int(sum)
+        return int(self.sous_total)
 
     @property
     def total_with_coupon(self):
-        reduction = 0
-        if self.coupon:
-            reduction = self.coupon.reduction * self.total
-        return int(self.total - reduction)
+        return int(self.total_remise)
 
     @property
     def check_empty(self):
-        panier = Panier.objects.get(id=self.id)
-        if panier.produit_panier.count() > 0:
-            return True
-        else:
-            return False
+        return self.nb_articles > 0
 
 
 class Commande(models.Model):
     """Model definition for UserRessource."""
 
+    EN_ATTENTE, PAYEE, REFUSEE = 'en_attente', 'payee', 'refusee'
+    STATUTS_PAIEMENT = (
+        (EN_ATTENTE, "En attente de paiement"),
+        (PAYEE, "Payée"),
+        (REFUSEE, "Paiement refusé"),
+    )
+
     # TODO: Define fields here
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name="user_commande", null=True)
     id_paiment = models.CharField( max_length=50, null=True)
     payment_token = models.CharField(max_length=250, null=True)
     payment_url = models.TextField(null=True)
-    transaction_id = models.TextField(null=True)
+    # Clé d'idempotence du paiement : une commande au plus par transaction
+    transaction_id = models.CharField(max_length=100, null=True, unique=True)
+    # Mis à jour par les notifications du fournisseur (shop.notifications)
+    statut_paiement = models.CharField(max_length=20, choices=STATUTS_PAIEMENT, default=EN_ATTENTE)
     api_response_id = models.CharField(max_length=50, null=True)
     crypto = models.CharField(max_length=50, null=True)
     prix_total = models.FloatField()
@@ -138,11 +192,25 @@ class Commande(models.Model):
     
     @property
     def check_paiement(self):
+        return self.statut_paiement != self.REFUSEE
+
+
+class ReponseIdempotente(models.Model):
+    """Première réponse d'une requête rejouable (paiement), renvoyée telle quelle aux répétitions."""
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name="reponses_idempotentes")
+    cle = models.CharField(max_length=100)
+    reponse = models.JSONField(default=dict)
+    expire_le = models.DateTimeField(db_index=True)
 
-        if 1:
-            return True
-        else:
-            return False
+    class Meta:
+        verbose_name = 'Réponse idempotente'
+        verbose_name_plural = 'Réponses idempotentes'
+        constraints = [
+            models.UniqueConstraint(fields=['customer', 'cle'], name='reponse_idempotente_unique'),
+        ]
+
+    def __str__(self):
+        return self.cle
 
 
 class ProduitPanier(models.Model):
@@ -159,13 +227,16 @@ class ProduitPanier(models.Model):
 
         verbose_name = 'Produit Panier/Commande'
         verbose_name_plural = 'Produits Panier/Commande'
+        constraints = [
+            # Une ligne par produit dans un panier ouvert ; les lignes de commande (panier nul) ne sont pas concernées
+            models.UniqueConstraint(
+                fields=['panier', 'produit'], condition=models.Q(panier__isnull=False), name='produit_panier_unique',
+            ),
+        ]
 
     @property
     def total(self):
-        if self.produit.check_promotion:
-            return self.produit.prix_promotionnel * self.quantite
-        else:
-            return self.produit.prix * self.quantite
+        return self.produit.prix_effectif * self.quantite
         
 
 
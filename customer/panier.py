@@ -0,0 +1,364 @@
+import contextvars
+import re
+from contextlib import contextmanager
+
+from django.contrib.sessions.models import Session
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, FloatField, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from shop import models as shop_models
+from shop import reservations
+
+from . import models
+
+
+# Robots d'indexation, outils de supervision et clients HTTP en ligne de commande
+ROBOTS = re.compile(
+    r'bot|crawl|spider|slurp|bingpreview|facebookexternalhit|whatsapp|telegram|'
+    r'mediapartners|lighthouse|pingdom|uptime|monitor|health|curl|wget|python-requests|httpclient',
+    re.IGNORECASE,
+)
+
+
+def est_robot(request):
+    """Vrai pour un robot connu : il n'aura jamais de session ni de panier."""
+    return bool(ROBOTS.search(request.META.get('HTTP_USER_AGENT', '')))
+
+
+# Clé de session portant l'id du panier anonyme, pour le rattacher à la connexion
+SESSION_PANIER = 'panier'
+
+# Clients traités par transaction lors du regroupement des paniers
+TAILLE_LOT = 500
+
+# Opérations acceptées par modifier_panier
+ACTIONS = ('ajouter', 'modifier', 'supprimer')
+
+# Borne le travail d'un seul appel
+MAX_OPERATIONS = 50
+
+# Vrai pendant une opération groupée qui recalcule elle-même résumé et réservations
+_signaux_suspendus = contextvars.ContextVar('signaux_lignes_suspendus', default=False)
+
+
+@contextmanager
+def sans_signaux_lignes():
+    """Les signaux des lignes de panier (customer.signals) ne font rien dans ce bloc."""
+    jeton = _signaux_suspendus.set(True)
+    try:
+        yield
+    finally:
+        _signaux_suspendus.reset(jeton)
+
+
+def signaux_lignes_actifs():
+    return not _signaux_suspendus.get()
+
+
+class PanierVide:
+    """
+    Panier affiché tant que le visiteur n'a rien ajouté.
+
+    Expose ce que lisent les templates (cart.html, checkout.html, mini-panier) sans
+    session ni ligne Panier en base.
+    """
+    id = ''
+    coupon = None
+    nb_articles = 0
+    sous_total = 0
+    total_remise = 0
+    total = 0
+    total_with_coupon = 0
+    check_empty = False
+
+    @property
+    def produit_panier(self):
+        return models.ProduitPanier.objects.none()
+
+    lignes = produit_panier
+
+    def __bool__(self):
+        return False
+
+
+def panier_existant(request):
+    """Panier du visiteur s'il en a déjà un, sinon un PanierVide ; ne crée jamais rien."""
+    if request.user.is_authenticated:
+        # Panier unique du client, quel que soit l'appareil
+        return models.Panier.objects.filter(customer__user=request.user).first() or PanierVide()
+    session_key = request.session.session_key
+    if not session_key or est_robot(request):
+        return PanierVide()
+    return models.Panier.objects.filter(session_id=session_key, customer__isnull=True).first() or PanierVide()
+
+
+def panier_client(customer):
+    """Panier canonique du client, créé au besoin (la contrainte panier_client_unique départage les courses)."""
+    panier = models.Panier.objects.filter(customer=customer).first()
+    if panier is None:
+        try:
+            with transaction.atomic():
+                panier = models.Panier.objects.create(customer=customer)
+        except IntegrityError:
+            panier = models.Panier.objects.get(customer=customer)
+    return panier
+
+
+def panier_courant(request):
+    """
+    Panier du visiteur, créé au besoin : le panier canonique d'un client connecté,
+    sinon celui de la session.
+
+    À n'appeler qu'au moment d'ajouter un produit. Retourne None pour un robot,
+    un utilisateur sans profil client ou si la session ne peut pas être créée.
+    """
+    if est_robot(request):
+        return None
+    if request.user.is_authenticated:
+        try:
+            return panier_client(models.Customer.objects.get(user=request.user))
+        except models.Customer.DoesNotExist:
+            # Compte sans profil client (administrateur, établissement)
+            return None
+    if not request.session.exists(request.session.session_key):
+        request.session.create()
+    try:
+        session_id = Session.objects.get(session_key=request.session.session_key)
+    except Session.DoesNotExist:
+        # Moteur de session hors base (cache, cookies) : le panier ne peut pas s'y rattacher
+        return None
+    panier = models.Panier.objects.filter(session_id=session_id, customer__isnull=True).first()
+    if panier is None:
+        panier = models.Panier.objects.create(session_id=session_id)
+    # Retrouvé à la connexion : login() change la clé de session
+    request.session[SESSION_PANIER] = panier.id
+    return panier
+
+
+def fusionner(source, cible):
+    """
+    Verse les lignes du panier source dans cible, puis supprime source.
+
+    Requêtes en nombre fixe quel que soit le nombre de lignes : les quantités des
+    produits présents des deux côtés sont additionnées par un UPDATE, les autres
+    lignes changent de panier par un second UPDATE.
+    """
+    lignes_source = models.ProduitPanier.objects.filter(panier_id=source.id)
+    lignes_cible = models.ProduitPanier.objects.filter(panier_id=cible.id)
+    with transaction.atomic():
+        lignes_cible.filter(produit_id__in=lignes_source.values('produit_id')).update(
+            quantite=F('quantite') + Subquery(
+                lignes_source.filter(produit_id=OuterRef('produit_id')).values('quantite')[:1]
+            )
+        )
+        with sans_signaux_lignes():
+            # Le résumé de cible est recalculé par l'appelant, source disparaît avec ses réservations
+            lignes_source.filter(produit_id__in=lignes_cible.values('produit_id')).delete()
+        lignes_source.update(panier_id=cible.id)
+        if cible.coupon_id is None and source.coupon_id is not None:
+            models.Panier.objects.filter(id=cible.id).update(coupon_id=source.coupon_id)
+            cible.coupon_id = source.coupon_id
+        source.delete()
+
+
+def rattacher_panier_anonyme(request, user):
+    """À la connexion : le panier anonyme de la session rejoint le panier canonique du client."""
+    panier_id = request.session.pop(SESSION_PANIER, None)
+    customer = models.Customer.objects.filter(user=user).first()
+    if panier_id is None or customer is None:
+        return None
+    anonyme = models.Panier.objects.filter(id=panier_id, customer__isnull=True).first()
+    if anonyme is None:
+        return None
+    cible = models.Panier.objects.filter(customer=customer).first()
+    if cible is None:
+        # Premier panier du client : on l'adopte tel quel
+        anonyme.customer = customer
+        anonyme.session_id = None
+        try:
+            with transaction.atomic():
+                anonyme.save(update_fields=['customer', 'session_id'])
+            return anonyme
+        except IntegrityError:
+            cible = models.Panier.objects.get(customer=customer)
+    fusionner(anonyme, cible)
+    cible.recalculer()
+    return cible
+
+
+def regrouper_paniers(taille_lot=TAILLE_LOT):
+    """
+    Réduit à un seul panier par client les paniers créés par session avant le panier canonique.
+
+    Le panier modifié le plus récemment est conservé et les autres y sont fusionnés,
+    client par client, par lots de taille_lot clients : chaque lot est une
+    transaction courte. Retourne le nombre de paniers fusionnés.
+    """
+    fusionnes = 0
+    while True:
+        clients = list(
+            models.Panier.objects.filter(customer__isnull=False).values('customer_id')
+            .annotate(nombre=Count('id')).filter(nombre__gt=1).values_list('customer_id', flat=True)[:taille_lot]
+        )
+        if not clients:
+            return fusionnes
+        with transaction.atomic():
+            for customer_id in clients:
+                paniers = list(models.Panier.objects.filter(customer_id=customer_id).order_by('-date_update', '-id'))
+                cible = paniers[0]
+                for source in paniers[1:]:
+                    fusionner(source, cible)
+                    fusionnes += 1
+                cible.recalculer()
+
+
+def supprimer_paniers_orphelins():
+    """Paniers anonymes dont la session a expiré (clearsessions) : plus personne ne peut les retrouver."""
+    _, supprimes = models.Panier.objects.filter(customer__isnull=True, session_id__isnull=True).delete()
+    return supprimes.get(models.Panier._meta.label, 0)
+
+
+def recalculer_paniers(paniers=None, produits=None):
+    """
+    Recalcule en un seul UPDATE le résumé des paniers donnés, ou de ceux qui contiennent les produits donnés.
+
+    Même calcul que Panier.resume(), fait par la base pour tous les paniers à la
+    fois : un changement de prix ou la bascule quotidienne des promotions ne
+    charge aucun panier.
+    """
+    queryset = models.Panier.objects.all()
+    if paniers is not None:
+        queryset = queryset.filter(id__in=paniers)
+    if produits is not None:
+        queryset = queryset.filter(
+            id__in=models.ProduitPanier.objects.filter(produit_id__in=produits, panier__isnull=False).values('panier_id')
+        )
+    lignes = models.ProduitPanier.objects.filter(panier_id=OuterRef('pk')).order_by().values('panier_id')
+    nb_articles = Subquery(lignes.annotate(nombre=Count('id')).values('nombre'), output_field=IntegerField())
+    sous_total = Coalesce(
+        Subquery(
+            lignes.annotate(total=Sum(F('produit__prix_effectif') * F('quantite'), output_field=FloatField())).values('total'),
+            output_field=FloatField(),
+        ),
+        Value(0.0),
+    )
+    reduction = Coalesce(
+        Subquery(models.CodePromotionnel.objects.filter(pk=OuterRef('coupon_id')).values('reduction'), output_field=FloatField()),
+        Value(0.0),
+    )
+    return queryset.update(
+        nb_articles=Coalesce(nb_articles, Value(0)),
+        sous_total=sous_total,
+        total_remise=sous_total - reduction * sous_total,
+    )
+
+
+def ajouter_produit(panier, produit_id, quantite):
+    """
+    Ajoute quantite au produit dans le panier en un upsert atomique.
+
+    L'incrément est fait par la base (UPDATE ... quantite = quantite + n) ; si la
+    ligne n'existe pas, elle est créée, et la contrainte produit_panier_unique
+    départage deux créations simultanées : la perdante repasse par l'UPDATE.
+    Le stock est réservé pour la nouvelle quantité ; lève ValueError s'il manque.
+    """
+    lignes = models.ProduitPanier.objects.filter(panier=panier, produit_id=produit_id)
+    with transaction.atomic():
+        if not lignes.update(quantite=F('quantite') + quantite):
+            try:
+                with transaction.atomic():
+                    # bulk_create : pas de signal, le résumé est recalculé une fois ci-dessous
+                    models.ProduitPanier.objects.bulk_create([
+                        models.ProduitPanier(panier=panier, produit_id=produit_id, quantite=quantite)
+                    ])
+            except IntegrityError:
+                lignes.update(quantite=F('quantite') + quantite)
+        # Lève ValueError si le stock disponible manque : l'ajout est annulé
+        reservations.reserver(panier, {produit_id: lignes.values_list('quantite', flat=True).get()})
+        panier.recalculer()
+    return panier
+
+
+def _valider(operations):
+    if not isinstance(operations, list) or not operations:
+        raise ValueError("Aucune opération")
+    if len(operations) > MAX_OPERATIONS:
+        raise ValueError("Trop d'opérations")
+    valides = []
+    for operation in operations:
+        if not isinstance(operation, dict) or operation.get('action') not in ACTIONS:
+            raise ValueError("Opération invalide")
+        try:
+            produit = int(operation.get('produit'))
+            quantite = int(operation.get('quantite', 0))
+        except (TypeError, ValueError):
+            raise ValueError("Produit ou quantité invalide")
+        if quantite < 0 or (operation['action'] == 'ajouter' and quantite == 0):
+            raise ValueError("Quantité invalide")
+        valides.append((operation['action'], produit, quantite))
+    return valides
+
+
+def appliquer_operations(panier, operations):
+    """
+    Applique une liste d'opérations {action, produit, quantite} au panier.
+
+    ajouter augmente la quantité, modifier la remplace (0 retire la ligne),
+    supprimer retire la ligne. Seules les quantités en hausse vérifient que le
+    produit est actif et en stock : une ligne dont le produit a été désactivé peut
+    toujours être réduite ou retirée. Le stock est réservé (shop.reservations) et
+    tout est enregistré dans une seule transaction, puis le résumé est recalculé
+    une fois. Lève ValueError si une opération est invalide ou le stock
+    insuffisant : rien n'est alors modifié.
+    """
+    operations = _valider(operations)
+    ids = {produit for _, produit, _ in operations}
+    try:
+        return _appliquer(panier, operations, ids)
+    except IntegrityError:
+        # Une ligne a été créée en parallèle : on relit les lignes et on recommence
+        return _appliquer(panier, operations, ids)
+
+
+def _appliquer(panier, operations, ids):
+    with transaction.atomic():
+        lignes = {
+            ligne.produit_id: ligne
+            for ligne in models.ProduitPanier.objects.select_for_update().filter(panier=panier, produit_id__in=ids)
+        }
+        quantites = {produit: ligne.quantite for produit, ligne in lignes.items()}
+        for action, produit, quantite in operations:
+            if action == 'ajouter':
+                quantites[produit] = quantites.get(produit, 0) + quantite
+            elif action == 'modifier':
+                quantites[produit] = quantite
+            else:
+                quantites[produit] = 0
+        hausses = {p for p, q in quantites.items() if q > (lignes[p].quantite if p in lignes else 0)}
+        if hausses and shop_models.Produit.objects.filter(id__in=hausses, status=True).count() != len(hausses):
+            raise ValueError("Produit indisponible")
+        # Lève ValueError si le stock disponible manque : la transaction est annulée
+        reservations.reserver(panier, quantites, verifier=hausses)
+
+        a_supprimer = [lignes[p].id for p, q in quantites.items() if q == 0 and p in lignes]
+        a_modifier = []
+        for produit, quantite in quantites.items():
+            if quantite and produit in lignes and lignes[produit].quantite != quantite:
+                lignes[produit].quantite = quantite
+                a_modifier.append(lignes[produit])
+        a_creer = [
+            models.ProduitPanier(panier=panier, produit_id=produit, quantite=quantite)
+            for produit, quantite in quantites.items() if quantite and produit not in lignes
+        ]
+        # Réservations déjà portées à quantites et résumé recalculé une fois ci-dessous :
+        # ni les signaux des lignes supprimées, ni bulk_update et bulk_create ne recalculent
+        if a_supprimer:
+            with sans_signaux_lignes():
+                models.ProduitPanier.objects.filter(id__in=a_supprimer).delete()
+        if a_modifier:
+            models.ProduitPanier.objects.bulk_update(a_modifier, ['quantite'])
+        if a_creer:
+            models.ProduitPanier.objects.bulk_create(a_creer)
+        panier.recalculer()
+    return panier
@@ -0,0 +1,29 @@
+from django.contrib.auth.signals import user_logged_in
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from shop import models as shop_models
+
+from . import models, panier
+
+
+@receiver(post_save, sender=models.ProduitPanier)
+@receiver(post_delete, sender=models.ProduitPanier)
+def recalculer_resume_panier(sender, instance, raw=False, **kwargs):
+    if raw or instance.panier_id is None or not panier.signaux_lignes_actifs():
+        return
+    panier.recalculer_paniers(paniers=[instance.panier_id])
+
+
+@receiver(post_delete, sender=models.ProduitPanier)
+def liberer_reservation(sender, instance, **kwargs):
+    # Ligne retirée du panier : son stock retenu redevient disponible
+    if instance.panier_id is not None and panier.signaux_lignes_actifs():
+        shop_models.Reservation.objects.filter(panier_id=instance.panier_id, produit_id=instance.produit_id).delete()
+
+
+@receiver(user_logged_in)
+def rattacher_panier(sender, request, user, **kwargs):
+    if request is None:
+        return
+    panier.rattacher_panier_anonyme(request, user)
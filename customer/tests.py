@@ -1,10 +1,38 @@
-from django.test import TestCase, Client
+from django.conf import settings
+from django.test import TestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import IntegrityError, connection, transaction
 from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
 from django.utils import timezone
 from django.urls import reverse
-from shop.models import CategorieEtablissement, CategorieProduit, Etablissement, Produit
-from .models import Customer, Panier, ProduitPanier, Commande, CodePromotionnel, PasswordResetToken
+from unittest.mock import patch
+from shop.models import CategorieEtablissement, CategorieProduit, Etablissement, Produit, Reservation
+from shop.paiement import ErreurPaiement, Passerelle
+from shop.paiement_factice import ServeurFactice
+from . import idempotence, panier as panier_module
+from .commandes import passer_commande
+from .models import Customer, Panier, ProduitPanier, Commande, CodePromotionnel, PasswordResetToken, ReponseIdempotente
 import datetime
+import json
+
+
+class PaiementFacticeMixin:
+    """Dirige la passerelle de paiement vers un serveur factice local le temps de la classe"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.serveur_paiement = ServeurFactice().demarrer()
+        cls.addClassCleanup(cls.serveur_paiement.arreter)
+        reglages = override_settings(CINETPAY=dict(settings.CINETPAY, URL=cls.serveur_paiement.url))
+        reglages.enable()
+        cls.addClassCleanup(reglages.disable)
+
+    def setUp(self):
+        super().setUp()
+        self.serveur_paiement.vider()
+
 
 class CustomerConsolidatedTest(TestCase):
     """Tests consolidés pour l'application Customer (Panier, Commandes, Inscription)"""
@@ -38,6 +66,7 @@ class CustomerConsolidatedTest(TestCase):
         """Teste le calcul du total du panier"""
         panier = Panier.objects.create(customer=self.customer)
         ProduitPanier.objects.create(produit=self.produit, panier=panier, quantite=3)
+        panier.refresh_from_db()
         self.assertEqual(panier.total, 1500) # 500 * 3
 
     def test_panier_total_with_coupon(self):
@@ -107,9 +136,546 @@ class CustomerConsolidatedTest(TestCase):
         """Ajout, modification et suppression dans le panier"""
         panier = Panier.objects.create(customer=self.customer)
         pp = ProduitPanier.objects.create(produit=self.produit, panier=panier, quantite=1)
+        panier.refresh_from_db()
         self.assertEqual(panier.total, 500)
         pp.quantite = 2
         pp.save()
+        panier.refresh_from_db()
         self.assertEqual(panier.total, 1000)
         pp.delete()
+        panier.refresh_from_db()
         self.assertEqual(panier.total, 0)
+
+
+class CustomerPanierParesseuxTest(TestCase):
+    """Le panier et la session ne sont créés qu'au premier ajout"""
+
+    def setUp(self):
+        self.client = Client()
+        owner = User.objects.create_user(username="owner", password="test")
+        cat_etab = CategorieEtablissement.objects.create(nom="Resto", description="D")
+        cat_prod = CategorieProduit.objects.create(nom="Plats", description="D", categorie=cat_etab)
+        etab = Etablissement.objects.create(
+            user=owner, nom="Resto Test", description="D", categorie=cat_etab,
+            nom_du_responsable="T", prenoms_duresponsable="U", adresse="A", pays="CI", contact_1="0", email="t@t.com"
+        )
+        self.produit = Produit.objects.create(nom="Pomme", prix=500, quantite=100, categorie=cat_prod, etablissement=etab)
+
+    def _ajouter(self, **extra):
+        return self.client.post(reverse('add_to_cart'), json.dumps({'produit': self.produit.id, 'quantite': 1}),
+                                content_type='application/json', **extra).json()
+
+    def test_pages_en_lecture_seule(self):
+        """Parcourir le site et ouvrir le panier ne crée ni session ni panier"""
+        for url in (reverse('index'), reverse('cart'), reverse('mini_panier')):
+            self.client.get(url)
+        self.assertEqual(Session.objects.count(), 0)
+        self.assertEqual(Panier.objects.count(), 0)
+        self.assertEqual(self.client.get(reverse('mini_panier')).json()['nombre'], 0)
+
+    def test_creation_au_premier_ajout(self):
+        """Le premier ajout crée la session et le panier, réutilisés ensuite"""
+        self.assertTrue(self._ajouter()['success'])
+        self.assertTrue(self._ajouter()['success'])
+        self.assertEqual(Session.objects.count(), 1)
+        self.assertEqual(Panier.objects.count(), 1)
+        self.assertEqual(self.client.get(reverse('mini_panier')).json()['nombre'], 1)
+
+    def test_robot_sans_session(self):
+        """Un robot connu ne crée jamais de session"""
+        data = self._ajouter(HTTP_USER_AGENT='Mozilla/5.0 (compatible; Googlebot/2.1)')
+        self.assertFalse(data['success'])
+        self.assertEqual(Session.objects.count(), 0)
+        self.assertEqual(Panier.objects.count(), 0)
+
+    def test_compte_sans_profil_client(self):
+        """Un compte sans profil client n'a pas de panier ; les autres erreurs ne sont pas masquées"""
+        self.client.login(username="owner", password="test")
+        self.assertFalse(self._ajouter()['success'])
+        self.assertEqual(Panier.objects.count(), 0)
+        with patch.object(Panier.objects, 'create', side_effect=IntegrityError):
+            self.client.logout()
+            with self.assertRaises(IntegrityError):
+                self._ajouter()
+
+
+class CustomerResumePanierTest(TestCase):
+    """Résumé du panier (nombre de lignes, sous-total, total remisé) stocké sur Panier"""
+
+    def setUp(self):
+        owner = User.objects.create_user(username="owner", password="test")
+        cat_etab = CategorieEtablissement.objects.create(nom="Resto", description="D")
+        cat_prod = CategorieProduit.objects.create(nom="Plats", description="D", categorie=cat_etab)
+        etab = Etablissement.objects.create(
+            user=owner, nom="Resto Test", description="D", categorie=cat_etab,
+            nom_du_responsable="T", prenoms_duresponsable="U", adresse="A", pays="CI", contact_1="0", email="t@t.com"
+        )
+        self.pomme = Produit.objects.create(nom="Pomme", prix=500, quantite=100, categorie=cat_prod, etablissement=etab)
+        self.poire = Produit.objects.create(nom="Poire", prix=1000, quantite=100, categorie=cat_prod, etablissement=etab)
+        self.panier = Panier.objects.create()
+
+    def _resume(self):
+        panier = Panier.objects.get(id=self.panier.id)
+        return panier.nb_articles, panier.sous_total, panier.total_remise
+
+    def test_resume_suit_les_lignes(self):
+        """Ajout, modification et suppression de lignes mettent le résumé à jour"""
+        ligne = ProduitPanier.objects.create(produit=self.pomme, panier=self.panier, quantite=2)
+        ProduitPanier.objects.create(produit=self.poire, panier=self.panier, quantite=1)
+        self.assertEqual(self._resume(), (2, 2000, 2000))
+        ligne.quantite = 4
+        ligne.save()
+        self.assertEqual(self._resume(), (2, 3000, 3000))
+        ligne.delete()
+        self.assertEqual(self._resume(), (1, 1000, 1000))
+
+    def test_coupon_et_changement_de_prix(self):
+        """Le coupon et le prix des produits se répercutent sur le total remisé"""
+        ProduitPanier.objects.create(produit=self.pomme, panier=self.panier, quantite=2)
+        self.panier.coupon = CodePromotionnel.objects.create(
+            libelle="Promo", etat=True, date_fin=datetime.date.today(), reduction=0.10, code_promo="DIX"
+        )
+        self.panier.save()
+        self.assertEqual(self._resume(), (1, 1000, 900))
+        self.pomme.prix = 1000
+        self.pomme.save()
+        self.assertEqual(self._resume(), (1, 2000, 1800))
+
+    def test_recalcul_ensembliste(self):
+        """Un changement de prix recalcule tous les paniers concernés en un seul UPDATE"""
+        autres = [Panier.objects.create() for _ in range(3)]
+        for panier in [self.panier] + autres:
+            ProduitPanier.objects.create(produit=self.pomme, panier=panier, quantite=2)
+        autres[0].coupon = CodePromotionnel.objects.create(
+            libelle="Promo", etat=True, date_fin=datetime.date.today(), reduction=0.10, code_promo="DIX"
+        )
+        autres[0].save()
+        Produit.objects.filter(id=self.pomme.id).update(prix_effectif=1000)
+        with self.assertNumQueries(1):
+            self.assertEqual(panier_module.recalculer_paniers(produits=[self.pomme.id]), 4)
+        self.assertEqual(self._resume(), (1, 2000, 2000))
+        self.assertEqual(Panier.objects.get(id=autres[0].id).total_remise, 1800)
+        vide = Panier.objects.create(nb_articles=3, sous_total=10, total_remise=10)
+        panier_module.recalculer_paniers(paniers=[vide.id])
+        vide.refresh_from_db()
+        self.assertEqual((vide.nb_articles, vide.sous_total, vide.total_remise), (0, 0, 0))
+
+    def test_enregistrement_sans_changement_de_coupon(self):
+        """Enregistrer le panier ne recalcule le résumé que si le coupon change"""
+        panier = Panier.objects.get(id=self.panier.id)
+        with self.assertNumQueries(1):
+            panier.save()
+
+    def test_totaux_sans_requete(self):
+        """Les totaux et check_empty lisent le résumé stocké, sans agrégat"""
+        for produit in (self.pomme, self.poire):
+            ProduitPanier.objects.create(produit=produit, panier=self.panier, quantite=1)
+        self.panier.refresh_from_db()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.panier.total, 1500)
+            self.assertEqual(self.panier.total_with_coupon, 1500)
+            self.assertTrue(self.panier.check_empty)
+
+
+class CustomerModifierPanierTest(TestCase):
+    """Modifications du panier regroupées en un appel"""
+
+    def setUp(self):
+        self.client = Client()
+        owner = User.objects.create_user(username="owner", password="test")
+        cat_etab = CategorieEtablissement.objects.create(nom="Resto", description="D")
+        cat_prod = CategorieProduit.objects.create(nom="Plats", description="D", categorie=cat_etab)
+        etab = Etablissement.objects.create(
+            user=owner, nom="Resto Test", description="D", categorie=cat_etab,
+            nom_du_responsable="T", prenoms_duresponsable="U", adresse="A", pays="CI", contact_1="0", email="t@t.com"
+        )
+        self.pomme = Produit.objects.create(nom="Pomme", prix=500, quantite=10, categorie=cat_prod, etablissement=etab)
+        self.poire = Produit.objects.create(nom="Poire", prix=1000, quantite=10, categorie=cat_prod, etablissement=etab)
+
+    def _envoyer(self, *operations):
+        return self.client.post(reverse('modifier_panier'), json.dumps({'operations': list(operations)}),
+                                content_type='application/json').json()
+
+    def test_operations_groupees(self):
+        """Ajouts, modification et suppression sont appliqués ensemble et le résumé est renvoyé"""
+        data = self._envoyer(
+            {'action': 'ajouter', 'produit': self.pomme.id, 'quantite': 1},
+            {'action': 'ajouter', 'produit': self.pomme.id, 'quantite': 2},
+            {'action': 'ajouter', 'produit': self.poire.id, 'quantite': 1},
+        )
+        self.assertTrue(data['success'])
+        self.assertEqual(data['panier'], {'nb_articles': 2, 'sous_total': 2500, 'total_remise': 2500})
+        data = self._envoyer(
+            {'action': 'modifier', 'produit': self.pomme.id, 'quantite': 5},
+            {'action': 'supprimer', 'produit': self.poire.id},
+        )
+        self.assertEqual(data['panier']['sous_total'], 2500)
+        self.assertEqual(list(ProduitPanier.objects.values_list('produit_id', 'quantite')), [(self.pomme.id, 5)])
+        self.assertEqual(Panier.objects.get().nb_articles, 1)
+        self.assertContains(self.client.get(reverse('cart')), 'quantites: { %d: 5 }' % self.pomme.id)
+
+    def test_operation_invalide_sans_effet(self):
+        """Une opération invalide annule tout l'appel"""
+        self._envoyer({'action': 'ajouter', 'produit': self.pomme.id, 'quantite': 1})
+        for operation in (
+            {'action': 'ajouter', 'produit': 0, 'quantite': 1},
+            {'action': 'modifier', 'produit': self.pomme.id, 'quantite': 11},
+            {'action': 'vider', 'produit': self.pomme.id},
+        ):
+            data = self._envoyer({'action': 'ajouter', 'produit': self.poire.id, 'quantite': 1}, operation)
+            self.assertFalse(data['success'])
+        self.assertEqual(list(ProduitPanier.objects.values_list('produit_id', 'quantite')), [(self.pomme.id, 1)])
+
+    def test_produit_desactive_retirable(self):
+        """Un produit désactivé ne peut plus être ajouté, mais sa ligne peut être réduite ou retirée"""
+        self._envoyer(
+            {'action': 'ajouter', 'produit': self.pomme.id, 'quantite': 3},
+            {'action': 'ajouter', 'produit': self.poire.id, 'quantite': 1},
+        )
+        Produit.objects.filter(id=self.pomme.id).update(status=False, quantite=1)
+        self.assertFalse(self._envoyer({'action': 'ajouter', 'produit': self.pomme.id, 'quantite': 1})['success'])
+        self.assertTrue(self._envoyer({'action': 'modifier', 'produit': self.pomme.id, 'quantite': 2})['success'])
+        data = self._envoyer({'action': 'supprimer', 'produit': self.pomme.id})
+        self.assertTrue(data['success'])
+        self.assertEqual(data['panier']['sous_total'], 1000)
+        self.assertEqual(list(ProduitPanier.objects.values_list('produit_id', flat=True)), [self.poire.id])
+        self.assertFalse(Reservation.objects.filter(produit=self.pomme).exists())
+
+    def test_coupon_sur_son_propre_panier(self):
+        """Le coupon s'applique au panier du visiteur, jamais à celui désigné par la requête"""
+        autre = Panier.objects.create()
+        ProduitPanier.objects.create(produit=self.poire, panier=autre, quantite=1)
+        CodePromotionnel.objects.create(libelle="Promo", etat=True, date_fin=datetime.date.today(), reduction=0.10, code_promo="DIX")
+        url = reverse('add_coupon')
+        data = self.client.post(url, json.dumps({'panier': autre.id, 'coupon': "DIX"}), content_type='application/json').json()
+        self.assertFalse(data['success'])
+
+        self._envoyer({'action': 'ajouter', 'produit': self.pomme.id, 'quantite': 2})
+        self.assertFalse(self.client.post(url, json.dumps({'coupon': "VINGT"}), content_type='application/json').json()['success'])
+        data = self.client.post(url, json.dumps({'panier': autre.id, 'coupon': "DIX"}), content_type='application/json').json()
+        self.assertTrue(data['success'])
+        self.assertEqual(Panier.objects.get(produit_panier__produit=self.pomme).total_remise, 900)
+        autre.refresh_from_db()
+        self.assertIsNone(autre.coupon_id)
+
+    def test_suppressions_groupees(self):
+        """Retirer plusieurs lignes ne recalcule pas le panier ligne par ligne"""
+        self._envoyer(
+            {'action': 'ajouter', 'produit': self.pomme.id, 'quantite': 1},
+            {'action': 'ajouter', 'produit': self.poire.id, 'quantite': 1},
+        )
+        with CaptureQueriesContext(connection) as requetes:
+            data = self._envoyer(
+                {'action': 'supprimer', 'produit': self.pomme.id},
+                {'action': 'supprimer', 'produit': self.poire.id},
+            )
+        self.assertEqual(data['panier'], {'nb_articles': 0, 'sous_total': 0, 'total_remise': 0})
+        resumes = [q for q in requetes if q['sql'].startswith('UPDATE "customer_panier"')]
+        self.assertEqual(len(resumes), 1)
+        self.assertFalse(Reservation.objects.exists())
+
+    def test_nombre_de_requetes_constant(self):
+        """Le coût d'un appel ne dépend pas du nombre de produits ajoutés"""
+        self._envoyer({'action': 'ajouter', 'produit': self.pomme.id, 'quantite': 1})
+        with CaptureQueriesContext(connection) as une:
+            self._envoyer({'action': 'modifier', 'produit': self.pomme.id, 'quantite': 2})
+        with CaptureQueriesContext(connection) as deux:
+            self._envoyer(
+                {'action': 'modifier', 'produit': self.pomme.id, 'quantite': 3},
+                {'action': 'ajouter', 'produit': self.poire.id, 'quantite': 1},
+            )
+        self.assertLessEqual(len(deux), len(une) + 1)
+
+
+class CustomerAjoutConcurrentTest(TestCase):
+    """Une seule ligne par produit dans un panier ouvert"""
+
+    def setUp(self):
+        self.client = Client()
+        owner = User.objects.create_user(username="owner", password="test")
+        cat_etab = CategorieEtablissement.objects.create(nom="Resto", description="D")
+        cat_prod = CategorieProduit.objects.create(nom="Plats", description="D", categorie=cat_etab)
+        etab = Etablissement.objects.create(
+            user=owner, nom="Resto Test", description="D", categorie=cat_etab,
+            nom_du_responsable="T", prenoms_duresponsable="U", adresse="A", pays="CI", contact_1="0", email="t@t.com"
+        )
+        self.produit = Produit.objects.create(nom="Pomme", prix=500, quantite=100, categorie=cat_prod, etablissement=etab)
+
+    def test_ajouts_cumules(self):
+        """Deux ajouts du même produit incrémentent la même ligne"""
+        for quantite in (1, 2):
+            self.client.post(reverse('add_to_cart'), json.dumps({'produit': self.produit.id, 'quantite': quantite}),
+                             content_type='application/json')
+        self.assertEqual(list(ProduitPanier.objects.values_list('quantite', flat=True)), [3])
+        self.assertEqual(Panier.objects.get().sous_total, 1500)
+
+    def test_contrainte_unique(self):
+        """La base refuse une seconde ligne du même produit dans le même panier"""
+        panier = Panier.objects.create()
+        ProduitPanier.objects.create(produit=self.produit, panier=panier, quantite=1)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            ProduitPanier.objects.create(produit=self.produit, panier=panier, quantite=1)
+
+    def test_lignes_de_commande_non_concernees(self):
+        """Les lignes rattachées à une commande (sans panier) peuvent répéter un produit"""
+        customer = Customer.objects.create(user=User.objects.create_user(username="client"), adresse="A", contact_1="1")
+        commande = Commande.objects.create(customer=customer, prix_total=1000)
+        ProduitPanier.objects.create(produit=self.produit, commande=commande, quantite=1)
+        ProduitPanier.objects.create(produit=self.produit, commande=commande, quantite=1)
+        self.assertEqual(commande.produit_commande.count(), 2)
+
+
+class CustomerPanierCanoniqueTest(TestCase):
+    """Un panier par client, rejoint par le panier anonyme à la connexion"""
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username="client", password="password123")
+        self.customer = Customer.objects.create(user=self.user, adresse="Abidjan", contact_1="123")
+        owner = User.objects.create_user(username="owner", password="test")
+        cat_etab = CategorieEtablissement.objects.create(nom="Resto", description="D")
+        cat_prod = CategorieProduit.objects.create(nom="Plats", description="D", categorie=cat_etab)
+        etab = Etablissement.objects.create(
+            user=owner, nom="Resto Test", description="D", categorie=cat_etab,
+            nom_du_responsable="T", prenoms_duresponsable="U", adresse="A", pays="CI", contact_1="0", email="t@t.com"
+        )
+        self.pomme = Produit.objects.create(nom="Pomme", prix=500, quantite=100, categorie=cat_prod, etablissement=etab)
+        self.poire = Produit.objects.create(nom="Poire", prix=1000, quantite=100, categorie=cat_prod, etablissement=etab)
+
+    def _ajouter(self, produit, quantite):
+        self.client.post(reverse('add_to_cart'), json.dumps({'produit': produit.id, 'quantite': quantite}),
+                         content_type='application/json')
+
+    def _lignes(self, panier):
+        return dict(panier.produit_panier.values_list('produit_id', 'quantite'))
+
+    def test_fusion_a_la_connexion(self):
+        """Les lignes anonymes rejoignent le panier du client, quantités additionnées"""
+        panier_client = Panier.objects.create(customer=self.customer)
+        ProduitPanier.objects.create(produit=self.pomme, panier=panier_client, quantite=1)
+        self._ajouter(self.pomme, 2)
+        self._ajouter(self.poire, 1)
+        self.client.login(username="client", password="password123")
+        self.assertEqual(Panier.objects.count(), 1)
+        panier_client.refresh_from_db()
+        self.assertEqual(self._lignes(panier_client), {self.pomme.id: 3, self.poire.id: 1})
+        self.assertEqual((panier_client.nb_articles, panier_client.sous_total), (2, 2500))
+
+    def test_panier_anonyme_adopte(self):
+        """Sans panier existant, le panier anonyme devient celui du client"""
+        self._ajouter(self.pomme, 2)
+        self.client.login(username="client", password="password123")
+        panier = Panier.objects.get()
+        self.assertEqual(panier.customer, self.customer)
+        self.assertEqual(self.client.get(reverse('mini_panier')).json()['nombre'], 1)
+
+    def test_meme_panier_sur_deux_appareils(self):
+        """Deux sessions du même client partagent le panier"""
+        self.client.login(username="client", password="password123")
+        self._ajouter(self.pomme, 1)
+        autre = Client()
+        autre.login(username="client", password="password123")
+        autre.post(reverse('add_to_cart'), json.dumps({'produit': self.poire.id, 'quantite': 1}),
+                   content_type='application/json')
+        self.assertEqual(Panier.objects.count(), 1)
+        self.assertEqual(autre.get(reverse('mini_panier')).json()['nombre'], 2)
+
+    def test_regroupement_par_lots(self):
+        """Le job fusionne les anciens paniers par session en un panier par client"""
+        Panier.objects.create(customer=self.customer)
+        autre = User.objects.create_user(username="autre")
+        autre_customer = Customer.objects.create(user=autre, adresse="A", contact_1="1")
+        Panier.objects.create(customer=autre_customer)
+        # Anciens paniers par session, antérieurs à la contrainte : insérés sans elle
+        with connection.cursor() as cursor:
+            cursor.execute('DROP INDEX panier_client_unique')
+        for customer, produit in ((self.customer, self.pomme), (self.customer, self.pomme), (autre_customer, self.poire)):
+            ProduitPanier.objects.create(produit=produit, panier=Panier.objects.create(customer=customer), quantite=1)
+        self.assertEqual(panier_module.regrouper_paniers(taille_lot=1), 3)
+        self.assertEqual(Panier.objects.filter(customer=self.customer).count(), 1)
+        self.assertEqual(self._lignes(Panier.objects.get(customer=self.customer)), {self.pomme.id: 2})
+        self.assertEqual(Panier.objects.get(customer=autre_customer).sous_total, 1000)
+
+    def test_orphelins_supprimes(self):
+        """Un panier anonyme dont la session a disparu est supprimé par le nettoyage"""
+        self._ajouter(self.pomme, 1)
+        Session.objects.all().delete()
+        self.assertEqual(panier_module.supprimer_paniers_orphelins(), 1)
+        self.assertFalse(Panier.objects.exists())
+
+
+class CustomerPasserCommandeTest(PaiementFacticeMixin, TestCase):
+    """Validation d'une commande en une transaction"""
+
+    def setUp(self):
+        super().setUp()
+        self.client = Client()
+        self.user = User.objects.create_user(username="client", password="password123")
+        self.customer = Customer.objects.create(user=self.user, adresse="Abidjan", contact_1="123")
+        owner = User.objects.create_user(username="owner", password="test")
+        cat_etab = CategorieEtablissement.objects.create(nom="Resto", description="D")
+        cat_prod = CategorieProduit.objects.create(nom="Plats", description="D", categorie=cat_etab)
+        self.etab = Etablissement.objects.create(
+            user=owner, nom="Resto Test", description="D", categorie=cat_etab,
+            nom_du_responsable="T", prenoms_duresponsable="U", adresse="A", pays="CI", contact_1="0", email="t@t.com"
+        )
+        self.cat_prod = cat_prod
+        self.pomme = Produit.objects.create(nom="Pomme", prix=500, quantite=10, categorie=cat_prod, etablissement=self.etab)
+        self.poire = Produit.objects.create(nom="Poire", prix=1000, quantite=None, categorie=cat_prod, etablissement=self.etab)
+        self.panier = Panier.objects.create(customer=self.customer)
+        ProduitPanier.objects.create(produit=self.pomme, panier=self.panier, quantite=3)
+        ProduitPanier.objects.create(produit=self.poire, panier=self.panier, quantite=1)
+
+    def test_commande_complete(self):
+        """Total calculé en SQL, stock décrémenté, lignes rattachées et panier supprimé"""
+        self.client.login(username="client", password="password123")
+        data = self.client.post(reverse('paiement_detail'), json.dumps({
+            'transaction_id': 'T1', 'notify_url': '/', 'return_url': '/', 'panier': self.panier.id,
+        }), content_type='application/json').json()
+        self.assertTrue(data['success'])
+        commande = Commande.objects.get()
+        self.assertEqual((commande.prix_total, commande.transaction_id), (2500, 'T1'))
+        self.assertEqual(commande.produit_commande.count(), 2)
+        self.assertFalse(Panier.objects.exists())
+        self.pomme.refresh_from_db()
+        self.poire.refresh_from_db()
+        self.assertEqual((self.pomme.quantite, self.poire.quantite), (7, None))
+        # Paiement initialisé chez le fournisseur au montant de la commande
+        self.assertEqual(data['payment_url'], commande.payment_url)
+        self.assertEqual(self.serveur_paiement.transactions['T1']['amount'], 2500)
+
+    def test_montant_change(self):
+        """Un total différent du montant annoncé au fournisseur annule la commande"""
+        with self.assertRaises(ValueError):
+            passer_commande(self.panier.id, self.customer, montant=2000, transaction_id='T1')
+        self.assertFalse(Commande.objects.exists())
+        self.pomme.refresh_from_db()
+        self.assertEqual(self.pomme.quantite, 10)
+
+    def test_stock_insuffisant_sans_effet(self):
+        """Si un produit manque, rien n'est modifié"""
+        ProduitPanier.objects.filter(produit=self.pomme).update(quantite=11)
+        with self.assertRaises(ValueError):
+            passer_commande(self.panier.id, self.customer, transaction_id='T1')
+        self.assertFalse(Commande.objects.exists())
+        self.assertEqual(self.panier.produit_panier.count(), 2)
+        self.pomme.refresh_from_db()
+        self.assertEqual(self.pomme.quantite, 10)
+
+    def test_requetes_independantes_du_nombre_de_lignes(self):
+        """Le nombre de requêtes ne dépend pas du nombre de lignes"""
+        with CaptureQueriesContext(connection) as deux_lignes:
+            passer_commande(self.panier.id, self.customer, transaction_id='T1')
+        panier = Panier.objects.create(customer=self.customer)
+        ProduitPanier.objects.bulk_create([
+            ProduitPanier(panier=panier, quantite=1, produit=Produit.objects.create(
+                nom="Deal %d" % i, prix=100, quantite=5, categorie=self.cat_prod, etablissement=self.etab))
+            for i in range(6)
+        ])
+        with CaptureQueriesContext(connection) as six_lignes:
+            passer_commande(panier.id, self.customer, transaction_id='T2')
+        self.assertEqual(len(deux_lignes), len(six_lignes))
+
+
+class CustomerIdempotenceTest(PaiementFacticeMixin, TestCase):
+    """Paiement rejoué : la commande n'est passée qu'une fois"""
+
+    def setUp(self):
+        super().setUp()
+        self.client = Client()
+        self.user = User.objects.create_user(username="client", password="password123")
+        self.customer = Customer.objects.create(user=self.user, adresse="Abidjan", contact_1="123")
+        owner = User.objects.create_user(username="owner", password="test")
+        cat_etab = CategorieEtablissement.objects.create(nom="Resto", description="D")
+        cat_prod = CategorieProduit.objects.create(nom="Plats", description="D", categorie=cat_etab)
+        etab = Etablissement.objects.create(
+            user=owner, nom="Resto Test", description="D", categorie=cat_etab,
+            nom_du_responsable="T", prenoms_duresponsable="U", adresse="A", pays="CI", contact_1="0", email="t@t.com"
+        )
+        self.pomme = Produit.objects.create(nom="Pomme", prix=500, quantite=10, categorie=cat_prod, etablissement=etab)
+        self.panier = Panier.objects.create(customer=self.customer)
+        ProduitPanier.objects.create(produit=self.pomme, panier=self.panier, quantite=3)
+        self.client.login(username="client", password="password123")
+
+    def payer(self, transaction_id, **entetes):
+        return self.client.post(reverse('paiement_detail'), json.dumps({
+            'transaction_id': transaction_id, 'notify_url': '/', 'return_url': '/', 'panier': self.panier.id,
+        }), content_type='application/json', **entetes).json()
+
+    def test_transaction_rejouee(self):
+        """Le même transaction_id renvoie la première réponse sans repasser la commande"""
+        premiere = self.payer('T1')
+        with CaptureQueriesContext(connection) as requetes:
+            seconde = self.payer('T1')
+        self.assertTrue(premiere['success'])
+        self.assertEqual(premiere, seconde)
+        self.assertEqual(Commande.objects.count(), 1)
+        self.pomme.refresh_from_db()
+        self.assertEqual(self.pomme.quantite, 7)
+        self.assertFalse([q for q in requetes if 'shop_produit' in q['sql']])
+
+    def test_fournisseur_appele_une_fois(self):
+        """Une requête rejouée, même pendant le premier appel au fournisseur, ne l'appelle pas de nouveau"""
+        initier = Passerelle.initier
+        rejeux = []
+
+        def initier_puis_rejouer(passerelle, *args, **kwargs):
+            # Seconde soumission arrivée pendant que le fournisseur répond à la première
+            rejeux.append(self.payer('T1'))
+            return initier(passerelle, *args, **kwargs)
+
+        with patch.object(Passerelle, 'initier', initier_puis_rejouer):
+            premiere = self.payer('T1')
+        self.assertTrue(premiere['success'])
+        self.assertFalse(rejeux[0]['success'])
+        self.assertEqual(self.payer('T1'), premiere)
+        self.assertEqual(self.serveur_paiement.appels, 1)
+        self.assertEqual(Commande.objects.count(), 1)
+
+    def test_entete_idempotency_key(self):
+        """L'en-tête Idempotency-Key prime sur le transaction_id"""
+        premiere = self.payer('T1', HTTP_IDEMPOTENCY_KEY='cle-1')
+        self.assertEqual(self.payer('T2', HTTP_IDEMPOTENCY_KEY='cle-1'), premiere)
+        self.assertEqual(list(Commande.objects.values_list('transaction_id', flat=True)), ['T1'])
+
+    def test_echec_non_enregistre(self):
+        """Un échec de l'appel au fournisseur n'est pas mémorisé : la même clé peut être retentée"""
+        with patch.object(Passerelle, 'initier', side_effect=ErreurPaiement("Fournisseur injoignable")):
+            self.assertFalse(self.payer('T1', HTTP_IDEMPOTENCY_KEY='cle-1')['success'])
+        self.assertFalse(ReponseIdempotente.objects.exists())
+        self.assertTrue(self.payer('T1', HTTP_IDEMPOTENCY_KEY='cle-1')['success'])
+        self.assertEqual(Commande.objects.count(), 1)
+
+    def test_echec_apres_fournisseur_memorise(self):
+        """Après l'appel au fournisseur, un échec est mémorisé : la requête rejouée ne le rappelle pas"""
+        ProduitPanier.objects.filter(panier=self.panier).update(quantite=11)
+        self.panier.recalculer()
+        premiere = self.payer('T1', HTTP_IDEMPOTENCY_KEY='cle-1')
+        self.assertFalse(premiere['success'])
+        ProduitPanier.objects.filter(panier=self.panier).update(quantite=2)
+        self.panier.recalculer()
+        self.assertEqual(self.payer('T2', HTTP_IDEMPOTENCY_KEY='cle-1'), premiere)
+        self.assertEqual(self.serveur_paiement.appels, 1)
+        # Nouvelle clé : nouvelle tentative
+        self.assertTrue(self.payer('T2', HTTP_IDEMPOTENCY_KEY='cle-2')['success'])
+        self.assertEqual(Commande.objects.count(), 1)
+
+    def test_exception_apres_fournisseur(self):
+        """Une exception après l'appel au fournisseur est mémorisée comme un échec, sans second appel"""
+        with patch('shop.views.passer_commande', side_effect=RuntimeError):
+            self.assertFalse(self.payer('T1')['success'])
+        self.assertFalse(self.payer('T1')['success'])
+        self.assertEqual(self.serveur_paiement.appels, 1)
+        self.assertFalse(Commande.objects.exists())
+
+    def test_reponse_expiree(self):
+        """Réponse expirée purgée ; le transaction_id unique empêche encore le doublon"""
+        self.payer('T1')
+        ReponseIdempotente.objects.update(expire_le=timezone.now() - datetime.timedelta(minutes=1))
+        self.assertEqual(idempotence.purger_expirees(), 1)
+        panier = Panier.objects.create(customer=self.customer)
+        ProduitPanier.objects.create(produit=self.pomme, panier=panier, quantite=1)
+        self.panier = panier
+        self.assertFalse(self.payer('T1')['success'])
+        self.assertEqual(Commande.objects.count(), 1)
+        self.assertEqual(panier.produit_panier.count(), 1)
@@ -9,10 +9,10 @@ urlpatterns = [
     path('post', views.islogin, name="post"),
     path('deconnexion', views.deconnexion, name="deconnexion"),
     path('inscription', views.inscription, name="inscription"),
+    path('cart/mini', views.mini_panier, name="mini_panier"),
     path('cart/add/product', views.add_to_cart, name="add_to_cart"),
+    path('cart/batch', views.modifier_panier, name="modifier_panier"),
     path('cart/add/coupon', views.add_coupon, name="add_coupon"),
-    path('cart/delete/product', views.delete_from_cart, name="delete_from_cart"),
-    path('cart/udpate/product', views.update_cart, name="update_cart"),
     path('reset-password/', views.request_reset_password, name='request_reset_password'),
     path('reset-password/<str:token>/', views.reset_password, name='reset_password'),
 ]
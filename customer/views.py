@@ -6,11 +6,17 @@ from shop import models as shop_models
 from django.contrib.auth import authenticate, login as login_request, logout
 import json
 from django.http import JsonResponse
+from django.template.loader import render_to_string
+from django.views.decorators.cache import never_cache
+from django.views.decorators.csrf import ensure_csrf_cookie
+from django.views.decorators.http import require_GET, require_POST
+from .panier import ajouter_produit, appliquer_operations, panier_courant, panier_existant
 from django.contrib.auth.models import User
 from cities_light.models import City
 
 
 from django.core.mail import send_mail
+from base import taches
 from django.utils.crypto import get_random_string
 from django.contrib import messages
 from django.urls import reverse
@@ -183,25 +189,23 @@ def add_to_cart(request):
 
     # name = postdata['name']
 
-    panier = postdata['panier']
-    produit = postdata['produit']
-    quantite = postdata['quantite']
+    # Le panier vient de la session : les pages produit mises en cache n'en portent pas l'id
+    panier = panier_courant(request)
+    try:
+        produit = int(postdata.get('produit'))
+        quantite = int(postdata.get('quantite'))
+    except (TypeError, ValueError):
+        produit, quantite = None, 0
     isSuccess = False
-    if panier is not None and produit is not None and quantite is not None:
-        panier = models.Panier.objects.get(id=panier)
-        produit = shop_models.Produit.objects.get(id=produit)
+    if panier is not None and produit is not None and quantite > 0 \
+            and shop_models.Produit.objects.filter(id=produit, status=True).exists():
+        # Upsert atomique : deux onglets qui ajoutent en même temps ne dupliquent pas la ligne
         try:
-            produit_panier = models.ProduitPanier.objects.get(produit=produit, panier=panier)
-
-        except Exception as e:
-
-            produit_panier = models.ProduitPanier()
-        produit_panier.panier = panier
-        produit_panier.produit = produit
-        produit_panier.quantite = quantite
-        produit_panier.save()
-        isSuccess = True
-        message = "Produit ajouté au panier avec succès"
+            ajouter_produit(panier, produit, quantite)
+            isSuccess = True
+            message = "Produit ajouté au panier avec succès"
+        except ValueError as e:
+            message = str(e)
     else:
         isSuccess = False
         message = "Une erreur s'est produite"
@@ -212,80 +216,69 @@ def add_to_cart(request):
     return JsonResponse(data, safe=False)
 
 
-def delete_from_cart(request):
-    postdata = json.loads(request.body.decode('utf-8'))
-
-    # name = postdata['name']
+@require_GET
+@never_cache
+@ensure_csrf_cookie
+def mini_panier(request):
+    """Badge et contenu du mini-panier du header, seule partie de la page propre au visiteur."""
+    panier = panier_existant(request)
+    data = {
+        'success': True,
+        'nombre': panier.nb_articles,
+        'html': render_to_string('partials/mini-panier.html', {'cart': panier}, request=request),
+    }
+    return JsonResponse(data, safe=False)
 
-    panier = postdata['panier']
-    produit_panier = postdata['produit_panier']
 
-    isSuccess = False
-    if panier is not None and produit_panier is not None :
-        produit_panier = models.ProduitPanier.objects.get(id=produit_panier)
-        produit_panier.delete()
-        isSuccess = True
-        message = "Produit supprimé avec succès"
-    else:
-        isSuccess = False
-        message = "Une erreur s'est produite"
+@require_POST
+def modifier_panier(request):
+    """Applique en un appel les ajouts, modifications et suppressions regroupés par le navigateur."""
+    try:
+        postdata = json.loads(request.body.decode('utf-8'))
+    except ValueError:
+        postdata = {}
+    panier = panier_courant(request)
+    if panier is None or not isinstance(postdata, dict):
+        return JsonResponse({'success': False, 'message': "Une erreur s'est produite"})
+    try:
+        appliquer_operations(panier, postdata.get('operations'))
+    except ValueError as e:
+        return JsonResponse({'success': False, 'message': str(e)})
     data = {
-        'message': message,
-        'success': isSuccess
+        'success': True,
+        'message': "Panier modifié avec succès",
+        'panier': {
+            'nb_articles': panier.nb_articles,
+            'sous_total': panier.sous_total,
+            'total_remise': panier.total_remise,
+        },
     }
     return JsonResponse(data, safe=False)
 
 
+@require_POST
 def add_coupon(request):
-    postdata = json.loads(request.body.decode('utf-8'))
-
-    # name = postdata['name']
-
-    panier = postdata['panier']
-    coupon = postdata['coupon']
+    """Applique un code promo au panier du visiteur ; l'id de panier envoyé par le navigateur est ignoré."""
+    try:
+        postdata = json.loads(request.body.decode('utf-8'))
+    except ValueError:
+        postdata = {}
+    coupon = postdata.get('coupon') if isinstance(postdata, dict) else None
+    panier = panier_existant(request)
 
     isSuccess = False
-    if panier is not None and coupon is not None :
-        try:
-            coupon = models.CodePromotionnel.objects.get(code_promo=coupon)
-            panier = models.Panier.objects.get(id=panier)
+    if not panier:
+        message = "Votre panier est vide"
+    elif coupon:
+        coupon = models.CodePromotionnel.objects.filter(code_promo=coupon).first()
+        if coupon is not None:
             panier.coupon = coupon
             panier.save()
             isSuccess = True
             message = "Félicitations, vous avez ajouté un code coupon"
-        except:
-            isSuccess = False
+        else:
             message = "Code coupon invalide"
     else:
-        isSuccess = False
-        message = "Une erreur s'est produite"
-    data = {
-        'message': message,
-        'success': isSuccess
-    }
-    return JsonResponse(data, safe=False)
-
-
-def update_cart(request):
-    postdata = json.loads(request.body.decode('utf-8'))
-
-    # name = postdata['name']
-
-    panier = postdata['panier']
-    produit = postdata['produit']
-    quantite = postdata['quantite']
-
-    isSuccess = False
-    if panier is not None and produit is not None :
-        panier = models.Panier.objects.get(id=panier)
-        produit = shop_models.Produit.objects.get(id=produit)
-        produit_panier = models.ProduitPanier.objects.get(panier=panier, produit=produit)
-        produit_panier.quantite = quantite
-        produit_panier.save()
-        isSuccess = True
-        message = "Panier modifié avec succès"
-    else:
-        isSuccess = False
         message = "Une erreur s'est produite"
     data = {
         'message': message,
@@ -308,14 +301,13 @@ def request_reset_password(request):
             token.token = get_random_string(64)
             token.save()
 
-            # Envoyer l'e-mail
+            # Envoyer l'e-mail : mis en file, la requête n'attend pas le serveur SMTP
             reset_url = request.build_absolute_uri(reverse('reset_password', args=[token.token]))
-            send_mail(
+            taches.differer_email(
                 'Réinitialisation de mot de passe',
                 f'Cliquez sur le lien suivant pour réinitialiser votre mot de passe : {reset_url}',
-                'nguessanlandry216@gmail.com',
                 [user.email],
-                fail_silently=False,
+                expediteur='nguessanlandry216@gmail.com',
             )
 
             messages.success(request, 'Un e-mail de réinitialisation a été envoyé.')
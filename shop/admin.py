@@ -110,6 +110,8 @@ class ProduitAdmin(admin.ModelAdmin):
         'prix_promotionnel',
         'date_debut_promo',
         'date_fin_promo',
+        'promo_active',
+        'prix_effectif',
         'categorie_etab',
         'categorie',
         'etablissement',
@@ -125,6 +127,7 @@ class ProduitAdmin(admin.ModelAdmin):
     list_filter = (
         'date_debut_promo',
         'date_fin_promo',
+        'promo_active',
         'categorie_etab',
         'categorie',
         'etablissement',
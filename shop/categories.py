@@ -0,0 +1,56 @@
+"""
+Arbre de navigation des catégories (menu du header, barre latérale des deals).
+
+CategorieEtablissement -> CategorieProduit, avec le nombre de produits actifs de
+chaque nœud lu dans les compteurs de facettes. L'arbre est construit en trois
+requêtes puis mis en cache ; shop.signals l'invalide quand une catégorie ou un
+produit change.
+"""
+from django.core.cache import cache
+
+from . import models
+
+
+CLE_CACHE = 'shop:arbre_categories'
+
+# Filet de sécurité si une modification échappe aux signaux (update() en masse)
+DUREE_CACHE = 60 * 60
+
+
+def _nombres(facette):
+    return dict(models.FacetProduit.objects.filter(facette=facette).values_list('valeur', 'nombre'))
+
+
+def construire():
+    nombres_etab = _nombres('categorie_etab')
+    nombres_produit = _nombres('categorie')
+    enfants = {}
+    for categorie in models.CategorieProduit.objects.filter(status=True).order_by('nom').values('id', 'nom', 'slug', 'categorie_id'):
+        enfants.setdefault(categorie['categorie_id'], []).append({
+            'id': categorie['id'],
+            'nom': categorie['nom'],
+            'slug': categorie['slug'],
+            'nombre': nombres_produit.get(str(categorie['id']), 0),
+        })
+    return [
+        {
+            'id': categorie['id'],
+            'nom': categorie['nom'],
+            'slug': categorie['slug'],
+            'nombre': nombres_etab.get(str(categorie['id']), 0),
+            'enfants': enfants.get(categorie['id'], []),
+        }
+        for categorie in models.CategorieEtablissement.objects.filter(status=True).values('id', 'nom', 'slug')
+    ]
+
+
+def arbre():
+    noeuds = cache.get(CLE_CACHE)
+    if noeuds is None:
+        noeuds = construire()
+        cache.set(CLE_CACHE, noeuds, DUREE_CACHE)
+    return noeuds
+
+
+def invalider():
+    cache.delete(CLE_CACHE)
@@ -0,0 +1,65 @@
+from django_cron import CronJobBase, Schedule
+from django_cron.models import CronJobLog
+
+from shop import facettes, notifications, promotions, reservations, similaires
+
+
+class BasculerPromotionsCronJob(CronJobBase):
+    # Les fenêtres de promotion sont des jours : une bascule juste après minuit suffit
+    RUN_AT_TIMES = ['00:00']
+
+    schedule = Schedule(run_at_times=RUN_AT_TIMES)
+    code = 'shop.basculer_promotions'
+
+    def do(self):
+        actives, terminees = promotions.basculer_promotions()
+        print(f"{actives} promotions activées, {terminees} terminées.")
+
+
+class RecalculerFacettesCronJob(CronJobBase):
+    # Les update() en masse ne passent pas par les signaux : on recale chaque jour.
+    RUN_AT_TIMES = ['00:05']
+
+    schedule = Schedule(run_at_times=RUN_AT_TIMES)
+    code = 'shop.recalculer_facettes'
+
+    def do(self):
+        facettes.reconstruire()
+        print("Facettes des deals recalculées.")
+
+
+class CalculerSimilairesCronJob(CronJobBase):
+    # Recalcul incrémental des produits modifiés depuis la dernière exécution réussie
+    RUN_EVERY_MINS = 60
+
+    schedule = Schedule(run_every_mins=RUN_EVERY_MINS)
+    code = 'shop.calculer_similaires'
+
+    def do(self):
+        derniere = CronJobLog.objects.filter(code=self.code, is_success=True).order_by('-start_time').first()
+        modifies = similaires.modifies_depuis(derniere.start_time) if derniere else None
+        total = similaires.calculer(modifies)
+        print(f"Voisins recalculés pour {total} produits.")
+
+
+class LibererReservationsCronJob(CronJobBase):
+    RUN_EVERY_MINS = 5
+
+    schedule = Schedule(run_every_mins=RUN_EVERY_MINS)
+    code = 'shop.liberer_reservations'
+
+    def do(self):
+        total = reservations.liberer_expirees()
+        print(f"{total} réservations expirées supprimées.")
+
+
+class TraiterNotificationsCronJob(CronJobBase):
+    # Un lot par minute : relit chez CinetPay l'état des paiements notifiés et des notifications repoussées
+    RUN_EVERY_MINS = 1
+
+    schedule = Schedule(run_every_mins=RUN_EVERY_MINS)
+    code = 'shop.traiter_notifications'
+
+    def do(self):
+        total = notifications.traiter()
+        print(f"{total} notifications de paiement traitées.")
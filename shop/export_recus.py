@@ -0,0 +1,166 @@
+"""
+Export des reçus d'un établissement en une archive ZIP diffusée.
+
+L'archive est produite au fil de la réponse : chaque reçu y est écrit dès qu'il
+est prêt et les octets de l'archive sont aussitôt envoyés, la mémoire reste
+donc constante quel que soit le nombre de commandes. Les reçus déjà rendus
+(client.recus) sont repris tels quels ; les autres sont rendus par un pool de
+processus partagé (settings.RENDU_PDF['PROCESSUS']), au plus EN_VOL par
+processus à la fois, puis enregistrés comme le ferait un téléchargement.
+L'archive se termine par manifeste.csv : une ligne par commande, avec le nom
+du fichier ou l'erreur de rendu.
+"""
+import csv
+import io
+import multiprocessing
+import tempfile
+import threading
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import django
+from django.conf import settings
+from django.utils import timezone
+
+from client import moteurs_pdf, recus
+
+
+# Rendus soumis et non encore écrits, par processus du pool
+EN_VOL = 2
+
+# Au-delà, le manifeste en cours d'écriture passe de la mémoire à un fichier temporaire
+TAILLE_MANIFESTE_MEMOIRE = 1024 * 1024
+
+COLONNES = ('commande', 'transaction_id', 'date', 'client', 'prix_total', 'fichier', 'statut')
+
+
+class _Tampon:
+    # Fichier en écriture seule que ZipFile remplit et que le générateur vide ; sans
+    # tell() ni seek(), ZipFile écrit les tailles après chaque fichier (data descriptor)
+    def __init__(self):
+        self.morceaux = []
+
+    def write(self, donnees):
+        self.morceaux.append(bytes(donnees))
+        return len(donnees)
+
+    def flush(self):
+        pass
+
+    def vider(self):
+        donnees = b''.join(self.morceaux)
+        self.morceaux = []
+        return donnees
+
+
+_pool = None
+_verrou = threading.Lock()
+
+
+def pool():
+    """Pool de rendu du processus, créé au premier export ('spawn' : rien n'est hérité du serveur web)."""
+    global _pool
+    with _verrou:
+        if _pool is None:
+            # django.setup() avant tout : les tâches reçues contiennent des modèles
+            _pool = ProcessPoolExecutor(
+                settings.RENDU_PDF['PROCESSUS'],
+                mp_context=multiprocessing.get_context('spawn'), initializer=django.setup,
+            )
+        return _pool
+
+
+def _soumettre(moteur, contexte):
+    global _pool
+    try:
+        return pool().submit(_rendre, moteur, contexte)
+    except BrokenProcessPool:
+        # Processus du pool tué (mémoire) : un nouveau pool pour cet export et les suivants
+        with _verrou:
+            _pool = None
+        return pool().submit(_rendre, moteur, contexte)
+
+
+def _rendre(moteur, contexte):
+    # Exécuté dans un processus du pool
+    return moteurs_pdf.moteur(moteur).rendre(contexte)
+
+
+def nom_fichier(commande):
+    return 'recus/Recu_%s.pdf' % (commande.transaction_id or commande.id)
+
+
+def exporter(commandes, detail_url, logo_url):
+    """
+    Génère les octets de l'archive des reçus des commandes, au fil des rendus.
+
+    detail_url(commande) donne l'URL du QR code d'une commande, logo_url celle du
+    logo ; commandes est parcouru une seule fois, par morceaux.
+    """
+    tampon = _Tampon()
+    archive = zipfile.ZipFile(tampon, 'w')
+    manifeste = io.TextIOWrapper(
+        tempfile.SpooledTemporaryFile(max_size=TAILLE_MANIFESTE_MEMOIRE), encoding='utf-8', newline='',
+    )
+    lignes = csv.writer(manifeste)
+    lignes.writerow(COLONNES)
+    moteur = settings.RENDU_PDF['MOTEUR']
+    en_vol = {}
+    limite = settings.RENDU_PDF['PROCESSUS'] * EN_VOL
+
+    def ecrire(commande, pdf, erreur=None):
+        fichier = '' if erreur else nom_fichier(commande)
+        if not erreur:
+            date = timezone.localtime(commande.date_add).timetuple()[:6]
+            archive.writestr(zipfile.ZipInfo(fichier, date), pdf)
+        client = commande.customer.user if commande.customer_id else None
+        lignes.writerow((
+            commande.id, commande.transaction_id or '', timezone.localtime(commande.date_add).isoformat(),
+            client.get_full_name() if client else '', commande.prix_total, fichier, erreur or 'ok',
+        ))
+
+    def terminer(futurs):
+        for futur in futurs:
+            commande, empreinte = en_vol.pop(futur)
+            try:
+                pdf = futur.result()
+            except Exception as e:
+                ecrire(commande, None, str(e) or type(e).__name__)
+                continue
+            recus.enregistrer(commande, empreinte, pdf)
+            ecrire(commande, pdf)
+
+    try:
+        for commande in commandes.iterator(chunk_size=100):
+            empreinte = recus.empreinte(commande, detail_url(commande), logo_url)
+            if recus.a_jour(commande, empreinte):
+                with commande.recu_paiement.open('rb') as fichier:
+                    ecrire(commande, fichier.read())
+            else:
+                contexte = recus.contexte(commande, detail_url(commande), logo_url)
+                en_vol[_soumettre(moteur, contexte)] = (commande, empreinte)
+                if len(en_vol) >= limite:
+                    terminer(wait(en_vol, return_when=FIRST_COMPLETED).done)
+            yield tampon.vider()
+        while en_vol:
+            terminer(wait(en_vol, return_when=FIRST_COMPLETED).done)
+            yield tampon.vider()
+
+        manifeste.flush()
+        manifeste.buffer.seek(0)
+        entree = zipfile.ZipInfo('manifeste.csv', timezone.localtime().timetuple()[:6])
+        entree.compress_type = zipfile.ZIP_DEFLATED
+        with archive.open(entree, 'w') as sortie:
+            while True:
+                morceau = manifeste.buffer.read(64 * 1024)
+                if not morceau:
+                    break
+                sortie.write(morceau)
+                yield tampon.vider()
+        archive.close()
+        yield tampon.vider()
+    finally:
+        for futur in en_vol:
+            futur.cancel()
+        manifeste.close()
@@ -0,0 +1,250 @@
+"""
+Facettes de la page des deals.
+
+Les compteurs affichés à côté de chaque filtre sont stockés dans FacetProduit et
+mis à jour de façon incrémentale par les signaux de shop.signals : une requête
+de la page des deals ne fait donc jamais de GROUP BY sur le catalogue.
+"""
+from django.db import transaction
+from django.db.models import Case, Count, ExpressionWrapper, F, FloatField, Q, Value, When
+
+from cities_light.models import City
+
+from base.cache import invalider
+
+from . import categories, models
+
+
+FACETTES = ('categorie_etab', 'categorie', 'ville', 'prix', 'promo')
+
+# (clé, borne basse incluse, borne haute exclue, libellé)
+TRANCHES_PRIX = (
+    ('0-5000', 0, 5000, "Moins de 5 000 F"),
+    ('5000-10000', 5000, 10000, "5 000 à 10 000 F"),
+    ('10000-25000', 10000, 25000, "10 000 à 25 000 F"),
+    ('25000-50000', 25000, 50000, "25 000 à 50 000 F"),
+    ('50000+', 50000, None, "Plus de 50 000 F"),
+)
+
+TRIS = {
+    'recent': ('-date_add', '-id'),
+    'prix': ('prix_effectif', 'id'),
+    '-prix': ('-prix_effectif', '-id'),
+    'remise': ('-remise', '-id'),
+}
+
+LIBELLES_TRI = (
+    ('recent', "Plus récents"),
+    ('prix', "Prix croissant"),
+    ('-prix', "Prix décroissant"),
+    ('remise', "Meilleure remise"),
+)
+
+CHAMPS_FACETTES = {
+    'categorie_etab': 'categorie_etab_id',
+    'categorie': 'categorie_id',
+    'ville': 'etablissement__ville_id',
+}
+
+CHAMPS_ETAT = (
+    'status', 'categorie_id', 'categorie_etab_id', 'etablissement__ville_id',
+    'prix_effectif', 'promo_active',
+)
+
+
+def tranche_prix(prix):
+    if prix is None:
+        return None
+    for cle, bas, haut, _ in TRANCHES_PRIX:
+        if prix >= bas and (haut is None or prix < haut):
+            return cle
+    return None
+
+
+def etat_produit(pk):
+    """Valeurs en base utiles au calcul des facettes d'un produit (None s'il n'existe pas)."""
+    if pk is None:
+        return None
+    return models.Produit.objects.filter(pk=pk).values(*CHAMPS_ETAT).first()
+
+
+def cles(etat):
+    """Ensemble des (facette, valeur) comptant le produit ; vide pour un produit inactif."""
+    if not etat or not etat['status']:
+        return set()
+    valeurs = {
+        ('categorie_etab', etat['categorie_etab_id']),
+        ('categorie', etat['categorie_id']),
+        ('ville', etat['etablissement__ville_id']),
+        ('prix', tranche_prix(etat['prix_effectif'])),
+    }
+    if etat['promo_active']:
+        valeurs.add(('promo', '1'))
+    return {(facette, str(valeur)) for facette, valeur in valeurs if valeur is not None}
+
+
+def _ajuster(facette, valeur, delta):
+    # UPDATE atomique : deux sauvegardes concurrentes ne perdent pas d'incrément
+    lignes = models.FacetProduit.objects.filter(facette=facette, valeur=valeur).update(nombre=F('nombre') + delta)
+    if not lignes and delta > 0:
+        models.FacetProduit.objects.get_or_create(facette=facette, valeur=valeur, defaults={'nombre': 0})
+        models.FacetProduit.objects.filter(facette=facette, valeur=valeur).update(nombre=F('nombre') + delta)
+
+
+def appliquer_changement(avant, apres):
+    """Décrémente les facettes quittées par le produit et incrémente les nouvelles."""
+    cles_avant, cles_apres = cles(avant), cles(apres)
+    with transaction.atomic():
+        for facette, valeur in sorted(cles_avant - cles_apres):
+            _ajuster(facette, valeur, -1)
+        for facette, valeur in sorted(cles_apres - cles_avant):
+            _ajuster(facette, valeur, 1)
+
+
+def _compter(facette, produits):
+    actifs = produits.filter(status=True)
+    if facette == 'promo':
+        total = actifs.filter(promo_active=True).count()
+        return {'1': total} if total else {}
+    if facette == 'prix':
+        conditions = []
+        for cle, bas, haut, _ in TRANCHES_PRIX:
+            condition = Q(prix_effectif__gte=bas)
+            if haut is not None:
+                condition &= Q(prix_effectif__lt=haut)
+            conditions.append(When(condition, then=Value(cle)))
+        lignes = actifs.annotate(tranche=Case(*conditions)).values('tranche').annotate(nombre=Count('id')).order_by()
+        return {ligne['tranche']: ligne['nombre'] for ligne in lignes if ligne['tranche']}
+    champ = CHAMPS_FACETTES[facette]
+    lignes = actifs.values(champ).annotate(nombre=Count('id')).order_by()
+    return {str(ligne[champ]): ligne['nombre'] for ligne in lignes if ligne[champ] is not None}
+
+
+def reconstruire(facettes=FACETTES):
+    """
+    Recalcule entièrement les compteurs des facettes données.
+
+    Utilisé par la commande reconstruire_facettes et le cron quotidien (les promotions
+    commencent et finissent sans que le produit soit modifié).
+    """
+    with transaction.atomic():
+        for facette in facettes:
+            nombres = _compter(facette, models.Produit.objects.all())
+            models.FacetProduit.objects.filter(facette=facette).delete()
+            models.FacetProduit.objects.bulk_create([
+                models.FacetProduit(facette=facette, valeur=valeur, nombre=nombre)
+                for valeur, nombre in nombres.items()
+            ])
+    categories.invalider()
+    invalider('produits')
+
+
+def deplacer(facette, ancienne, nouvelle, nombre):
+    """Transfère nombre produits d'une valeur de facette à une autre (ex: établissement qui change de ville)."""
+    if not nombre or ancienne == nouvelle:
+        return
+    with transaction.atomic():
+        if ancienne is not None:
+            _ajuster(facette, str(ancienne), -nombre)
+        if nouvelle is not None:
+            _ajuster(facette, str(nouvelle), nombre)
+    categories.invalider()
+
+
+def compteurs():
+    """{facette: {valeur: nombre}} lu en une requête."""
+    resultat = {facette: {} for facette in FACETTES}
+    for ligne in models.FacetProduit.objects.filter(nombre__gt=0).values('facette', 'valeur', 'nombre'):
+        resultat.setdefault(ligne['facette'], {})[ligne['valeur']] = ligne['nombre']
+    return resultat
+
+
+def selection(params):
+    """Filtres demandés dans la querystring, limités aux valeurs reconnues."""
+    choisis = {}
+    for facette in CHAMPS_FACETTES:
+        valeur = params.get(facette, '')
+        if valeur.isdigit():
+            choisis[facette] = valeur
+    if params.get('prix') in {cle for cle, _, _, _ in TRANCHES_PRIX}:
+        choisis['prix'] = params['prix']
+    if params.get('promo') == '1':
+        choisis['promo'] = '1'
+    return choisis
+
+
+def filtrer(produits, choisis):
+    for facette, champ in CHAMPS_FACETTES.items():
+        if facette in choisis:
+            produits = produits.filter(**{champ: choisis[facette]})
+    if 'prix' in choisis:
+        for cle, bas, haut, _ in TRANCHES_PRIX:
+            if cle == choisis['prix']:
+                produits = produits.filter(prix_effectif__gte=bas)
+                if haut is not None:
+                    produits = produits.filter(prix_effectif__lt=haut)
+    if 'promo' in choisis:
+        produits = produits.filter(promo_active=True)
+    return produits
+
+
+def trier(produits, tri):
+    """Retourne (queryset, ordre keyset) pour le tri demandé ; 'recent' par défaut."""
+    if tri not in TRIS:
+        tri = 'recent'
+    if tri == 'remise':
+        produits = produits.annotate(remise=ExpressionWrapper(F('prix') - F('prix_effectif'), output_field=FloatField()))
+    return produits, TRIS[tri]
+
+
+def _url(params, facette, valeur):
+    query = params.copy()
+    query.pop('curseur', None)
+    if query.get(facette) == valeur:
+        query.pop(facette, None)
+    else:
+        query[facette] = valeur
+    return '?' + query.urlencode()
+
+
+def blocs(params, choisis):
+    """Facettes prêtes à afficher : libellé, compteur, lien (params est un QueryDict) qui active/désactive le filtre."""
+    nombres = compteurs()
+
+    def ids(facette):
+        return [int(v) for v in nombres[facette]]
+
+    libelles = {
+        'categorie_etab': {str(o.pk): o.nom for o in models.CategorieEtablissement.objects.filter(pk__in=ids('categorie_etab'))},
+        'categorie': {str(o.pk): o.nom for o in models.CategorieProduit.objects.filter(pk__in=ids('categorie'))},
+        'ville': {str(o.pk): o.name for o in City.objects.filter(pk__in=ids('ville'))},
+        'prix': {cle: libelle for cle, _, _, libelle in TRANCHES_PRIX},
+        'promo': {'1': "En promotion"},
+    }
+    titres = (
+        ('promo', "Promotions"),
+        ('categorie_etab', "Type d'établissement"),
+        ('categorie', "Catégorie"),
+        ('ville', "Ville"),
+        ('prix', "Prix"),
+    )
+    resultat = []
+    for facette, titre in titres:
+        valeurs = [
+            {
+                'valeur': valeur,
+                'libelle': libelles[facette].get(valeur, valeur),
+                'nombre': nombre,
+                'actif': choisis.get(facette) == valeur,
+                'url': _url(params, facette, valeur),
+            }
+            for valeur, nombre in nombres[facette].items()
+        ]
+        if facette == 'prix':
+            ordre = [cle for cle, _, _, _ in TRANCHES_PRIX]
+            valeurs.sort(key=lambda v: ordre.index(v['valeur']))
+        else:
+            valeurs.sort(key=lambda v: v['libelle'])
+        if valeurs:
+            resultat.append({'facette': facette, 'titre': titre, 'valeurs': valeurs})
+    return resultat
@@ -0,0 +1,42 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop import promotions
+
+
+# Intervalle maximal (secondes) entre deux recalculs de la prochaine bascule
+REVERIFICATION = 15 * 60
+
+
+class Command(BaseCommand):
+    help = "Active/désactive les promotions dont la fenêtre commence ou se termine aujourd'hui"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--watch', action='store_true',
+                            help="Reste actif et bascule à chaque minuit où une promotion change d'état")
+
+    def basculer(self):
+        actives, terminees = promotions.basculer_promotions()
+        self.stdout.write(self.style.SUCCESS(f"{actives} promotions activées, {terminees} terminées."))
+
+    def handle(self, *args, **options):
+        self.basculer()
+        if not options['watch']:
+            return
+        prochaine = None
+        while True:
+            # Une promotion créée entre-temps peut avancer la bascule : on recalcule régulièrement
+            nouvelle = promotions.prochaine_bascule()
+            if nouvelle != prochaine and nouvelle:
+                self.stdout.write(f"Prochaine bascule le {nouvelle:%d/%m/%Y}.")
+            prochaine = nouvelle
+            if prochaine is None:
+                time.sleep(REVERIFICATION)
+                continue
+            attente = (datetime.datetime.combine(prochaine, datetime.time.min) - datetime.datetime.now()).total_seconds()
+            if attente > 0:
+                time.sleep(min(attente, REVERIFICATION))
+                continue
+            self.basculer()
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+
+from shop import similaires
+
+
+class Command(BaseCommand):
+    help = "Calcule les deals similaires de tout le catalogue, ou seulement des produits modifiés"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--produits', nargs='+', type=int, help="Ids des produits modifiés")
+        parser.add_argument('--depuis', help="Produits modifiés depuis cette date (AAAA-MM-JJ HH:MM)")
+
+    def handle(self, *args, **options):
+        modifies = options['produits']
+        if options['depuis']:
+            date = parse_datetime(options['depuis'])
+            if date is None:
+                raise CommandError("Date invalide : %s" % options['depuis'])
+            modifies = (modifies or []) + similaires.modifies_depuis(date)
+        total = similaires.calculer(modifies)
+        self.stdout.write(self.style.SUCCESS(f"Voisins recalculés pour {total} produits."))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from shop import reservations
+
+
+class Command(BaseCommand):
+    help = "Supprime par lots les réservations de stock expirées"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lot', type=int, default=reservations.TAILLE_LOT, help="Réservations supprimées par transaction")
+
+    def handle(self, *args, **options):
+        total = reservations.liberer_expirees(taille_lot=options['lot'])
+        self.stdout.write(self.style.SUCCESS(f"{total} réservations expirées supprimées."))
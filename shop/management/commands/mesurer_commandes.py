@@ -0,0 +1,77 @@
+import json
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import RequestFactory, override_settings
+
+from customer import models as customer_models
+from shop import models, views
+from shop.paiement_factice import ServeurFactice
+
+
+class Command(BaseCommand):
+    help = (
+        "Mesure le débit (commandes par seconde) de la validation de commande "
+        "post_paiement_details, paiement initialisé auprès du serveur factice ; "
+        "les données créées sont annulées à la fin"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--commandes', type=int, default=200, help="Nombre de commandes passées")
+        parser.add_argument('--lignes', type=int, default=5, help="Produits par panier")
+        parser.add_argument('--latence', type=float, default=0, help="Latence simulée du fournisseur, en secondes")
+
+    def handle(self, *args, **options):
+        serveur = ServeurFactice(latence=options['latence']).demarrer()
+        try:
+            with override_settings(CINETPAY=dict(settings.CINETPAY, URL=serveur.url)):
+                self._mesurer(options['commandes'], options['lignes'])
+        finally:
+            serveur.arreter()
+
+    def _mesurer(self, nombre, lignes):
+        with transaction.atomic():
+            produits, clients = self._preparer(nombre, lignes)
+            factory = RequestFactory()
+            reussies = 0
+            debut = time.perf_counter()
+            for i, (user, panier) in enumerate(clients):
+                request = factory.post('/', json.dumps({
+                    'transaction_id': 'mesure-%d' % i, 'notify_url': '/', 'return_url': '/', 'panier': panier.id,
+                }), content_type='application/json')
+                request.user = user
+                reussies += json.loads(views.post_paiement_details(request).content)['success']
+            duree = time.perf_counter() - debut
+            transaction.set_rollback(True)
+
+        self.stdout.write(f"{reussies}/{nombre} commandes de {lignes} lignes en {duree:.2f}s")
+        self.stdout.write(self.style.SUCCESS(f"{nombre / duree:.1f} commandes par seconde"))
+
+    def _preparer(self, nombre, lignes):
+        proprietaire = User.objects.create_user(username='mesure-proprietaire')
+        categorie_etab = models.CategorieEtablissement.objects.create(nom="Mesure", description="Mesure")
+        categorie = models.CategorieProduit.objects.create(nom="Mesure", description="Mesure", categorie=categorie_etab)
+        etablissement = models.Etablissement.objects.create(
+            user=proprietaire, nom="Mesure", description="Mesure", categorie=categorie_etab,
+            nom_du_responsable="M", prenoms_duresponsable="M", adresse="M", pays="CI", contact_1="0", email="m@m.com",
+        )
+        produits = [
+            models.Produit.objects.create(
+                nom="Mesure %d" % i, prix=1000, quantite=nombre * 10, categorie=categorie, etablissement=etablissement,
+            )
+            for i in range(lignes)
+        ]
+        clients = []
+        for i in range(nombre):
+            user = User.objects.create_user(username='mesure-client-%d' % i)
+            customer = customer_models.Customer.objects.create(user=user, adresse="M", contact_1="0")
+            panier = customer_models.Panier.objects.create(customer=customer)
+            customer_models.ProduitPanier.objects.bulk_create([
+                customer_models.ProduitPanier(panier=panier, produit=produit, quantite=1) for produit in produits
+            ])
+            panier.recalculer()
+            clients.append((user, panier))
+        return produits, clients
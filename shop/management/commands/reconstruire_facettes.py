@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from shop import facettes
+
+
+class Command(BaseCommand):
+    help = "Recalcule les compteurs des facettes de la page des deals"
+
+    def add_arguments(self, parser):
+        parser.add_argument('facettes', nargs='*', choices=facettes.FACETTES,
+                            help="Facettes à recalculer (toutes par défaut)")
+
+    def handle(self, *args, **options):
+        choisies = options['facettes'] or facettes.FACETTES
+        facettes.reconstruire(choisies)
+        self.stdout.write(self.style.SUCCESS(f"Facettes recalculées : {', '.join(choisies)}."))
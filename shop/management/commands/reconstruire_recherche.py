@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from shop import recherche
+
+
+class Command(BaseCommand):
+    help = "Reconstruit entièrement l'index de recherche plein texte des produits"
+
+    def handle(self, *args, **options):
+        if recherche.moteur() is None:
+            self.stdout.write(self.style.WARNING(
+                "Aucun moteur plein texte pour cette base : la recherche utilise icontains."
+            ))
+            return
+        with transaction.atomic():
+            total = recherche.reconstruire_index()
+        self.stdout.write(self.style.SUCCESS(f"{total} produits indexés ({recherche.moteur()})."))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from shop.paiement_factice import ServeurFactice
+
+
+class Command(BaseCommand):
+    help = (
+        "Lance le serveur factice de l'API CinetPay (développement hors ligne, tests de charge) ; "
+        "settings.CINETPAY['URL'] le vise par défaut hors production"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=8001)
+        parser.add_argument('--latence', type=float, default=0, help="Secondes d'attente avant chaque réponse de l'API")
+        parser.add_argument('--taux-erreur', type=float, default=0, help="Part des appels répondus en 503 (0 à 1)")
+        parser.add_argument('--repetitions', type=int, default=1, help="Notifications postées par paiement terminé")
+
+    def handle(self, *args, **options):
+        serveur = ServeurFactice(
+            port=options['port'], latence=options['latence'], taux_erreur=options['taux_erreur'],
+            repetitions=options['repetitions'], verbeux=True,
+        )
+        self.stdout.write(self.style.SUCCESS(f"Serveur de paiement factice sur {serveur.url}"))
+        try:
+            serveur.servir()
+        except KeyboardInterrupt:
+            serveur.arreter()
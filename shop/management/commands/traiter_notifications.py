@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop import notifications
+
+
+class Command(BaseCommand):
+    help = (
+        "Applique aux commandes les notifications de paiement reçues ; "
+        "avec --continu, tourne comme worker et surveille la file"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lot', type=int, default=notifications.TAILLE_LOT, help="Notifications réservées à la fois")
+        parser.add_argument('--continu', action='store_true', help="Ne s'arrête pas quand la file est vide")
+        parser.add_argument('--intervalle', type=float, default=1, help="Secondes entre deux scrutations de la file vide")
+
+    def handle(self, *args, **options):
+        while True:
+            total = notifications.traiter(taille_lot=options['lot'])
+            if total or not options['continu']:
+                self.stdout.write(self.style.SUCCESS(f"{total} notifications de paiement traitées."))
+            if not options['continu']:
+                return
+            if not total:
+                time.sleep(options['intervalle'])
@@ -0,0 +1,66 @@
+from django.db import migrations
+
+
+SELECT_DOCUMENTS = """
+    SELECT p.id, p.nom, p.description, p.description_deal,
+           COALESCE(cp.nom, '') || ' ' || COALESCE(ce.nom, ''),
+           COALESCE(e.nom, '')
+    FROM shop_produit p
+    LEFT JOIN shop_categorieproduit cp ON cp.id = p.categorie_id
+    LEFT JOIN shop_categorieetablissement ce ON ce.id = p.categorie_etab_id
+    LEFT JOIN shop_etablissement e ON e.id = p.etablissement_id
+"""
+
+
+def creer_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS shop_produit_fts USING fts5("
+            "nom, description, description_deal, categories, etablissement, "
+            "tokenize = 'unicode61 remove_diacritics 2')"
+        )
+        schema_editor.execute(
+            "INSERT INTO shop_produit_fts (rowid, nom, description, description_deal, categories, etablissement) "
+            + SELECT_DOCUMENTS
+        )
+    elif vendor == 'postgresql':
+        schema_editor.execute(
+            "CREATE TABLE IF NOT EXISTS shop_produit_recherche ("
+            "produit_id bigint PRIMARY KEY REFERENCES shop_produit (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+            "document tsvector NOT NULL)"
+        )
+        schema_editor.execute(
+            "CREATE INDEX IF NOT EXISTS shop_produit_recherche_doc_idx ON shop_produit_recherche USING GIN (document)"
+        )
+        schema_editor.execute(
+            "INSERT INTO shop_produit_recherche (produit_id, document) "
+            "SELECT p.id, "
+            "setweight(to_tsvector('french', COALESCE(p.nom, '')), 'A') || "
+            "setweight(to_tsvector('french', COALESCE(cp.nom, '') || ' ' || COALESCE(ce.nom, '') || ' ' || COALESCE(e.nom, '')), 'B') || "
+            "setweight(to_tsvector('french', COALESCE(p.description_deal, '')), 'C') || "
+            "setweight(to_tsvector('french', COALESCE(p.description, '')), 'D') "
+            "FROM shop_produit p "
+            "LEFT JOIN shop_categorieproduit cp ON cp.id = p.categorie_id "
+            "LEFT JOIN shop_categorieetablissement ce ON ce.id = p.categorie_etab_id "
+            "LEFT JOIN shop_etablissement e ON e.id = p.etablissement_id"
+        )
+
+
+def supprimer_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS shop_produit_fts")
+    elif vendor == 'postgresql':
+        schema_editor.execute("DROP TABLE IF EXISTS shop_produit_recherche")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0018_produit_index_liste'),
+    ]
+
+    operations = [
+        migrations.RunPython(creer_index, supprimer_index),
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 4.2.9 on 2026-10-18 15:08
+
+import datetime
+
+from django.db import migrations, models
+from django.db.models import Case, Count, Q, Value, When
+
+
+TRANCHES_PRIX = (
+    ('0-5000', 0, 5000),
+    ('5000-10000', 5000, 10000),
+    ('10000-25000', 10000, 25000),
+    ('25000-50000', 25000, 50000),
+    ('50000+', 50000, None),
+)
+
+CHAMPS_FACETTES = {
+    'categorie_etab': 'categorie_etab_id',
+    'categorie': 'categorie_id',
+    'ville': 'etablissement__ville_id',
+}
+
+
+def calculer_facettes(apps, schema_editor):
+    Produit = apps.get_model('shop', 'Produit')
+    FacetProduit = apps.get_model('shop', 'FacetProduit')
+    actifs = Produit.objects.filter(status=True)
+    nombres = {}
+    for facette, champ in CHAMPS_FACETTES.items():
+        lignes = actifs.values(champ).annotate(nombre=Count('id')).order_by()
+        nombres[facette] = {str(ligne[champ]): ligne['nombre'] for ligne in lignes if ligne[champ] is not None}
+    conditions = []
+    for cle, bas, haut in TRANCHES_PRIX:
+        condition = Q(prix__gte=bas)
+        if haut is not None:
+            condition &= Q(prix__lt=haut)
+        conditions.append(When(condition, then=Value(cle)))
+    lignes = actifs.annotate(tranche=Case(*conditions)).values('tranche').annotate(nombre=Count('id')).order_by()
+    nombres['prix'] = {ligne['tranche']: ligne['nombre'] for ligne in lignes if ligne['tranche']}
+    jour = datetime.date.today()
+    promo = actifs.filter(date_debut_promo__lte=jour, date_fin_promo__gte=jour).count()
+    nombres['promo'] = {'1': promo} if promo else {}
+    FacetProduit.objects.bulk_create([
+        FacetProduit(facette=facette, valeur=valeur, nombre=nombre)
+        for facette, valeurs in nombres.items() for valeur, nombre in valeurs.items()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0019_produit_index_recherche'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FacetProduit',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('facette', models.CharField(max_length=30)),
+                ('valeur', models.CharField(max_length=50)),
+                ('nombre', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='produit',
+            index=models.Index(fields=['status', 'prix', 'id'], name='produit_prix_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='produit',
+            index=models.Index(fields=['date_fin_promo', 'date_debut_promo'], name='produit_promo_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='facetproduit',
+            constraint=models.UniqueConstraint(fields=('facette', 'valeur'), name='facet_produit_unique'),
+        ),
+        migrations.RunPython(calculer_facettes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 4.2.9 on 2026-10-18 15:10
+
+import datetime
+
+from django.db import migrations, models
+from django.db.models import Case, Count, F, Q, Value, When
+
+
+TRANCHES_PRIX = (
+    ('0-5000', 0, 5000),
+    ('5000-10000', 5000, 10000),
+    ('10000-25000', 10000, 25000),
+    ('25000-50000', 25000, 50000),
+    ('50000+', 50000, None),
+)
+
+
+def initialiser_promotions(apps, schema_editor):
+    Produit = apps.get_model('shop', 'Produit')
+    FacetProduit = apps.get_model('shop', 'FacetProduit')
+    jour = datetime.date.today()
+    Produit.objects.update(promo_active=False, prix_effectif=F('prix'))
+    Produit.objects.filter(date_debut_promo__lte=jour, date_fin_promo__gte=jour).update(
+        promo_active=True, prix_effectif=F('prix_promotionnel')
+    )
+
+    # Les facettes promo et prix suivent désormais l'état matérialisé
+    actifs = Produit.objects.filter(status=True)
+    conditions = []
+    for cle, bas, haut in TRANCHES_PRIX:
+        condition = Q(prix_effectif__gte=bas)
+        if haut is not None:
+            condition &= Q(prix_effectif__lt=haut)
+        conditions.append(When(condition, then=Value(cle)))
+    lignes = actifs.annotate(tranche=Case(*conditions)).values('tranche').annotate(nombre=Count('id')).order_by()
+    promo = actifs.filter(promo_active=True).count()
+    FacetProduit.objects.filter(facette__in=['promo', 'prix']).delete()
+    FacetProduit.objects.bulk_create(
+        [FacetProduit(facette='prix', valeur=l['tranche'], nombre=l['nombre']) for l in lignes if l['tranche']]
+        + ([FacetProduit(facette='promo', valeur='1', nombre=promo)] if promo else [])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0020_facetproduit'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='produit',
+            name='produit_prix_idx',
+        ),
+        migrations.AddField(
+            model_name='produit',
+            name='prix_effectif',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='produit',
+            name='promo_active',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='produit',
+            index=models.Index(fields=['status', 'prix_effectif', 'id'], name='produit_prix_effectif_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='produit',
+            index=models.Index(fields=['status', 'promo_active', 'date_fin_promo', 'id'], name='produit_fin_promo_idx'),
+        ),
+        migrations.RunPython(initialiser_promotions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.9 on 2026-10-18 15:14
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0021_produit_promotion_materialisee'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProduitSimilaire',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rang', models.PositiveSmallIntegerField()),
+                ('score', models.FloatField()),
+                ('produit', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similaires', to='shop.produit')),
+                ('similaire', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='shop.produit')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='produitsimilaire',
+            constraint=models.UniqueConstraint(fields=('produit', 'rang'), name='produit_similaire_rang_unique'),
+        ),
+    ]
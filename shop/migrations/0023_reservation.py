@@ -0,0 +1,32 @@
+# Generated by Django 4.2.9 on 2026-10-18 15:42
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customer', '0011_panier_client_unique'),
+        ('shop', '0022_produitsimilaire'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Reservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantite', models.PositiveIntegerField()),
+                ('expire_le', models.DateTimeField()),
+                ('panier', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='customer.panier')),
+                ('produit', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='shop.produit')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['produit', 'expire_le'], name='reservation_produit_idx'), models.Index(fields=['expire_le'], name='reservation_expire_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='reservation',
+            constraint=models.UniqueConstraint(fields=('panier', 'produit'), name='reservation_panier_produit_unique'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.9 on 2026-10-18 16:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0023_reservation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationPaiement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('transaction_id', models.CharField(max_length=100, unique=True)),
+                ('recue_le', models.DateTimeField()),
+                ('a_traiter', models.BooleanField(default=True)),
+                ('prochain_essai', models.DateTimeField()),
+                ('tentatives', models.PositiveIntegerField(default=0)),
+                ('traitee_le', models.DateTimeField(blank=True, null=True)),
+                ('statut', models.CharField(blank=True, max_length=20)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['a_traiter', 'prochain_essai'], name='notification_a_traiter_idx')],
+            },
+        ),
+    ]
@@ -105,36 +105,127 @@ class Produit(models.Model):
     image_2 = models.ImageField(upload_to='produis/images', default="b-1.jpg")
     image_3 = models.ImageField(upload_to='produis/images', default="b-1.jpg")
     super_deal = models.BooleanField(default=False)
+    # État de promotion matérialisé, recalé chaque jour par shop.promotions
+    promo_active = models.BooleanField(default=False, editable=False)
+    prix_effectif = models.FloatField(default=0, editable=False)
 
     date_add = models.DateTimeField(auto_now_add=True)
     date_update = models.DateTimeField(auto_now=True)
     status = models.BooleanField(default=True)
     slug = models.SlugField(unique=True, editable=False, null=True,  blank=True)
 
+    class Meta:
+        # Index couvrant la pagination keyset (date_add, id) des listes de deals
+        indexes = [
+            models.Index(fields=['status', '-date_add', '-id'], name='produit_liste_idx'),
+            models.Index(fields=['categorie', '-date_add', '-id'], name='produit_categorie_liste_idx'),
+            models.Index(fields=['categorie_etab', '-date_add', '-id'], name='produit_cat_etab_liste_idx'),
+            models.Index(fields=['status', 'prix_effectif', 'id'], name='produit_prix_effectif_idx'),
+            models.Index(fields=['date_fin_promo', 'date_debut_promo'], name='produit_promo_idx'),
+            models.Index(fields=['status', 'promo_active', 'date_fin_promo', 'id'], name='produit_fin_promo_idx'),
+        ]
+
     def save(self, *args, **kwargs):
         if not self.slug or self.slug is None:
             self.slug = '-'.join((slugify(self.nom), slugify(datetime.datetime.now().microsecond)))
         self.categorie_etab = self.etablissement.categorie
+        self.calculer_promotion()
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = set(kwargs['update_fields']) | {'promo_active', 'prix_effectif'}
         super(Produit, self).save(*args, **kwargs)
 
     def __str__(self):
         return self.nom
 
+    def calculer_promotion(self, jour=None):
+        jour = jour or datetime.date.today()
+        self.promo_active = bool(
+            self.date_debut_promo and self.date_fin_promo
+            and self.date_debut_promo <= jour <= self.date_fin_promo
+        )
+        self.prix_effectif = self.prix_promotionnel if self.promo_active else self.prix
+
     @property
     def check_promotion(self):
-        result = True
-        if self.date_debut_promo:
-            if self.date_debut_promo > datetime.date.today():
-                result = False
-        else:
-            result = False
-        if self.date_fin_promo:
-            if self.date_fin_promo < datetime.date.today():
-                result = False
-        else:
-            result=False
-        
-        return result
+        return self.promo_active
+
+
+class FacetProduit(models.Model):
+    """Nombre de produits actifs par valeur de facette, tenu à jour par shop.facettes."""
+    facette = models.CharField(max_length=30)
+    valeur = models.CharField(max_length=50)
+    nombre = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['facette', 'valeur'], name='facet_produit_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.facette}={self.valeur} ({self.nombre})"
+
+
+class ProduitSimilaire(models.Model):
+    """Voisins d'un produit calculés par shop.similaires, du plus proche (rang 0) au moins proche."""
+    produit = models.ForeignKey(Produit, related_name='similaires', on_delete=models.CASCADE)
+    similaire = models.ForeignKey(Produit, related_name='+', on_delete=models.CASCADE)
+    rang = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['produit', 'rang'], name='produit_similaire_rang_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.produit_id} -> {self.similaire_id} ({self.score:.2f})"
+
+
+class Reservation(models.Model):
+    """Stock retenu pour un panier jusqu'à expire_le, géré par shop.reservations."""
+    produit = models.ForeignKey(Produit, related_name='reservations', on_delete=models.CASCADE)
+    panier = models.ForeignKey('customer.Panier', related_name='reservations', on_delete=models.CASCADE)
+    quantite = models.PositiveIntegerField()
+    expire_le = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['panier', 'produit'], name='reservation_panier_produit_unique'),
+        ]
+        indexes = [
+            # Somme des réservations vivantes d'un produit
+            models.Index(fields=['produit', 'expire_le'], name='reservation_produit_idx'),
+            models.Index(fields=['expire_le'], name='reservation_expire_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.produit_id} x {self.quantite} (panier {self.panier_id})"
+
+
+class NotificationPaiement(models.Model):
+    """
+    Notification de paiement reçue du fournisseur, traitée en arrière-plan par shop.notifications.
+
+    Une ligne par transaction : les notifications répétées ne font que la
+    remettre à traiter.
+    """
+    transaction_id = models.CharField(max_length=100, unique=True)
+    recue_le = models.DateTimeField()
+    a_traiter = models.BooleanField(default=True)
+    # Repoussé après chaque échec de vérification auprès du fournisseur
+    prochain_essai = models.DateTimeField()
+    tentatives = models.PositiveIntegerField(default=0)
+    traitee_le = models.DateTimeField(null=True, blank=True)
+    statut = models.CharField(max_length=20, blank=True)
+
+    class Meta:
+        indexes = [
+            # File des notifications en attente
+            models.Index(fields=['a_traiter', 'prochain_essai'], name='notification_a_traiter_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.transaction_id} ({self.statut or 'en attente'})"
 
 
 class Favorite(models.Model):
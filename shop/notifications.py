@@ -0,0 +1,83 @@
+"""
+Notifications de paiement du fournisseur.
+
+La vue paiement_notification ne fait qu'enregistrer la notification, en un
+INSERT ... ON CONFLICT sans appel au fournisseur, et répond aussitôt : une
+rafale de notifications ne coûte qu'une écriture chacune, et les doublons d'une
+même transaction se fondent en une ligne. traiter(), lancé en arrière-plan
+(commande traiter_notifications, cron), relit l'état du paiement chez le
+fournisseur (le contenu de la notification n'est pas cru) et met la commande à
+jour. Un fournisseur injoignable repousse la notification, avec un délai
+croissant, jusqu'à MAX_TENTATIVES.
+"""
+import datetime
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from customer import commandes
+
+from . import models, paiement
+
+
+# Notifications réservées à la fois par un worker
+TAILLE_LOT = 50
+
+MAX_TENTATIVES = 10
+
+# Délai avant le prochain essai, multiplié par le nombre de tentatives
+DELAI_ESSAI = datetime.timedelta(seconds=30)
+
+STATUTS_FINAUX = ('ACCEPTED', 'REFUSED')
+
+
+def enregistrer(transaction_id):
+    """Enregistre une notification, ou remet à traiter celle déjà reçue pour la transaction."""
+    maintenant = timezone.now()
+    models.NotificationPaiement.objects.bulk_create(
+        [models.NotificationPaiement(transaction_id=transaction_id, recue_le=maintenant, prochain_essai=maintenant)],
+        update_conflicts=True, unique_fields=['transaction_id'],
+        update_fields=['recue_le', 'prochain_essai', 'a_traiter'],
+    )
+
+
+def _reserver(taille_lot):
+    # SKIP LOCKED : plusieurs workers se partagent la file sans se bloquer
+    with transaction.atomic():
+        ids = list(
+            models.NotificationPaiement.objects.select_for_update(skip_locked=True)
+            .filter(a_traiter=True, prochain_essai__lte=timezone.now())
+            .order_by('prochain_essai').values_list('id', flat=True)[:taille_lot]
+        )
+        models.NotificationPaiement.objects.filter(id__in=ids).update(a_traiter=False, tentatives=F('tentatives') + 1)
+    return list(models.NotificationPaiement.objects.filter(id__in=ids))
+
+
+def traiter_notification(notification):
+    """Vérifie le paiement chez le fournisseur et met à jour la commande ; False s'il faut réessayer."""
+    try:
+        donnees = paiement.passerelle().verifier(notification.transaction_id)
+    except paiement.ErreurPaiement:
+        if notification.tentatives < MAX_TENTATIVES:
+            # Une notification reçue entre-temps a pu la remettre à traiter : on ne recule pas son essai
+            models.NotificationPaiement.objects.filter(id=notification.id, a_traiter=False).update(
+                a_traiter=True, prochain_essai=timezone.now() + DELAI_ESSAI * notification.tentatives,
+            )
+        return False
+    statut = str(donnees.get('status', ''))[:20]
+    if statut in STATUTS_FINAUX:
+        commandes.enregistrer_paiement(notification.transaction_id, accepte=statut == 'ACCEPTED')
+    models.NotificationPaiement.objects.filter(id=notification.id).update(statut=statut, traitee_le=timezone.now())
+    return True
+
+
+def traiter(taille_lot=TAILLE_LOT):
+    """Traite les notifications dues, par lots, jusqu'à épuisement. Retourne le nombre traité."""
+    traitees = 0
+    while True:
+        lot = _reserver(taille_lot)
+        if not lot:
+            return traitees
+        for notification in lot:
+            traitees += traiter_notification(notification)
@@ -0,0 +1,93 @@
+import base64
+import datetime
+import json
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+
+# Nombre de produits par page sur la liste des deals
+PRODUITS_PAR_PAGE = 12
+
+ORDRE_PAR_DEFAUT = ('-date_add', '-id')
+
+
+class _CurseurEncoder(DjangoJSONEncoder):
+    # DjangoJSONEncoder tronque les microsecondes, ce qui casserait l'égalité
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def encoder_curseur(valeurs):
+    """Encode les valeurs de tri du dernier produit affiché en curseur opaque."""
+    data = json.dumps(list(valeurs), cls=_CurseurEncoder, separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decoder_curseur(curseur):
+    """Retourne la liste des valeurs du curseur, ou None s'il est invalide."""
+    if not curseur:
+        return None
+    try:
+        padding = '=' * (-len(curseur) % 4)
+        valeurs = json.loads(base64.urlsafe_b64decode(curseur + padding).decode('utf-8'))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(valeurs, list):
+        return None
+    return valeurs
+
+
+def _convertir(queryset, champ, valeur):
+    # Les champs annotés (ex: remise) sont déjà des nombres JSON
+    try:
+        field = queryset.model._meta.get_field(champ)
+    except FieldDoesNotExist:
+        return valeur
+    if valeur is None:
+        return None
+    return field.to_python(valeur)
+
+
+def filtre_apres(queryset, ordre, valeurs):
+    """
+    Construit le filtre keyset "strictement après" la ligne décrite par valeurs.
+
+    Pour un ordre (a DESC, b DESC) on obtient : a < va OR (a = va AND b < vb).
+    """
+    condition = Q()
+    egalites = Q()
+    for champ, valeur in zip(ordre, valeurs):
+        nom = champ.lstrip('-')
+        valeur = _convertir(queryset, nom, valeur)
+        operateur = 'lt' if champ.startswith('-') else 'gt'
+        condition |= egalites & Q(**{'%s__%s' % (nom, operateur): valeur})
+        egalites &= Q(**{nom: valeur})
+    return condition
+
+
+def page_keyset(queryset, curseur=None, ordre=ORDRE_PAR_DEFAUT, par_page=PRODUITS_PAR_PAGE):
+    """
+    Retourne (objets, curseur_suivant) pour une page triée par ordre.
+
+    Le coût ne dépend que de par_page : la base parcourt l'index à partir de la
+    position du curseur au lieu de compter ou sauter les lignes précédentes.
+    """
+    queryset = queryset.order_by(*ordre)
+    valeurs = decoder_curseur(curseur)
+    if valeurs is not None and len(valeurs) == len(ordre):
+        try:
+            queryset = queryset.filter(filtre_apres(queryset, ordre, valeurs))
+        except ValidationError:
+            pass
+
+    objets = list(queryset[:par_page + 1])
+    curseur_suivant = None
+    if len(objets) > par_page:
+        objets = objets[:par_page]
+        dernier = objets[-1]
+        curseur_suivant = encoder_curseur(getattr(dernier, champ.lstrip('-')) for champ in ordre)
+    return objets, curseur_suivant
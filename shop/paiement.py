@@ -0,0 +1,152 @@
+"""
+Passerelle de paiement CinetPay.
+
+Client HTTP partagé par le processus : connexions réutilisées (pool requests),
+timeouts de connexion et de lecture stricts, nouvelles tentatives bornées, et
+disjoncteur : après SEUIL échecs consécutifs, les appels échouent aussitôt
+pendant DELAI secondes au lieu d'immobiliser les workers sur un fournisseur
+lent. La configuration est lue dans settings.CINETPAY ; en développement elle
+vise le serveur factice (commande serveur_paiement_factice).
+"""
+import threading
+import time
+
+import requests
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class ErreurPaiement(Exception):
+    """Paiement refusé par le fournisseur ou fournisseur injoignable."""
+
+
+class PasserelleIndisponible(ErreurPaiement):
+    """Disjoncteur ouvert : le fournisseur n'est pas appelé."""
+
+
+class Disjoncteur:
+    """
+    Coupe les appels après seuil échecs consécutifs, pendant delai secondes.
+
+    Passé le délai, un seul appel d'essai est laissé passer : son succès
+    referme le disjoncteur, son échec le rouvre pour un nouveau délai.
+    """
+
+    def __init__(self, seuil, delai):
+        self.seuil = seuil
+        self.delai = delai
+        self.echecs = 0
+        self.ouvert_jusqua = 0
+        self._verrou = threading.Lock()
+
+    def autoriser(self):
+        with self._verrou:
+            if self.echecs < self.seuil:
+                return True
+            maintenant = time.monotonic()
+            if maintenant < self.ouvert_jusqua:
+                return False
+            # Appel d'essai ; les suivants attendent son résultat
+            self.ouvert_jusqua = maintenant + self.delai
+            return True
+
+    def succes(self):
+        with self._verrou:
+            self.echecs = 0
+
+    def echec(self):
+        with self._verrou:
+            self.echecs += 1
+            if self.echecs >= self.seuil:
+                self.ouvert_jusqua = time.monotonic() + self.delai
+
+
+class Passerelle:
+    """Appels à l'API CinetPay v2 (initialisation et vérification d'un paiement)."""
+
+    def __init__(self, config):
+        self.url = config['URL'].rstrip('/')
+        self.apikey = config['APIKEY']
+        self.site_id = config['SITE_ID']
+        self.timeout = (config['TIMEOUT_CONNEXION'], config['TIMEOUT_LECTURE'])
+        self.disjoncteur = Disjoncteur(config['SEUIL_DISJONCTEUR'], config['DELAI_DISJONCTEUR'])
+
+        # Pas de nouvelle tentative après un timeout de lecture : le fournisseur
+        # a pu traiter la requête, et l'attente est déjà celle du timeout
+        tentatives = Retry(
+            total=config['TENTATIVES'], connect=config['TENTATIVES'], read=0, status=config['TENTATIVES'],
+            status_forcelist=(502, 503, 504), allowed_methods=frozenset({'POST'}),
+            backoff_factor=0.2, raise_on_status=False,
+        )
+        adaptateur = HTTPAdapter(pool_connections=1, pool_maxsize=config['CONNEXIONS'], max_retries=tentatives)
+        self.session = requests.Session()
+        self.session.mount('http://', adaptateur)
+        self.session.mount('https://', adaptateur)
+
+    def _appeler(self, chemin, donnees):
+        if not self.disjoncteur.autoriser():
+            raise PasserelleIndisponible("Le service de paiement est momentanément indisponible")
+        try:
+            reponse = self.session.post(
+                self.url + chemin, json=dict(donnees, apikey=self.apikey, site_id=self.site_id), timeout=self.timeout,
+            )
+        except requests.RequestException:
+            self.disjoncteur.echec()
+            raise ErreurPaiement("Le service de paiement ne répond pas, merci de réessayer")
+        if reponse.status_code >= 500:
+            self.disjoncteur.echec()
+            raise ErreurPaiement("Le service de paiement ne répond pas, merci de réessayer")
+        self.disjoncteur.succes()
+        try:
+            return reponse.json()
+        except ValueError:
+            raise ErreurPaiement("Réponse invalide du service de paiement")
+
+    def initier(self, transaction_id, montant, description, notify_url, return_url, nom='', prenom=''):
+        """Crée le paiement ; retourne ses données (payment_token, payment_url...)."""
+        resultat = self._appeler('/payment', {
+            'transaction_id': transaction_id,
+            'amount': int(round(montant)),
+            'currency': 'XOF',
+            'description': description,
+            'notify_url': notify_url,
+            'return_url': return_url,
+            'customer_name': nom,
+            'customer_surname': prenom,
+            'channels': 'ALL',
+        })
+        if resultat.get('code') != '201':
+            raise ErreurPaiement(resultat.get('description') or resultat.get('message') or "Paiement refusé")
+        return dict(resultat['data'], api_response_id=resultat.get('api_response_id', ''))
+
+    def verifier(self, transaction_id):
+        """Données du paiement chez le fournisseur (status ACCEPTED, REFUSED...)."""
+        resultat = self._appeler('/payment/check', {'transaction_id': transaction_id})
+        if not resultat.get('data'):
+            raise ErreurPaiement(resultat.get('message') or "Transaction inconnue")
+        return resultat['data']
+
+
+_passerelle = None
+_verrou = threading.Lock()
+
+
+def passerelle():
+    """Passerelle du processus, créée au premier appel : son pool de connexions est partagé par les requêtes."""
+    global _passerelle
+    with _verrou:
+        if _passerelle is None:
+            _passerelle = Passerelle(settings.CINETPAY)
+        return _passerelle
+
+
+@receiver(setting_changed)
+def reinitialiser(setting, **kwargs):
+    # override_settings(CINETPAY=...) dans les tests
+    global _passerelle
+    if setting == 'CINETPAY':
+        with _verrou:
+            _passerelle = None
@@ -0,0 +1,212 @@
+"""
+Serveur factice de l'API CinetPay v2, pour le développement hors ligne et les tests de charge.
+
+Implémente POST /v2/payment (initialisation), POST /v2/payment/check (état)
+et la page de paiement /payment/<token>, où l'on accepte ou refuse le paiement
+avant d'être renvoyé sur return_url ; la notification est alors postée sur
+notify_url, repetitions fois comme le font les fournisseurs en rafale. Les codes
+d'erreur sont simplifiés. latence (secondes) et taux_erreur (part des appels
+répondus en 503) simulent un fournisseur lent ou instable.
+"""
+import html
+import json
+import random
+import secrets
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import URLError
+from urllib.parse import parse_qs, urlencode
+from urllib.request import urlopen
+
+from django.utils import timezone
+
+
+class _Gestionnaire(BaseHTTPRequestHandler):
+    # Connexions persistantes, comme le fournisseur : sans TCP_NODELAY, en-têtes et
+    # corps écrits séparément attendent l'ACK retardé du client (~40 ms par appel)
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        if self.server.factice.verbeux:
+            super().log_message(format, *args)
+
+    def _lire(self):
+        longueur = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(longueur) if longueur else b''
+
+    def _repondre(self, statut, corps, type_contenu='application/json', entetes=()):
+        if not isinstance(corps, bytes):
+            corps = json.dumps(corps).encode('utf-8') if type_contenu == 'application/json' else corps.encode('utf-8')
+        self.send_response(statut)
+        self.send_header('Content-Type', type_contenu + '; charset=utf-8')
+        self.send_header('Content-Length', str(len(corps)))
+        for nom, valeur in entetes:
+            self.send_header(nom, valeur)
+        self.end_headers()
+        self.wfile.write(corps)
+
+    def do_POST(self):
+        factice = self.server.factice
+        corps = self._lire()
+        factice.compter()
+        if factice.latence:
+            time.sleep(factice.latence)
+        if factice.taux_erreur and random.random() < factice.taux_erreur:
+            return self._repondre(503, {'code': '503', 'message': 'SERVICE_UNAVAILABLE'})
+
+        if self.path.startswith('/payment/'):
+            return self._choisir(self.path[len('/payment/'):], parse_qs(corps.decode('utf-8')))
+        try:
+            donnees = json.loads(corps or b'{}')
+        except ValueError:
+            return self._repondre(400, {'code': '400', 'message': 'BAD_REQUEST'})
+        if self.path == '/v2/payment':
+            return self._repondre(200, factice.initier(donnees, 'http://%s:%s' % self.server.server_address[:2]))
+        if self.path == '/v2/payment/check':
+            return self._repondre(200, factice.verifier(donnees))
+        self._repondre(404, {'code': '404', 'message': 'NOT_FOUND'})
+
+    def do_GET(self):
+        transaction = self.server.factice.par_token(self.path[len('/payment/'):])
+        if not self.path.startswith('/payment/') or transaction is None:
+            return self._repondre(404, "Paiement inconnu", 'text/html')
+        self._repondre(200, (
+            '<!doctype html><meta charset="utf-8"><title>Paiement factice</title>'
+            '<h1>Paiement factice</h1><p>Transaction %s : %s %s</p>'
+            '<form method="post"><button name="status" value="ACCEPTED">Accepter</button> '
+            '<button name="status" value="REFUSED">Refuser</button></form>'
+        ) % (html.escape(transaction['transaction_id']), transaction['amount'], transaction['currency']), 'text/html')
+
+    def _choisir(self, token, formulaire):
+        statut = (formulaire.get('status') or ['ACCEPTED'])[0]
+        transaction = self.server.factice.terminer(token, 'REFUSED' if statut == 'REFUSED' else 'ACCEPTED')
+        if transaction is None:
+            return self._repondre(404, "Paiement inconnu", 'text/html')
+        threading.Thread(target=self.server.factice.notifier, args=(transaction,), daemon=True).start()
+        self._repondre(303, b'', 'text/html', [('Location', transaction['return_url'] or '/')])
+
+
+class _Serveur(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Client parti avant la réponse (timeout de lecture) : attendu avec latence
+        if not self.factice.verbeux:
+            return
+        super().handle_error(request, client_address)
+
+
+class ServeurFactice:
+    """Serveur factice ; demarrer() le lance dans un thread (tests), servir() bloque (commande)."""
+
+    def __init__(self, hote='127.0.0.1', port=0, latence=0, taux_erreur=0, repetitions=1, verbeux=False):
+        self.latence = latence
+        self.taux_erreur = taux_erreur
+        self.repetitions = repetitions
+        self.verbeux = verbeux
+        self.transactions = {}
+        self.tokens = {}
+        # Appels POST reçus, erreurs simulées comprises
+        self.appels = 0
+        self._verrou = threading.Lock()
+        self.serveur = _Serveur((hote, port), _Gestionnaire)
+        self.serveur.factice = self
+        self._thread = None
+
+    @property
+    def url(self):
+        """URL de l'API, à mettre dans settings.CINETPAY['URL']."""
+        return 'http://%s:%s/v2' % self.serveur.server_address[:2]
+
+    def vider(self):
+        with self._verrou:
+            self.transactions.clear()
+            self.tokens.clear()
+            self.appels = 0
+
+    def compter(self):
+        with self._verrou:
+            self.appels += 1
+
+    def initier(self, donnees, base):
+        manquants = [c for c in ('transaction_id', 'amount', 'currency') if donnees.get(c) in (None, '')]
+        if manquants:
+            return {'code': '608', 'message': 'MINIMUM_REQUIRED_FIELDS', 'description': ', '.join(manquants), 'data': []}
+        with self._verrou:
+            if donnees['transaction_id'] in self.transactions:
+                return {'code': '609', 'message': 'TRANSACTION_EXIST', 'description': "Transaction déjà initialisée", 'data': []}
+            token = secrets.token_hex(16)
+            self.transactions[donnees['transaction_id']] = {
+                'transaction_id': str(donnees['transaction_id']),
+                'amount': donnees['amount'],
+                'currency': donnees['currency'],
+                'site_id': donnees.get('site_id', ''),
+                'notify_url': donnees.get('notify_url', ''),
+                'return_url': donnees.get('return_url', ''),
+                'payment_token': token,
+                'status': 'PENDING',
+                'payment_date': '',
+            }
+            self.tokens[token] = donnees['transaction_id']
+        return {
+            'code': '201',
+            'message': 'CREATED',
+            'description': 'Transaction created with success',
+            'data': {'payment_token': token, 'payment_url': '%s/payment/%s' % (base, token)},
+            'api_response_id': secrets.token_hex(8),
+        }
+
+    def verifier(self, donnees):
+        with self._verrou:
+            transaction = self.transactions.get(donnees.get('transaction_id'))
+            if transaction is None:
+                return {'code': '627', 'message': 'TRANSACTION_NOT_FOUND', 'data': None}
+            return {'code': '00', 'message': 'SUCCES', 'data': {
+                'amount': transaction['amount'],
+                'currency': transaction['currency'],
+                'status': transaction['status'],
+                'payment_method': 'FACTICE',
+                'payment_date': transaction['payment_date'],
+            }}
+
+    def par_token(self, token):
+        with self._verrou:
+            transaction = self.transactions.get(self.tokens.get(token))
+            return dict(transaction) if transaction else None
+
+    def terminer(self, token, statut):
+        with self._verrou:
+            transaction = self.transactions.get(self.tokens.get(token))
+            if transaction is None:
+                return None
+            transaction['status'] = statut
+            transaction['payment_date'] = timezone.now().strftime('%Y-%m-%d %H:%M:%S')
+            return dict(transaction)
+
+    def notifier(self, transaction):
+        """Poste la notification de la transaction sur son notify_url ; retourne les codes HTTP reçus."""
+        if not transaction['notify_url'].startswith('http'):
+            return []
+        corps = urlencode({'cpm_trans_id': transaction['transaction_id'], 'cpm_site_id': transaction['site_id']}).encode()
+        codes = []
+        for _ in range(self.repetitions):
+            try:
+                with urlopen(transaction['notify_url'], data=corps, timeout=10) as reponse:
+                    codes.append(reponse.status)
+            except URLError as e:
+                codes.append(getattr(e, 'code', None))
+        return codes
+
+    def demarrer(self):
+        self._thread = threading.Thread(target=self.serveur.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def servir(self):
+        self.serveur.serve_forever()
+
+    def arreter(self):
+        self.serveur.shutdown()
+        self.serveur.server_close()
@@ -0,0 +1,72 @@
+"""
+État de promotion matérialisé des produits.
+
+Produit.promo_active et Produit.prix_effectif sont calculés à la sauvegarde ;
+basculer_promotions() les recale en masse quand une fenêtre de promotion
+s'ouvre ou se ferme sans que le produit soit modifié. Les dates de promotion
+étant des jours, les bascules ont lieu à minuit.
+"""
+import datetime
+
+from django.db import transaction
+from django.db.models import F, Q
+
+from customer import panier
+
+from . import facettes, models
+
+
+# Nombre de deals affichés dans "Derniers jours"
+DEALS_FIN_PROCHE = 3
+
+
+def condition_active(jour):
+    return Q(date_debut_promo__lte=jour, date_fin_promo__gte=jour)
+
+
+def basculer_promotions(jour=None):
+    """
+    Active/désactive en deux UPDATE les promotions dont la fenêtre a changé.
+
+    Seuls les paniers contenant un produit basculé sont recalculés. Retourne
+    (nombre activé, nombre désactivé).
+    """
+    jour = jour or datetime.date.today()
+    with transaction.atomic():
+        # Lignes verrouillées : les ids lus sont exactement ceux que les UPDATE basculent
+        a_activer = list(
+            models.Produit.objects.select_for_update().filter(condition_active(jour)).filter(promo_active=False)
+            .values_list('id', flat=True)
+        )
+        a_terminer = list(
+            models.Produit.objects.select_for_update().filter(promo_active=True).exclude(condition_active(jour))
+            .values_list('id', flat=True)
+        )
+        actives = models.Produit.objects.filter(id__in=a_activer).update(
+            promo_active=True, prix_effectif=F('prix_promotionnel')
+        )
+        terminees = models.Produit.objects.filter(id__in=a_terminer).update(
+            promo_active=False, prix_effectif=F('prix')
+        )
+    if actives or terminees:
+        # update() ne déclenche pas les signaux qui tiennent facettes et paniers à jour
+        facettes.reconstruire(['promo', 'prix'])
+        panier.recalculer_paniers(produits=a_activer + a_terminer)
+    return actives, terminees
+
+
+def prochaine_bascule(jour=None):
+    """Premier jour après jour où une promotion commence ou se termine, ou None."""
+    jour = jour or datetime.date.today()
+    debut = models.Produit.objects.filter(date_debut_promo__gt=jour).order_by('date_debut_promo').values_list(
+        'date_debut_promo', flat=True).first()
+    fin = models.Produit.objects.filter(date_fin_promo__gte=jour).order_by('date_fin_promo').values_list(
+        'date_fin_promo', flat=True).first()
+    # Une promotion qui finit le jour J est encore active ce jour-là : elle bascule à J + 1
+    candidats = [d for d in (debut, fin and fin + datetime.timedelta(days=1)) if d]
+    return min(candidats) if candidats else None
+
+
+def deals_fin_proche(limite=DEALS_FIN_PROCHE):
+    """Promotions en cours qui se terminent le plus tôt (index produit_fin_promo_idx)."""
+    return models.Produit.objects.filter(status=True, promo_active=True).order_by('date_fin_promo', 'id')[:limite]
@@ -0,0 +1,205 @@
+"""
+Recherche plein texte des produits.
+
+Index FTS5 sous SQLite, tsvector sous PostgreSQL ; les autres bases retombent
+sur un simple icontains. L'index est tenu à jour par les signaux de shop.signals
+et peut être reconstruit avec la commande reconstruire_recherche.
+"""
+import re
+
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from . import models
+from .pagination import PRODUITS_PAR_PAGE, decoder_curseur, encoder_curseur
+
+
+TABLE_FTS = 'shop_produit_fts'
+TABLE_PG = 'shop_produit_recherche'
+
+# Poids bm25 des colonnes FTS5 : nom, description, description_deal, categories, etablissement
+POIDS_FTS = (10.0, 1.0, 2.0, 4.0, 4.0)
+
+TAILLE_LOT = 500
+
+# Documents indexés, un par produit
+SELECT_DOCUMENTS = """
+    SELECT p.id, p.nom, p.description, p.description_deal,
+           COALESCE(cp.nom, '') || ' ' || COALESCE(ce.nom, ''),
+           COALESCE(e.nom, '')
+    FROM shop_produit p
+    LEFT JOIN shop_categorieproduit cp ON cp.id = p.categorie_id
+    LEFT JOIN shop_categorieetablissement ce ON ce.id = p.categorie_etab_id
+    LEFT JOIN shop_etablissement e ON e.id = p.etablissement_id
+"""
+
+DOCUMENT_PG = """
+    setweight(to_tsvector('french', COALESCE(p.nom, '')), 'A') ||
+    setweight(to_tsvector('french', COALESCE(cp.nom, '') || ' ' || COALESCE(ce.nom, '') || ' ' || COALESCE(e.nom, '')), 'B') ||
+    setweight(to_tsvector('french', COALESCE(p.description_deal, '')), 'C') ||
+    setweight(to_tsvector('french', COALESCE(p.description, '')), 'D')
+"""
+
+JOINTURES_PG = """
+    FROM shop_produit p
+    LEFT JOIN shop_categorieproduit cp ON cp.id = p.categorie_id
+    LEFT JOIN shop_categorieetablissement ce ON ce.id = p.categorie_etab_id
+    LEFT JOIN shop_etablissement e ON e.id = p.etablissement_id
+"""
+
+
+def moteur():
+    if connection.vendor == 'sqlite':
+        return 'fts5'
+    if connection.vendor == 'postgresql':
+        return 'tsvector'
+    return None
+
+
+def termes(requete):
+    return re.findall(r'\w+', requete or '')[:10]
+
+
+def indexer_produits(ids):
+    """(Ré)indexe les produits dont l'id est dans ids."""
+    ids = [int(i) for i in ids]
+    if not ids or moteur() is None:
+        return
+    for debut in range(0, len(ids), TAILLE_LOT):
+        _indexer_lot(ids[debut:debut + TAILLE_LOT])
+
+
+def _indexer_lot(ids):
+    marqueurs = ', '.join(['%s'] * len(ids))
+    with connection.cursor() as cursor:
+        if moteur() == 'fts5':
+            cursor.execute('DELETE FROM %s WHERE rowid IN (%s)' % (TABLE_FTS, marqueurs), ids)
+            cursor.execute(
+                'INSERT INTO %s (rowid, nom, description, description_deal, categories, etablissement) %s WHERE p.id IN (%s)'
+                % (TABLE_FTS, SELECT_DOCUMENTS, marqueurs), ids
+            )
+        else:
+            cursor.execute(
+                'INSERT INTO %s (produit_id, document) SELECT p.id, %s %s WHERE p.id IN (%s) '
+                'ON CONFLICT (produit_id) DO UPDATE SET document = EXCLUDED.document'
+                % (TABLE_PG, DOCUMENT_PG, JOINTURES_PG, marqueurs), ids
+            )
+
+
+def retirer_produits(ids):
+    ids = [int(i) for i in ids]
+    if not ids or moteur() is None:
+        return
+    marqueurs = ', '.join(['%s'] * len(ids))
+    with connection.cursor() as cursor:
+        if moteur() == 'fts5':
+            cursor.execute('DELETE FROM %s WHERE rowid IN (%s)' % (TABLE_FTS, marqueurs), ids)
+        else:
+            cursor.execute('DELETE FROM %s WHERE produit_id IN (%s)' % (TABLE_PG, marqueurs), ids)
+
+
+def reconstruire_index():
+    """Vide puis reconstruit tout l'index. Retourne le nombre de produits indexés."""
+    if moteur() is None:
+        return 0
+    with connection.cursor() as cursor:
+        if moteur() == 'fts5':
+            cursor.execute('DELETE FROM %s' % TABLE_FTS)
+            cursor.execute(
+                'INSERT INTO %s (rowid, nom, description, description_deal, categories, etablissement) %s'
+                % (TABLE_FTS, SELECT_DOCUMENTS)
+            )
+            cursor.execute("INSERT INTO %s (%s) VALUES ('optimize')" % (TABLE_FTS, TABLE_FTS))
+        else:
+            cursor.execute('TRUNCATE %s' % TABLE_PG)
+            cursor.execute(
+                'INSERT INTO %s (produit_id, document) SELECT p.id, %s %s' % (TABLE_PG, DOCUMENT_PG, JOINTURES_PG)
+            )
+    return models.Produit.objects.count()
+
+
+def _sous_requete(produits):
+    sql, params = produits.values('id').query.sql_with_params()
+    return sql, list(params)
+
+
+def filtrer(produits, requete):
+    """Restreint le queryset aux produits correspondant à la requête (sans classement)."""
+    mots = termes(requete)
+    if not mots:
+        return produits
+    if moteur() == 'fts5':
+        expression = ' '.join('"%s"*' % mot for mot in mots)
+        return produits.filter(id__in=RawSQL(
+            'SELECT rowid FROM %s WHERE %s MATCH %%s' % (TABLE_FTS, TABLE_FTS), [expression]
+        ))
+    if moteur() == 'tsvector':
+        expression = ' & '.join('%s:*' % mot for mot in mots)
+        return produits.filter(id__in=RawSQL(
+            "SELECT produit_id FROM %s WHERE document @@ to_tsquery('french', %%s)" % TABLE_PG, [expression]
+        ))
+    condition = Q()
+    for mot in mots:
+        condition &= (
+            Q(nom__icontains=mot) | Q(description__icontains=mot) | Q(description_deal__icontains=mot)
+            | Q(categorie__nom__icontains=mot) | Q(etablissement__nom__icontains=mot)
+        )
+    return produits.filter(condition)
+
+
+def rechercher(requete, produits=None, offset=0, limite=12):
+    """
+    Retourne (produits classés par pertinence, total) pour la requête.
+
+    produits restreint les résultats (ex: produits actifs, ceux d'un vendeur) ;
+    il est injecté en sous-requête pour que le classement reste fait en SQL.
+    """
+    if produits is None:
+        produits = models.Produit.objects.filter(status=True)
+    mots = termes(requete)
+    if not mots:
+        return [], 0
+
+    if moteur() is None:
+        resultats = filtrer(produits, requete).order_by('-date_add', '-id')
+        return list(resultats[offset:offset + limite]), resultats.count()
+
+    sous_sql, sous_params = _sous_requete(produits)
+    if moteur() == 'fts5':
+        expression = ' '.join('"%s"*' % mot for mot in mots)
+        poids = ', '.join(str(p) for p in POIDS_FTS)
+        base = 'FROM %s WHERE %s MATCH %%s AND rowid IN (%s)' % (TABLE_FTS, TABLE_FTS, sous_sql)
+        select_ids = 'SELECT rowid %s ORDER BY bm25(%s, %s), rowid LIMIT %%s OFFSET %%s' % (base, TABLE_FTS, poids)
+        select_total = 'SELECT COUNT(*) %s' % base
+    else:
+        expression = ' & '.join('%s:*' % mot for mot in mots)
+        base = (
+            "FROM %s r, to_tsquery('french', %%s) q WHERE r.document @@ q AND r.produit_id IN (%s)"
+            % (TABLE_PG, sous_sql)
+        )
+        select_ids = 'SELECT r.produit_id %s ORDER BY ts_rank(r.document, q) DESC, r.produit_id LIMIT %%s OFFSET %%s' % base
+        select_total = 'SELECT COUNT(*) %s' % base
+
+    params = [expression] + sous_params
+    with connection.cursor() as cursor:
+        cursor.execute(select_ids, params + [limite, offset])
+        ids = [ligne[0] for ligne in cursor.fetchall()]
+        cursor.execute(select_total, params)
+        total = cursor.fetchone()[0]
+
+    par_id = produits.model.objects.in_bulk(ids)
+    return [par_id[i] for i in ids if i in par_id], total
+
+
+def page_recherche(requete, produits, curseur=None, par_page=PRODUITS_PAR_PAGE):
+    """Comme pagination.page_keyset, pour des résultats classés : le curseur porte le décalage."""
+    valeurs = decoder_curseur(curseur)
+    offset = 0
+    if valeurs and isinstance(valeurs[0], int) and valeurs[0] > 0:
+        offset = valeurs[0]
+    resultats, total = rechercher(requete, produits, offset=offset, limite=par_page)
+    curseur_suivant = None
+    if offset + par_page < total:
+        curseur_suivant = encoder_curseur([offset + par_page])
+    return resultats, curseur_suivant, total
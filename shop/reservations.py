@@ -0,0 +1,107 @@
+"""
+Réservations de stock.
+
+Ajouter au panier ou ouvrir la page de paiement retient le stock pendant
+DUREE_RESERVATION. Le stock disponible d'un produit est Produit.quantite moins
+ses réservations vivantes (non expirées) ; une quantité non renseignée (None)
+signifie un stock illimité, une quantité de 0 un produit épuisé. Les
+vérifications verrouillent les lignes produit concernées (SELECT ... FOR
+UPDATE) : deux paiements simultanés du même deal sont sérialisés, ceux de
+deals différents ne s'attendent pas. Les réservations expirées ne comptent
+plus et sont supprimées par lots par liberer_expirees().
+"""
+import datetime
+
+from django.db import transaction
+from django.db.models import IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import models
+
+
+DUREE_RESERVATION = datetime.timedelta(minutes=15)
+
+# Réservations expirées supprimées par transaction
+TAILLE_LOT = 1000
+
+
+def disponibles(produits, sauf_panier=None):
+    """{id produit: stock disponible (None si illimité)}, hors réservations de sauf_panier."""
+    stocks = dict(models.Produit.objects.filter(id__in=produits).values_list('id', 'quantite'))
+    tenues = models.Reservation.objects.filter(produit_id__in=produits, expire_le__gt=timezone.now())
+    if sauf_panier is not None:
+        tenues = tenues.exclude(panier=sauf_panier)
+    retenu = dict(tenues.values('produit_id').annotate(total=Sum('quantite')).values_list('produit_id', 'total'))
+    return {
+        produit: None if stock is None else stock - retenu.get(produit, 0)
+        for produit, stock in stocks.items()
+    }
+
+
+def retenu_ailleurs(panier):
+    """
+    Expression : quantité du produit (OuterRef('pk')) retenue par les autres paniers.
+
+    Utilisable dans un UPDATE conditionnel du stock, pour vérifier la disponibilité
+    sans requête supplémentaire.
+    """
+    tenues = (
+        models.Reservation.objects
+        .filter(produit_id=OuterRef('pk'), expire_le__gt=timezone.now())
+        .exclude(panier=panier)
+        .order_by().values('produit_id').annotate(total=Sum('quantite')).values('total')
+    )
+    return Coalesce(Subquery(tenues, output_field=IntegerField()), Value(0))
+
+
+def reserver(panier, quantites, verifier=None):
+    """
+    Porte les réservations du panier à quantites ({id produit: quantité}, 0 libère).
+
+    Prolonge aussi leur durée. Lève ValueError si un produit de verifier (par
+    défaut : tous) n'a pas assez de stock disponible ; à appeler dans la
+    transaction qui modifie le panier, pour que l'échec l'annule entièrement.
+    """
+    if not quantites:
+        return
+    with transaction.atomic():
+        # Verrous pris dans l'ordre des ids : pas d'interblocage entre deux paniers
+        list(models.Produit.objects.select_for_update().filter(id__in=quantites).order_by('id').values_list('id'))
+        stocks = disponibles(quantites, sauf_panier=panier)
+        for produit, quantite in quantites.items():
+            if verifier is not None and produit not in verifier:
+                continue
+            if quantite and stocks.get(produit) is not None and quantite > stocks[produit]:
+                raise ValueError("Stock insuffisant")
+
+        liberes = [produit for produit, quantite in quantites.items() if not quantite]
+        if liberes:
+            models.Reservation.objects.filter(panier=panier, produit_id__in=liberes).delete()
+        expire_le = timezone.now() + DUREE_RESERVATION
+        models.Reservation.objects.bulk_create(
+            [
+                models.Reservation(panier=panier, produit_id=produit, quantite=quantite, expire_le=expire_le)
+                for produit, quantite in quantites.items() if quantite
+            ],
+            update_conflicts=True, unique_fields=['panier', 'produit'], update_fields=['quantite', 'expire_le'],
+        )
+
+
+def reserver_panier(panier):
+    """Réserve (ou prolonge) tout le contenu du panier, au moment du paiement."""
+    reserver(panier, dict(panier.produit_panier.values_list('produit_id', 'quantite')))
+
+
+def liberer_expirees(taille_lot=TAILLE_LOT):
+    """Supprime par lots les réservations expirées. Retourne le nombre supprimé."""
+    supprimees = 0
+    while True:
+        with transaction.atomic():
+            ids = list(
+                models.Reservation.objects.filter(expire_le__lte=timezone.now())
+                .values_list('id', flat=True)[:taille_lot]
+            )
+            if not ids:
+                return supprimees
+            supprimees += models.Reservation.objects.filter(id__in=ids, expire_le__lte=timezone.now()).delete()[0]
@@ -0,0 +1,102 @@
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from customer import panier
+
+from . import categories, facettes, models, recherche
+
+
+@receiver(pre_save, sender=models.Produit)
+def memoriser_facettes_produit(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    instance._facettes_avant = facettes.etat_produit(instance.pk)
+
+
+@receiver(post_save, sender=models.Produit)
+def recalculer_paniers_produit(sender, instance, raw=False, **kwargs):
+    # Connecté avant mettre_a_jour_facettes_produit, qui efface _facettes_avant
+    avant = getattr(instance, '_facettes_avant', None)
+    if raw or not avant or avant['prix_effectif'] == instance.prix_effectif:
+        return
+    panier.recalculer_paniers(produits=[instance.pk])
+
+
+@receiver(post_save, sender=models.Produit)
+def mettre_a_jour_facettes_produit(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    facettes.appliquer_changement(getattr(instance, '_facettes_avant', None), facettes.etat_produit(instance.pk))
+    instance._facettes_avant = None
+
+
+@receiver(pre_delete, sender=models.Produit)
+def memoriser_facettes_suppression(sender, instance, **kwargs):
+    instance._facettes_avant = facettes.etat_produit(instance.pk)
+
+
+@receiver(post_delete, sender=models.Produit)
+def retirer_facettes_produit(sender, instance, **kwargs):
+    facettes.appliquer_changement(getattr(instance, '_facettes_avant', None), None)
+
+
+@receiver(pre_save, sender=models.Etablissement)
+def memoriser_ville_etablissement(sender, instance, raw=False, **kwargs):
+    if raw or instance.pk is None:
+        return
+    instance._ville_avant = sender.objects.filter(pk=instance.pk).values_list('ville_id', flat=True).first()
+
+
+@receiver(post_save, sender=models.Etablissement)
+def deplacer_facette_ville(sender, instance, raw=False, created=False, **kwargs):
+    if raw or created:
+        return
+    facettes.deplacer(
+        'ville', getattr(instance, '_ville_avant', None), instance.ville_id,
+        instance.produits.filter(status=True).count(),
+    )
+
+
+@receiver(post_save, sender=models.Produit)
+def indexer_produit(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    recherche.indexer_produits([instance.pk])
+
+
+@receiver(post_delete, sender=models.Produit)
+def retirer_produit(sender, instance, **kwargs):
+    recherche.retirer_produits([instance.pk])
+
+
+@receiver(post_save, sender=models.CategorieProduit)
+def indexer_categorie_produit(sender, instance, raw=False, created=False, **kwargs):
+    # Le nom de la catégorie fait partie du document indexé de ses produits
+    if raw or created:
+        return
+    recherche.indexer_produits(instance.produit.values_list('id', flat=True))
+
+
+@receiver(post_save, sender=models.CategorieEtablissement)
+def indexer_categorie_etablissement(sender, instance, raw=False, created=False, **kwargs):
+    if raw or created:
+        return
+    recherche.indexer_produits(instance.produit_etab.values_list('id', flat=True))
+
+
+@receiver(post_save, sender=models.Etablissement)
+def indexer_etablissement(sender, instance, raw=False, created=False, **kwargs):
+    if raw or created:
+        return
+    recherche.indexer_produits(instance.produits.values_list('id', flat=True))
+
+
+@receiver(post_save, sender=models.CategorieEtablissement)
+@receiver(post_delete, sender=models.CategorieEtablissement)
+@receiver(post_save, sender=models.CategorieProduit)
+@receiver(post_delete, sender=models.CategorieProduit)
+@receiver(post_save, sender=models.Produit)
+@receiver(post_delete, sender=models.Produit)
+def invalider_arbre_categories(sender, **kwargs):
+    # Les compteurs de l'arbre viennent des facettes, modifiées par chaque produit
+    categories.invalider()
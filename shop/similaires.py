@@ -0,0 +1,249 @@
+"""
+Deals similaires calculés hors ligne.
+
+Chaque produit actif est représenté par un vecteur TF-IDF creux construit sur
+son nom, sa catégorie et ses descriptions : seuls ses mots sont stockés, au format
+CSR (tableaux NumPy), la mémoire suit donc le nombre de mots du catalogue et non
+produits x vocabulaire. Les K plus proches voisins au sens du cosinus sont
+calculés par lots de lignes et stockés dans ProduitSimilaire : la fiche produit
+n'a plus qu'à lire (produit, rang) dans l'index.
+"""
+import math
+import re
+import unicodedata
+from collections import Counter, namedtuple
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Count, Min
+
+from base.cache import invalider
+
+from . import models
+
+
+# Voisins stockés par produit (la fiche en affiche 3)
+NOMBRE_VOISINS = 10
+
+# Lignes de la matrice de similarité calculées à la fois : un lot occupe TAILLE_LOT x produits x 8 octets
+TAILLE_LOT = 64
+
+# Taille maximale du vocabulaire (mots les plus fréquents)
+MAX_VOCABULAIRE = 4096
+
+# Ids passés à la fois dans un filtre produit_id__in
+TAILLE_REQUETE = 500
+
+# Le nom pèse plus que les descriptions
+POIDS_NOM = 3
+
+# Légère préférence pour les produits de la même catégorie à texte équivalent
+BONUS_CATEGORIE = 0.05
+
+MOTS_VIDES = {
+    'les', 'des', 'une', 'pour', 'avec', 'dans', 'sur', 'par', 'vos', 'votre', 'nos', 'notre',
+    'est', 'sont', 'pas', 'plus', 'tout', 'tous', 'toute', 'toutes', 'aux', 'qui', 'que', 'son',
+    'ses', 'leur', 'leurs', 'cette', 'ces', 'mais', 'ou', 'et', 'the', 'and', 'for',
+}
+
+
+def tokens(texte):
+    texte = unicodedata.normalize('NFKD', texte or '')
+    texte = ''.join(c for c in texte if not unicodedata.combining(c)).lower()
+    return [mot for mot in re.findall(r'[a-z0-9]{3,}', texte) if mot not in MOTS_VIDES]
+
+
+def _document(produit):
+    return (
+        tokens(produit['nom']) * POIDS_NOM
+        + tokens(produit['categorie__nom'])
+        + tokens(produit['description_deal'])
+        + tokens(produit['description'])
+    )
+
+
+# Matrice creuse au format CSR : les colonnes et valeurs de la ligne i sont
+# indices[indptr[i]:indptr[i + 1]] et data[indptr[i]:indptr[i + 1]]
+Creuse = namedtuple('Creuse', 'indptr indices data')
+
+
+def _plages(debuts, longueurs):
+    # Concaténation des intervalles [debuts[i], debuts[i] + longueurs[i])
+    decalages = debuts - np.cumsum(longueurs) + longueurs
+    return np.repeat(decalages, longueurs) + np.arange(longueurs.sum())
+
+
+def _transposer(matrice, colonnes):
+    ordre = np.argsort(matrice.indices, kind='stable')
+    lignes = np.repeat(np.arange(len(matrice.indptr) - 1), np.diff(matrice.indptr))
+    indptr = np.concatenate(([0], np.cumsum(np.bincount(matrice.indices, minlength=colonnes))))
+    return Creuse(indptr, lignes[ordre], matrice.data[ordre])
+
+
+def vectoriser(produits):
+    """
+    Retourne (ids, categories, (matrice, transposee)) pour une liste de dicts produit.
+
+    matrice est creuse (Creuse, float32), une ligne normalisée par produit : le
+    produit scalaire de deux lignes est leur similarité cosinus. transposee donne,
+    pour chaque mot, les produits qui le contiennent.
+    """
+    documents = [Counter(_document(p)) for p in produits]
+    frequences = Counter()
+    for document in documents:
+        frequences.update(document.keys())
+    vocabulaire = [mot for mot, _ in frequences.most_common(MAX_VOCABULAIRE)]
+    colonnes = {mot: i for i, mot in enumerate(vocabulaire)}
+
+    total = len(documents)
+    idf = np.array([math.log((1 + total) / (1 + frequences[mot])) + 1 for mot in vocabulaire], dtype=np.float32)
+    longueurs, indices, data = [], [], []
+    for document in documents:
+        mots = [(colonnes[mot], 1 + math.log(nombre)) for mot, nombre in document.items() if mot in colonnes]
+        mots.sort()
+        longueurs.append(len(mots))
+        indices.extend(colonne for colonne, _ in mots)
+        data.extend(valeur for _, valeur in mots)
+    indices = np.array(indices, dtype=np.int64)
+    data = np.array(data, dtype=np.float32) * idf[indices]
+    longueurs = np.array(longueurs, dtype=np.int64)
+    normes = np.sqrt(np.bincount(np.repeat(np.arange(total), longueurs), weights=data ** 2, minlength=total))
+    data /= np.repeat(normes, longueurs).astype(np.float32)
+    matrice = Creuse(np.concatenate(([0], np.cumsum(longueurs))), indices, data)
+
+    ids = np.array([p['id'] for p in produits], dtype=np.int64)
+    categories = np.array([p['categorie_id'] or 0 for p in produits], dtype=np.int64)
+    return ids, categories, (matrice, _transposer(matrice, len(vocabulaire)))
+
+
+def _similarites(lignes, categories, vecteurs):
+    """Scores (len(lignes) x produits) des lignes contre tout le catalogue, par produit creux."""
+    matrice, transposee = vecteurs
+    total = len(categories)
+    # Mots des lignes demandées, puis, pour chaque mot, les produits qui le contiennent
+    debuts = matrice.indptr[lignes]
+    longueurs = matrice.indptr[lignes + 1] - debuts
+    positions = _plages(debuts, longueurs)
+    rangs = np.repeat(np.arange(len(lignes)), longueurs)
+    mots = matrice.indices[positions]
+    debuts = transposee.indptr[mots]
+    longueurs = transposee.indptr[mots + 1] - debuts
+    postings = _plages(debuts, longueurs)
+    cellules = np.repeat(rangs * total, longueurs) + transposee.indices[postings]
+    poids = np.repeat(matrice.data[positions], longueurs) * transposee.data[postings]
+    scores = np.bincount(cellules, weights=poids, minlength=len(lignes) * total).reshape(len(lignes), total)
+    scores += BONUS_CATEGORIE * (categories[lignes][:, None] == categories[None, :])
+    scores[np.arange(len(lignes)), lignes] = -np.inf
+    return scores
+
+
+def _plus_proches(scores, k):
+    """Indices et scores des k meilleurs voisins (au moins un mot en commun) de chaque ligne, du meilleur au moins bon."""
+    k = min(k, scores.shape[1] - 1)
+    if k <= 0:
+        return [[] for _ in range(scores.shape[0])]
+    candidats = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    valeurs = np.take_along_axis(scores, candidats, axis=1)
+    ordre = np.argsort(-valeurs, axis=1)
+    candidats = np.take_along_axis(candidats, ordre, axis=1)
+    valeurs = np.take_along_axis(valeurs, ordre, axis=1)
+    return [
+        [(int(c), float(v)) for c, v in zip(ligne_c, ligne_v) if v > BONUS_CATEGORIE]
+        for ligne_c, ligne_v in zip(candidats, valeurs)
+    ]
+
+
+def _enregistrer(ids, lignes, voisins):
+    produits = [int(ids[ligne]) for ligne in lignes]
+    with transaction.atomic():
+        models.ProduitSimilaire.objects.filter(produit_id__in=produits).delete()
+        models.ProduitSimilaire.objects.bulk_create([
+            models.ProduitSimilaire(produit_id=produit, similaire_id=int(ids[colonne]), rang=rang, score=score)
+            for produit, liste in zip(produits, voisins)
+            for rang, (colonne, score) in enumerate(liste)
+        ])
+
+
+def _lignes_impactees(ids, categories, vecteurs, modifies, k):
+    """
+    Lignes dont la liste de voisins peut changer après modification des produits modifies.
+
+    Ce sont les produits modifiés eux-mêmes, ceux qui les avaient pour voisins, et
+    ceux pour qui un produit modifié dépasse désormais le k-ième voisin stocké. Le
+    seuil (k-ième score) n'est lu que pour les produits qui partagent un mot avec
+    un produit modifié.
+    """
+    position = {int(i): ligne for ligne, i in enumerate(ids)}
+    lignes_modifiees = np.array([position[i] for i in modifies if i in position], dtype=np.int64)
+    impactees = set(lignes_modifiees.tolist())
+
+    voisins_de = models.ProduitSimilaire.objects.filter(similaire_id__in=modifies).values_list('produit_id', flat=True)
+    impactees.update(position[i] for i in voisins_de if i in position)
+
+    if len(lignes_modifiees):
+        # Meilleur score d'un produit modifié pour chaque produit du catalogue
+        meilleurs = np.full(len(ids), -np.inf)
+        for debut in range(0, len(lignes_modifiees), TAILLE_LOT):
+            scores = _similarites(lignes_modifiees[debut:debut + TAILLE_LOT], categories, vecteurs)
+            np.maximum(meilleurs, scores.max(axis=0), out=meilleurs)
+        candidats = np.nonzero(meilleurs > BONUS_CATEGORIE)[0]
+        seuils = {}
+        for debut in range(0, len(candidats), TAILLE_REQUETE):
+            listes = (
+                models.ProduitSimilaire.objects.filter(produit_id__in=ids[candidats[debut:debut + TAILLE_REQUETE]].tolist())
+                .values('produit_id').annotate(nombre=Count('id'), minimum=Min('score')).order_by()
+            )
+            seuils.update((liste['produit_id'], liste['minimum']) for liste in listes if liste['nombre'] >= k)
+        impactees.update(
+            int(ligne) for ligne in candidats if meilleurs[ligne] > seuils.get(int(ids[ligne]), BONUS_CATEGORIE)
+        )
+    return sorted(impactees)
+
+
+def calculer(modifies=None, k=NOMBRE_VOISINS):
+    """
+    Calcule les voisins de tout le catalogue, ou seulement ce qui dépend des produits modifies.
+
+    Retourne le nombre de produits dont la liste a été recalculée.
+    """
+    produits = list(
+        models.Produit.objects.filter(status=True).order_by('id')
+        .values('id', 'nom', 'description', 'description_deal', 'categorie_id', 'categorie__nom')
+    )
+    if modifies is None:
+        models.ProduitSimilaire.objects.exclude(produit__status=True).delete()
+    else:
+        modifies = [int(i) for i in modifies]
+        # Produits désactivés ou supprimés : ils n'ont plus de liste propre
+        models.ProduitSimilaire.objects.filter(produit_id__in=modifies).exclude(produit__status=True).delete()
+    if not produits:
+        return 0
+
+    ids, categories, vecteurs = vectoriser(produits)
+    if modifies is None:
+        lignes = list(range(len(ids)))
+    else:
+        lignes = _lignes_impactees(ids, categories, vecteurs, modifies, k)
+
+    for debut in range(0, len(lignes), TAILLE_LOT):
+        lot = np.array(lignes[debut:debut + TAILLE_LOT], dtype=np.int64)
+        _enregistrer(ids, lot, _plus_proches(_similarites(lot, categories, vecteurs), k))
+    invalider('produits')
+    return len(lignes)
+
+
+def modifies_depuis(date):
+    """Produits modifiés depuis date (désactivés compris)."""
+    return list(models.Produit.objects.filter(date_update__gte=date).values_list('id', flat=True))
+
+
+def similaires(produit, limite=3):
+    """Deals similaires stockés, ou à défaut des deals de la même catégorie (produit pas encore calculé)."""
+    voisins = [
+        s.similaire for s in
+        models.ProduitSimilaire.objects.filter(produit=produit, similaire__status=True)
+        .select_related('similaire').order_by('rang')[:limite]
+    ]
+    if voisins:
+        return voisins
+    return list(models.Produit.objects.filter(categorie=produit.categorie, status=True).exclude(id=produit.id)[:limite])
@@ -1,11 +1,21 @@
-from django.test import TestCase, Client
+from django.conf import settings
+from django.test import TestCase, Client, override_settings
 from django.contrib.auth.models import User
 from django.urls import reverse
+from django.utils import timezone
+from . import notifications, paiement, reservations
+from .paiement_factice import ServeurFactice
 from .models import (
     CategorieEtablissement, CategorieProduit, Etablissement,
-    Produit, Favorite
+    Produit, Favorite, Reservation, NotificationPaiement
 )
+from unittest.mock import patch
+import csv
 import datetime
+import io
+import json
+import zipfile
+import numpy as np
 
 class ShopConsolidatedTest(TestCase):
     """Tests consolidés pour l'application Shop (Modèles, Stock, Sécurité)"""
@@ -112,3 +122,693 @@ class ShopConsolidatedTest(TestCase):
         self.produit.delete()
         with self.assertRaises(Produit.DoesNotExist):
             Produit.objects.get(id=produit_id)
+
+
+class ShopPaginationTest(TestCase):
+    """Tests de la pagination keyset de la liste des deals"""
+
+    def setUp(self):
+        self.client = Client()
+        user = User.objects.create_user(username="vendor", password="password123")
+        self.cat_etab = CategorieEtablissement.objects.create(nom="Alimentation", description="Desc")
+        self.cat_prod = CategorieProduit.objects.create(nom="Fruits", description="Desc", categorie=self.cat_etab)
+        etablissement = Etablissement.objects.create(
+            user=user, nom="Ma Boutique", description="Desc", categorie=self.cat_etab,
+            nom_du_responsable="Jean", prenoms_duresponsable="Dupont", adresse="Abidjan",
+            pays="CI", contact_1="0102030405", email="boutique@test.com"
+        )
+        self.produits = [
+            Produit.objects.create(
+                nom=f"Deal {i}", prix=100 + i, quantite=10,
+                categorie=self.cat_prod, etablissement=etablissement
+            )
+            for i in range(30)
+        ]
+
+    def test_pages_sans_doublon_ni_trou(self):
+        """Parcourir les curseurs retourne chaque produit une seule fois, du plus récent au plus ancien"""
+        from .pagination import page_keyset
+        vus = []
+        curseur = None
+        while True:
+            page, curseur = page_keyset(Produit.objects.filter(status=True), curseur, par_page=7)
+            vus.extend(p.id for p in page)
+            if curseur is None:
+                break
+        attendus = [p.id for p in sorted(self.produits, key=lambda p: (p.date_add, p.id), reverse=True)]
+        self.assertEqual(vus, attendus)
+
+    def test_api_produits_page_suivante(self):
+        """L'endpoint JSON renvoie les cartes de la page suivante et le curseur"""
+        response = self.client.get('/deals/')
+        curseur = response.context['curseur_suivant']
+        self.assertIsNotNone(curseur)
+        self.assertEqual(len(response.context['produits']), 12)
+
+        data = self.client.get(reverse('produits_page'), {'curseur': curseur}).json()
+        self.assertTrue(data['success'])
+        self.assertIn('Deal 17', data['grille'])
+        self.assertNotIn('Deal 18', data['grille'])
+
+    def test_curseur_invalide_ignore(self):
+        """Un curseur corrompu renvoie la première page"""
+        response = self.client.get('/deals/', {'curseur': '%%%pas-un-curseur'})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Deal 29')
+
+
+class ShopRechercheTest(TestCase):
+    """Tests de la recherche plein texte des produits"""
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username="vendor", password="password123")
+        cat_etab = CategorieEtablissement.objects.create(nom="Bien-être", description="Desc")
+        self.cat_prod = CategorieProduit.objects.create(nom="Spa", description="Desc", categorie=cat_etab)
+        self.etablissement = Etablissement.objects.create(
+            user=self.user, nom="Zen Cocody", description="Desc", categorie=cat_etab,
+            nom_du_responsable="Jean", prenoms_duresponsable="Dupont", adresse="Abidjan",
+            pays="CI", contact_1="0102030405", email="zen@test.com"
+        )
+        self.massage = Produit.objects.create(
+            nom="Massage relaxant", description="Une heure de détente", description_deal="Huiles essentielles",
+            prix=15000, quantite=10, categorie=self.cat_prod, etablissement=self.etablissement
+        )
+        self.soin = Produit.objects.create(
+            nom="Soin du visage", description="Inclut un massage du cuir chevelu", description_deal="",
+            prix=10000, quantite=10, categorie=self.cat_prod, etablissement=self.etablissement
+        )
+
+    def test_classement_par_pertinence(self):
+        """Un terme présent dans le nom classe le produit avant une simple mention dans la description"""
+        from .recherche import rechercher
+        resultats, total = rechercher("massage")
+        self.assertEqual(total, 2)
+        self.assertEqual(resultats[0], self.massage)
+
+    def test_recherche_accents_prefixe_et_etablissement(self):
+        """La recherche ignore les accents, accepte les préfixes et couvre le nom de l'établissement"""
+        from .recherche import rechercher
+        self.assertEqual(rechercher("detente")[0], [self.massage])
+        self.assertEqual(rechercher("relax")[0], [self.massage])
+        self.assertEqual(rechercher("cocody")[1], 2)
+
+    def test_index_mis_a_jour_a_la_modification(self):
+        """L'index suit les modifications, les renommages d'établissement et les suppressions"""
+        from .recherche import rechercher
+        self.soin.nom = "Pédicure"
+        self.soin.save()
+        self.assertEqual(rechercher("pedicure")[0], [self.soin])
+
+        self.etablissement.nom = "Oasis Plateau"
+        self.etablissement.save()
+        self.assertEqual(rechercher("oasis")[1], 2)
+
+        self.massage.delete()
+        self.assertEqual(rechercher("relaxant")[1], 0)
+
+    def test_page_deals_recherche(self):
+        """La page des deals affiche les résultats et un message quand rien ne correspond"""
+        response = self.client.get('/deals/', {'q': 'visage'})
+        self.assertContains(response, "Soin du visage")
+        self.assertNotContains(response, "Massage relaxant")
+
+        response = self.client.get('/deals/', {'q': 'introuvable'})
+        self.assertContains(response, "aucun-resultat")
+
+    def test_commande_reconstruction(self):
+        """La commande de reconstruction réindexe tout le catalogue"""
+        from django.core.management import call_command
+        from io import StringIO
+        from .recherche import rechercher
+        out = StringIO()
+        call_command('reconstruire_recherche', stdout=out)
+        self.assertIn("2 produits indexés", out.getvalue())
+        self.assertEqual(rechercher("massage")[1], 2)
+
+
+class ShopFacettesTest(TestCase):
+    """Tests des facettes précalculées et des tris de la page des deals"""
+
+    def setUp(self):
+        from cities_light.models import City, Country
+        self.client = Client()
+        user = User.objects.create_user(username="vendor", password="password123")
+        self.cat_etab = CategorieEtablissement.objects.create(nom="Alimentation", description="Desc")
+        self.cat_prod = CategorieProduit.objects.create(nom="Fruits", description="Desc", categorie=self.cat_etab)
+        pays = Country.objects.create(name="Côte d'Ivoire")
+        self.abidjan = City.objects.create(name="Abidjan", country=pays)
+        self.bouake = City.objects.create(name="Bouaké", country=pays)
+        self.etablissement = Etablissement.objects.create(
+            user=user, nom="Ma Boutique", description="Desc", categorie=self.cat_etab,
+            nom_du_responsable="Jean", prenoms_duresponsable="Dupont", adresse="Abidjan",
+            pays="CI", contact_1="0102030405", email="boutique@test.com", ville=self.abidjan
+        )
+        aujourdhui = datetime.date.today()
+        self.promo = Produit.objects.create(
+            nom="Deal promo", prix=8000, prix_promotionnel=4000, quantite=10,
+            date_debut_promo=aujourdhui - datetime.timedelta(days=1),
+            date_fin_promo=aujourdhui + datetime.timedelta(days=1),
+            categorie=self.cat_prod, etablissement=self.etablissement
+        )
+        self.produits = [
+            Produit.objects.create(
+                nom=f"Deal {i}", prix=1000 * (i + 1), quantite=10,
+                categorie=self.cat_prod, etablissement=self.etablissement
+            )
+            for i in range(15)
+        ]
+
+    def _compteurs_recalcules(self):
+        from . import facettes
+        incrementaux = facettes.compteurs()
+        facettes.reconstruire()
+        return incrementaux, facettes.compteurs()
+
+    def test_compteurs_incrementaux_identiques_au_recalcul(self):
+        """Les signaux maintiennent les mêmes compteurs qu'un recalcul complet"""
+        incrementaux, recalcules = self._compteurs_recalcules()
+        self.assertEqual(incrementaux, recalcules)
+        self.assertEqual(incrementaux['promo'], {'1': 1})
+        self.assertEqual(incrementaux['ville'], {str(self.abidjan.pk): 16})
+        self.assertEqual(incrementaux['prix']['5000-10000'], 5)
+        self.assertEqual(incrementaux['prix']['0-5000'], 5)
+
+    def test_modification_et_suppression_produit(self):
+        """Changer de tranche de prix, désactiver ou supprimer un produit ajuste les compteurs"""
+        self.produits[0].prix = 60000
+        self.produits[0].save()
+        self.produits[1].status = False
+        self.produits[1].save()
+        self.promo.delete()
+        incrementaux, recalcules = self._compteurs_recalcules()
+        self.assertEqual(incrementaux, recalcules)
+        self.assertEqual(incrementaux['prix']['50000+'], 1)
+        self.assertNotIn('promo', [f for f, valeurs in incrementaux.items() if valeurs])
+
+    def test_changement_de_ville_etablissement(self):
+        """Déplacer l'établissement transfère ses produits d'une ville à l'autre"""
+        self.etablissement.ville = self.bouake
+        self.etablissement.save()
+        incrementaux, recalcules = self._compteurs_recalcules()
+        self.assertEqual(incrementaux, recalcules)
+        self.assertEqual(incrementaux['ville'], {str(self.bouake.pk): 16})
+
+    def test_filtre_et_compteurs_sur_la_page(self):
+        """La page filtre par tranche de prix et affiche les compteurs des facettes"""
+        response = self.client.get(reverse('shop'), {'prix': '5000-10000'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(p.prix_effectif for p in response.context['produits']), [5000, 6000, 7000, 8000, 9000])
+        self.assertContains(response, 'Abidjan')
+        self.assertContains(response, '(16)')
+
+    def test_tri_par_prix_pagine(self):
+        """Le tri par prix croissant se poursuit sans trou via l'API de pages suivantes"""
+        response = self.client.get(reverse('shop'), {'tri': 'prix'})
+        prix = [p.prix_effectif for p in response.context['produits']]
+        curseur = response.context['curseur_suivant']
+        data = self.client.get(reverse('produits_page'), {'tri': 'prix', 'curseur': curseur}).json()
+        self.assertTrue(data['success'])
+        self.assertIsNone(data['curseur'])
+        self.assertEqual(prix, sorted(prix))
+        self.assertEqual(len(prix), 12)
+        self.assertEqual(prix[-1], 11000)
+
+
+class ShopPromotionsTest(TestCase):
+    """Tests de l'état de promotion matérialisé et des bascules programmées"""
+
+    def setUp(self):
+        user = User.objects.create_user(username="vendor", password="password123")
+        self.cat_etab = CategorieEtablissement.objects.create(nom="Alimentation", description="Desc")
+        self.cat_prod = CategorieProduit.objects.create(nom="Fruits", description="Desc", categorie=self.cat_etab)
+        self.etablissement = Etablissement.objects.create(
+            user=user, nom="Ma Boutique", description="Desc", categorie=self.cat_etab,
+            nom_du_responsable="Jean", prenoms_duresponsable="Dupont", adresse="Abidjan",
+            pays="CI", contact_1="0102030405", email="boutique@test.com"
+        )
+        self.aujourdhui = datetime.date.today()
+
+    def _produit(self, debut, fin, nom="Deal"):
+        return Produit.objects.create(
+            nom=nom, prix=1000, prix_promotionnel=600, quantite=10,
+            date_debut_promo=self.aujourdhui + datetime.timedelta(days=debut) if debut is not None else None,
+            date_fin_promo=self.aujourdhui + datetime.timedelta(days=fin) if fin is not None else None,
+            categorie=self.cat_prod, etablissement=self.etablissement
+        )
+
+    def test_etat_calcule_a_la_sauvegarde(self):
+        """La sauvegarde stocke le prix effectivement facturé, utilisé par le panier"""
+        from customer.models import ProduitPanier
+        en_cours = self._produit(-1, 1)
+        future = self._produit(2, 5)
+        sans_promo = self._produit(None, None)
+        self.assertEqual((en_cours.promo_active, en_cours.prix_effectif), (True, 600))
+        self.assertEqual((future.promo_active, future.prix_effectif), (False, 1000))
+        self.assertFalse(sans_promo.check_promotion)
+        self.assertEqual(ProduitPanier(produit=en_cours, quantite=3).total, 1800)
+
+    def test_bascule_en_masse(self):
+        """basculer_promotions active et termine les promotions sans sauvegarder les produits"""
+        from . import facettes, promotions
+        en_cours = self._produit(-1, 1)
+        future = self._produit(2, 5)
+        actives, terminees = promotions.basculer_promotions(self.aujourdhui + datetime.timedelta(days=2))
+        self.assertEqual((actives, terminees), (1, 1))
+        en_cours.refresh_from_db()
+        future.refresh_from_db()
+        self.assertEqual((en_cours.promo_active, en_cours.prix_effectif), (False, 1000))
+        self.assertEqual((future.promo_active, future.prix_effectif), (True, 600))
+        self.assertEqual(facettes.compteurs()['promo'], {'1': 1})
+        self.assertEqual(promotions.basculer_promotions(self.aujourdhui + datetime.timedelta(days=2)), (0, 0))
+
+    def test_bascule_recalcule_seulement_les_paniers_concernes(self):
+        """Seuls les paniers contenant un produit basculé sont recalculés"""
+        from customer.models import Panier, ProduitPanier
+        from . import promotions
+        stable = self._produit(-1, 9, nom="Stable")
+        future = self._produit(2, 5, nom="Future")
+        panier_stable, panier_future = Panier.objects.create(), Panier.objects.create()
+        ProduitPanier.objects.create(produit=stable, panier=panier_stable, quantite=1)
+        ProduitPanier.objects.create(produit=future, panier=panier_future, quantite=1)
+        Panier.objects.update(sous_total=-1)
+        promotions.basculer_promotions(self.aujourdhui + datetime.timedelta(days=2))
+        self.assertEqual(Panier.objects.get(id=panier_stable.id).sous_total, -1)
+        self.assertEqual(Panier.objects.get(id=panier_future.id).sous_total, 600)
+
+    def test_prochaine_bascule(self):
+        """La prochaine bascule est le premier début futur ou le lendemain de la première fin"""
+        from . import promotions
+        self.assertIsNone(promotions.prochaine_bascule())
+        self._produit(-1, 3)
+        self.assertEqual(promotions.prochaine_bascule(), self.aujourdhui + datetime.timedelta(days=4))
+        self._produit(2, 5)
+        self.assertEqual(promotions.prochaine_bascule(), self.aujourdhui + datetime.timedelta(days=2))
+
+    def test_deals_fin_proche(self):
+        """Les promotions en cours sont listées de la plus proche de sa fin à la plus lointaine"""
+        from . import promotions
+        loin = self._produit(-1, 9, nom="Loin")
+        proche = self._produit(-1, 0, nom="Proche")
+        self._produit(2, 5, nom="Pas commencé")
+        self.assertEqual(list(promotions.deals_fin_proche()), [proche, loin])
+        response = Client().get(reverse('index'))
+        self.assertContains(response, 'deals-fin-proche')
+        self.assertContains(response, 'Proche')
+
+
+class ShopSimilairesTest(TestCase):
+    """Tests du calcul hors ligne des deals similaires"""
+
+    def setUp(self):
+        user = User.objects.create_user(username="vendor", password="password123")
+        cat_etab = CategorieEtablissement.objects.create(nom="Beauté", description="Desc")
+        self.soins = CategorieProduit.objects.create(nom="Soins", description="Desc", categorie=cat_etab)
+        self.repas = CategorieProduit.objects.create(nom="Repas", description="Desc", categorie=cat_etab)
+        etablissement = Etablissement.objects.create(
+            user=user, nom="Ma Boutique", description="Desc", categorie=cat_etab,
+            nom_du_responsable="Jean", prenoms_duresponsable="Dupont", adresse="Abidjan",
+            pays="CI", contact_1="0102030405", email="boutique@test.com"
+        )
+
+        def produit(nom, description, categorie):
+            return Produit.objects.create(
+                nom=nom, description=description, description_deal=description, prix=1000, quantite=10,
+                categorie=categorie, etablissement=etablissement
+            )
+
+        self.massage = produit("Massage relaxant", "Massage aux huiles essentielles", self.soins)
+        self.massage_duo = produit("Massage duo", "Massage relaxant pour deux aux huiles", self.soins)
+        self.manucure = produit("Manucure", "Soin des ongles et vernis", self.soins)
+        self.pizza = produit("Pizza géante", "Pizza au feu de bois", self.repas)
+        self.pizza_duo = produit("Pizza duo", "Deux pizzas au feu de bois", self.repas)
+        musique = CategorieProduit.objects.create(nom="Musique", description="Desc", categorie=cat_etab)
+        self.piano = produit("Cours de piano", "Leçon particulière", musique)
+
+    def test_voisins_pertinents(self):
+        """Les voisins partagent du vocabulaire et sont classés par similarité"""
+        from . import similaires
+        self.assertEqual(similaires.calculer(), 6)
+        self.assertEqual(similaires.similaires(self.piano), [])
+        self.assertEqual(similaires.similaires(self.massage)[0], self.massage_duo)
+        self.assertEqual(similaires.similaires(self.pizza)[0], self.pizza_duo)
+        voisins_pizza = [s.similaire_id for s in self.pizza.similaires.all()]
+        self.assertNotIn(self.massage.id, voisins_pizza)
+        self.assertNotIn(self.pizza.id, voisins_pizza)
+
+    def test_recalcul_incremental(self):
+        """Modifier un produit ne recalcule que les listes qui en dépendent"""
+        from . import similaires
+        similaires.calculer()
+        self.manucure.nom = "Pizza margherita"
+        self.manucure.description = "Pizza au feu de bois"
+        self.manucure.categorie = self.repas
+        self.manucure.save()
+        recalcules = similaires.calculer([self.manucure.id])
+        self.assertLess(recalcules, 6)
+        self.assertFalse(self.piano.similaires.exists())
+        self.assertIn(self.manucure, similaires.similaires(self.pizza, limite=2))
+        self.assertNotIn(self.manucure, similaires.similaires(self.massage))
+
+    def test_vecteurs_creux(self):
+        """Seuls les mots présents sont stockés ; deux textes identiques ont une similarité de 1"""
+        from . import similaires
+        produits = [
+            {'id': i, 'nom': nom, 'categorie_id': None, 'categorie__nom': '', 'description_deal': '', 'description': ''}
+            for i, nom in enumerate(["Pizza au feu de bois", "Pizza au feu de bois", "Cours de piano", ""])
+        ]
+        _, categories, vecteurs = similaires.vectoriser(produits)
+        self.assertEqual(len(vecteurs[0].data), 3 + 3 + 2)
+        scores = similaires._similarites(np.array([0, 3]), categories, vecteurs)
+        self.assertAlmostEqual(scores[0, 1], 1 + similaires.BONUS_CATEGORIE, places=5)
+        self.assertEqual(scores[0, 2], similaires.BONUS_CATEGORIE)
+        self.assertEqual(scores[1].max(), similaires.BONUS_CATEGORIE)
+
+    def test_fiche_produit(self):
+        """La fiche affiche les voisins calculés, ou la même catégorie avant le premier calcul"""
+        response = Client().get(reverse('product_detail', args=[self.pizza.slug]))
+        self.assertNotIn(self.pizza, response.context['produits'])
+        from . import similaires
+        similaires.calculer()
+        response = Client().get(reverse('product_detail', args=[self.pizza.slug]))
+        self.assertEqual(response.context['produits'][0], self.pizza_duo)
+
+
+class ShopArbreCategoriesTest(TestCase):
+    """Tests de l'arbre de navigation des catégories mis en cache"""
+
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        user = User.objects.create_user(username="vendor", password="password123")
+        self.cat_etab = CategorieEtablissement.objects.create(nom="Alimentation", description="Desc")
+        self.fruits = CategorieProduit.objects.create(nom="Fruits", description="Desc", categorie=self.cat_etab)
+        self.legumes = CategorieProduit.objects.create(nom="Légumes", description="Desc", categorie=self.cat_etab)
+        self.etablissement = Etablissement.objects.create(
+            user=user, nom="Ma Boutique", description="Desc", categorie=self.cat_etab,
+            nom_du_responsable="Jean", prenoms_duresponsable="Dupont", adresse="Abidjan",
+            pays="CI", contact_1="0102030405", email="boutique@test.com"
+        )
+        for i in range(3):
+            Produit.objects.create(nom=f"Pomme {i}", prix=100, quantite=10, categorie=self.fruits, etablissement=self.etablissement)
+
+    def test_arbre_et_compteurs(self):
+        """Chaque nœud porte ses sous-catégories et le nombre de produits actifs"""
+        from . import categories
+        noeud, = categories.arbre()
+        self.assertEqual((noeud['nom'], noeud['nombre']), ("Alimentation", 3))
+        self.assertEqual([(e['nom'], e['nombre']) for e in noeud['enfants']], [("Fruits", 3), ("Légumes", 0)])
+
+    def test_aucune_requete_en_regime_etabli(self):
+        """Une fois en cache, l'arbre ne coûte aucune requête"""
+        from . import categories
+        categories.arbre()
+        with self.assertNumQueries(0):
+            categories.arbre()
+
+    def test_invalidation(self):
+        """Ajouter un produit ou renommer une catégorie met l'arbre à jour"""
+        from . import categories
+        categories.arbre()
+        Produit.objects.create(nom="Carotte", prix=100, quantite=10, categorie=self.legumes, etablissement=self.etablissement)
+        self.legumes.nom = "Légumes frais"
+        self.legumes.save()
+        enfants = categories.arbre()[0]['enfants']
+        self.assertEqual([(e['nom'], e['nombre']) for e in enfants], [("Fruits", 3), ("Légumes frais", 1)])
+
+    def test_barre_laterale(self):
+        """La barre latérale des deals affiche les compteurs de l'arbre"""
+        response = Client().get(reverse('shop'))
+        self.assertContains(response, 'Fruits <span>(3)</span>', html=False)
+
+
+class ShopReservationsTest(TestCase):
+    """Tests des réservations de stock à durée limitée"""
+
+    def setUp(self):
+        from customer.models import Customer, Panier
+        user = User.objects.create_user(username="vendor", password="password123")
+        cat_etab = CategorieEtablissement.objects.create(nom="Alimentation", description="Desc")
+        cat_prod = CategorieProduit.objects.create(nom="Fruits", description="Desc", categorie=cat_etab)
+        etablissement = Etablissement.objects.create(
+            user=user, nom="Ma Boutique", description="Desc", categorie=cat_etab,
+            nom_du_responsable="Jean", prenoms_duresponsable="Dupont", adresse="Abidjan",
+            pays="CI", contact_1="0102030405", email="boutique@test.com"
+        )
+        self.deal = Produit.objects.create(
+            nom="Flash", prix=1000, quantite=5, categorie=cat_prod, etablissement=etablissement
+        )
+        self.paniers = [Panier.objects.create() for _ in range(2)]
+        self.client_user = User.objects.create_user(username="client", password="password123")
+        self.customer = Customer.objects.create(user=self.client_user, adresse="A", contact_1="1")
+
+    def test_stock_disponible(self):
+        """Le disponible est le stock moins les réservations vivantes des autres paniers"""
+        reservations.reserver(self.paniers[0], {self.deal.id: 3})
+        self.assertEqual(reservations.disponibles([self.deal.id]), {self.deal.id: 2})
+        self.assertEqual(reservations.disponibles([self.deal.id], sauf_panier=self.paniers[0]), {self.deal.id: 5})
+        with self.assertRaises(ValueError):
+            reservations.reserver(self.paniers[1], {self.deal.id: 3})
+        reservations.reserver(self.paniers[1], {self.deal.id: 2})
+        # Un panier peut ajuster sa propre réservation
+        reservations.reserver(self.paniers[0], {self.deal.id: 1})
+        self.assertEqual(reservations.disponibles([self.deal.id]), {self.deal.id: 2})
+
+    def test_expiration(self):
+        """Une réservation expirée ne retient plus le stock et est supprimée par lots"""
+        reservations.reserver(self.paniers[0], {self.deal.id: 5})
+        Reservation.objects.update(expire_le=timezone.now() - datetime.timedelta(seconds=1))
+        self.assertEqual(reservations.disponibles([self.deal.id]), {self.deal.id: 5})
+        reservations.reserver(self.paniers[1], {self.deal.id: 5})
+        self.assertEqual(reservations.liberer_expirees(taille_lot=1), 1)
+        self.assertEqual(list(Reservation.objects.values_list('panier_id', flat=True)), [self.paniers[1].id])
+
+    def test_ajout_au_panier_refuse_au_dela_du_stock(self):
+        """L'ajout au panier réserve le stock ; au-delà, il est refusé sans effet"""
+        from customer.models import ProduitPanier
+        ajout = json.dumps({'produit': self.deal.id, 'quantite': 4})
+        self.assertTrue(Client().post(reverse('add_to_cart'), ajout, content_type='application/json').json()['success'])
+        data = Client().post(reverse('add_to_cart'), ajout, content_type='application/json').json()
+        self.assertFalse(data['success'])
+        self.assertEqual(list(ProduitPanier.objects.values_list('quantite', flat=True)), [4])
+
+    def test_commande_consomme_la_reservation(self):
+        """La commande décrémente le stock et supprime la réservation du panier"""
+        from customer.commandes import passer_commande
+        from customer.models import Panier, ProduitPanier
+        panier = Panier.objects.create(customer=self.customer)
+        ProduitPanier.objects.create(produit=self.deal, panier=panier, quantite=2)
+        self.client.login(username="client", password="password123")
+        self.assertEqual(self.client.get(reverse('checkout')).status_code, 200)
+        self.assertEqual(reservations.disponibles([self.deal.id]), {self.deal.id: 3})
+        reservations.reserver(self.paniers[0], {self.deal.id: 3})
+        passer_commande(panier.id, self.customer, transaction_id='T1')
+        self.deal.refresh_from_db()
+        self.assertEqual(self.deal.quantite, 3)
+        self.assertEqual(reservations.disponibles([self.deal.id]), {self.deal.id: 0})
+
+
+class ShopPaiementTest(TestCase):
+    """Passerelle de paiement : pool, timeouts, tentatives bornées et disjoncteur"""
+
+    def passerelle(self, serveur, **config):
+        return paiement.Passerelle(dict(settings.CINETPAY, URL=serveur.url, **config))
+
+    def serveur(self, **options):
+        serveur = ServeurFactice(**options).demarrer()
+        self.addCleanup(serveur.arreter)
+        return serveur
+
+    def test_initier_et_verifier(self):
+        """Le paiement créé chez le fournisseur est retrouvé par son transaction_id"""
+        serveur = self.serveur()
+        passerelle = self.passerelle(serveur)
+        donnees = passerelle.initier('T1', 2500.0, "Commande", notify_url='/n', return_url='/r')
+        self.assertTrue(donnees['payment_url'].endswith(donnees['payment_token']))
+        self.assertEqual(passerelle.verifier('T1')['status'], 'PENDING')
+        with self.assertRaises(paiement.ErreurPaiement):
+            passerelle.initier('T1', 2500.0, "Commande", notify_url='/n', return_url='/r')
+
+    def test_tentatives_bornees(self):
+        """Un fournisseur en erreur est rappelé TENTATIVES fois, pas plus"""
+        serveur = self.serveur(taux_erreur=1)
+        with self.assertRaises(paiement.ErreurPaiement):
+            self.passerelle(serveur, TENTATIVES=2).verifier('T1')
+        self.assertEqual(serveur.appels, 3)
+
+    def test_timeout_de_lecture(self):
+        """Un fournisseur lent est abandonné au timeout, sans nouvelle tentative"""
+        serveur = self.serveur(latence=0.5)
+        with self.assertRaises(paiement.ErreurPaiement):
+            self.passerelle(serveur, TIMEOUT_LECTURE=0.1).verifier('T1')
+        self.assertEqual(serveur.appels, 1)
+
+    def test_disjoncteur(self):
+        """Après SEUIL échecs, les appels échouent sans solliciter le fournisseur"""
+        serveur = self.serveur(taux_erreur=1)
+        passerelle = self.passerelle(serveur, TENTATIVES=0, SEUIL_DISJONCTEUR=2, DELAI_DISJONCTEUR=60)
+        for _ in range(2):
+            with self.assertRaises(paiement.ErreurPaiement):
+                passerelle.verifier('T1')
+        with self.assertRaises(paiement.PasserelleIndisponible):
+            passerelle.verifier('T1')
+        self.assertEqual(serveur.appels, 2)
+
+        # Passé le délai, un appel d'essai réussi referme le disjoncteur
+        serveur.taux_erreur = 0
+        passerelle.disjoncteur.ouvert_jusqua = 0
+        with self.assertRaises(paiement.ErreurPaiement):
+            passerelle.verifier('inconnue')
+        self.assertEqual(passerelle.disjoncteur.echecs, 0)
+
+
+class ShopNotificationsTest(TestCase):
+    """Notifications de paiement : enregistrées par la vue, appliquées en arrière-plan"""
+
+    def setUp(self):
+        from customer.models import Commande, Customer, ProduitPanier
+        self.serveur = ServeurFactice().demarrer()
+        self.addCleanup(self.serveur.arreter)
+        reglages = override_settings(CINETPAY=dict(settings.CINETPAY, URL=self.serveur.url, TENTATIVES=0))
+        reglages.enable()
+        self.addCleanup(reglages.disable)
+
+        user = User.objects.create_user(username="vendor", password="password123")
+        cat_etab = CategorieEtablissement.objects.create(nom="Alimentation", description="Desc")
+        cat_prod = CategorieProduit.objects.create(nom="Fruits", description="Desc", categorie=cat_etab)
+        etablissement = Etablissement.objects.create(
+            user=user, nom="Ma Boutique", description="Desc", categorie=cat_etab,
+            nom_du_responsable="Jean", prenoms_duresponsable="Dupont", adresse="Abidjan",
+            pays="CI", contact_1="0102030405", email="boutique@test.com"
+        )
+        self.deal = Produit.objects.create(nom="Flash", prix=1000, quantite=3, categorie=cat_prod, etablissement=etablissement)
+        customer = Customer.objects.create(user=User.objects.create_user(username="client"), adresse="A", contact_1="1")
+        self.commande = Commande.objects.create(customer=customer, prix_total=2000, transaction_id='T1')
+        ProduitPanier.objects.create(produit=self.deal, commande=self.commande, quantite=2)
+        self.token = paiement.passerelle().initier('T1', 2000, "Commande", notify_url='', return_url='')['payment_token']
+
+    def notifier(self, transaction_id='T1'):
+        return self.client.post(reverse('paiement_notification'), {'cpm_trans_id': transaction_id, 'cpm_site_id': ''})
+
+    def test_notifications_dedoublonnees(self):
+        """Une écriture par notification, une ligne par transaction"""
+        for _ in range(3):
+            with self.assertNumQueries(1):
+                self.assertEqual(self.notifier().status_code, 200)
+        self.assertEqual(NotificationPaiement.objects.count(), 1)
+        self.assertEqual(self.notifier('').status_code, 400)
+
+    def test_paiement_accepte(self):
+        """Le worker relit le paiement chez le fournisseur et marque la commande payée"""
+        self.serveur.terminer(self.token, 'ACCEPTED')
+        self.notifier()
+        self.notifier()
+        self.assertEqual(notifications.traiter(), 1)
+        self.assertEqual(notifications.traiter(), 0)
+        self.commande.refresh_from_db()
+        self.assertEqual(self.commande.statut_paiement, 'payee')
+        self.assertEqual(NotificationPaiement.objects.get().statut, 'ACCEPTED')
+
+    def test_paiement_refuse(self):
+        """Un paiement refusé rend le stock commandé, une seule fois"""
+        self.serveur.terminer(self.token, 'REFUSED')
+        for _ in range(2):
+            self.notifier()
+            notifications.traiter()
+        self.commande.refresh_from_db()
+        self.deal.refresh_from_db()
+        self.assertEqual((self.commande.statut_paiement, self.deal.quantite), ('refusee', 5))
+
+    def test_paiement_en_attente(self):
+        """Tant que le paiement n'est pas terminé, la commande reste en attente"""
+        self.notifier()
+        self.assertEqual(notifications.traiter(), 1)
+        self.commande.refresh_from_db()
+        self.assertEqual(self.commande.statut_paiement, 'en_attente')
+
+    def test_fournisseur_injoignable(self):
+        """Un fournisseur en erreur repousse la notification au lieu de la perdre"""
+        self.serveur.taux_erreur = 1
+        self.notifier()
+        self.assertEqual(notifications.traiter(), 0)
+        notification = NotificationPaiement.objects.get()
+        self.assertTrue(notification.a_traiter)
+        self.assertEqual(notification.tentatives, 1)
+        self.assertGreater(notification.prochain_essai, timezone.now())
+
+
+@override_settings(RENDU_PDF=dict(settings.RENDU_PDF, MOTEUR='reportlab'))
+class ShopExportRecusTest(TestCase):
+    """Export ZIP des reçus d'un établissement : filtres de commande_reçu, reçus rendus par le pool"""
+
+    def setUp(self):
+        from customer.models import Commande, Customer, ProduitPanier
+        from website.models import SiteInfo
+        SiteInfo.objects.create(
+            titre="CoolDeal", slogan="S", description="D", horaire_description="D",
+            text_pourquoi_nous_choisir="D", contact_1="1", contact_2="2", email="t@t.com",
+            adresse="A", map_url="h", facebook_url="h", instagram_url="h", twitter_url="h", whatsapp="h"
+        )
+        user = User.objects.create_user(username="vendor", password="password123")
+        cat_etab = CategorieEtablissement.objects.create(nom="Alimentation", description="Desc")
+        cat_prod = CategorieProduit.objects.create(nom="Fruits", description="Desc", categorie=cat_etab)
+        etablissement = Etablissement.objects.create(
+            user=user, nom="Ma Boutique", description="Desc", categorie=cat_etab,
+            nom_du_responsable="Jean", prenoms_duresponsable="Dupont", adresse="Abidjan",
+            pays="CI", contact_1="0102030405", email="boutique@test.com"
+        )
+        produit = Produit.objects.create(nom="Mangue", prix=1000, quantite=50, categorie=cat_prod, etablissement=etablissement)
+        autre = Etablissement.objects.create(
+            user=User.objects.create_user(username="autre"), nom="Autre", description="Desc", categorie=cat_etab,
+            nom_du_responsable="A", prenoms_duresponsable="A", adresse="A", pays="CI", contact_1="0", email="a@test.com"
+        )
+        produit_autre = Produit.objects.create(nom="Ananas", prix=500, quantite=50, categorie=cat_prod, etablissement=autre)
+
+        self.commandes = []
+        for i, prenom in enumerate(("Awa", "Awa", "Koffi")):
+            client = User.objects.create_user(username="client%d" % i, first_name=prenom, last_name="K")
+            commande = Commande.objects.create(
+                customer=Customer.objects.create(user=client, adresse="A", contact_1="1"),
+                prix_total=1000, transaction_id='EXP%d' % i,
+            )
+            ProduitPanier.objects.create(produit=produit, commande=commande, quantite=1)
+            self.commandes.append(commande)
+        hors_boutique = Commande.objects.create(prix_total=500, transaction_id='AUTRE')
+        ProduitPanier.objects.create(produit=produit_autre, commande=hors_boutique, quantite=1)
+        self.client.login(username="vendor", password="password123")
+
+    def exporter(self, **filtres):
+        response = self.client.get(reverse('commande-reçu-export'), filtres)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        self.assertTrue(response.streaming)
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        for commande in self.commandes:
+            commande.refresh_from_db()
+            if commande.recu_paiement:
+                self.addCleanup(commande.recu_paiement.storage.delete, commande.recu_paiement.name)
+        return archive, list(csv.DictReader(io.TextIOWrapper(archive.open('manifeste.csv'), encoding='utf-8')))
+
+    def test_export_complet(self):
+        """Un PDF par commande de l'établissement, et le manifeste ; les reçus rendus sont enregistrés"""
+        archive, manifeste = self.exporter()
+        self.assertEqual(
+            sorted(archive.namelist()),
+            ['manifeste.csv', 'recus/Recu_EXP0.pdf', 'recus/Recu_EXP1.pdf', 'recus/Recu_EXP2.pdf'],
+        )
+        self.assertTrue(archive.read('recus/Recu_EXP1.pdf').startswith(b'%PDF-'))
+        self.assertEqual({ligne['transaction_id'] for ligne in manifeste}, {'EXP0', 'EXP1', 'EXP2'})
+        self.assertEqual({ligne['statut'] for ligne in manifeste}, {'ok'})
+        self.assertTrue(all(commande.recu_paiement for commande in self.commandes))
+
+        # Second export : reçus enregistrés repris sans nouveau rendu
+        with patch('shop.export_recus._soumettre') as soumettre:
+            archive, manifeste = self.exporter()
+        soumettre.assert_not_called()
+        self.assertEqual(len(manifeste), 3)
+
+    def test_export_filtre(self):
+        """L'export applique les filtres de la liste des commandes"""
+        archive, manifeste = self.exporter(client="Awa")
+        self.assertEqual(sorted(ligne['transaction_id'] for ligne in manifeste), ['EXP0', 'EXP1'])
+        self.assertEqual(len(archive.namelist()), 3)
@@ -1,33 +1,97 @@
 from django.shortcuts import redirect, render,  get_object_or_404
+from django.urls import reverse
 from . import models
 from customer import models as customer_models
 from django.contrib.auth.decorators import login_required
 import json
-from django.http import JsonResponse
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
-from cinetpay_sdk.s_d_k import Cinetpay
 from cities_light.models import City
 
 from django.contrib import messages
 from .models import Produit, Favorite, Etablissement, CategorieProduit
 from customer.models import Commande
+from website.models import SiteInfo
+from customer import idempotence
+from customer.commandes import passer_commande
+from customer.panier import panier_existant
 
 from django.core.paginator import Paginator
+from django.template.loader import render_to_string
 from django.utils import timezone
+from .pagination import page_keyset
+from . import export_recus, facettes, notifications, paiement, recherche, reservations, similaires
+from base.cache import cache_page_anonyme
 
 
 # Create your views here.
+def _page_deals(request, produits):
+    """
+    Page courante des deals, filtrée par les facettes de la querystring.
+
+    Une recherche sans tri explicite est classée par pertinence ; sinon on pagine
+    en keyset selon le tri choisi (récents, prix, remise).
+    """
+    requete = request.GET.get('q', '').strip()
+    curseur = request.GET.get('curseur')
+    tri = request.GET.get('tri')
+    produits = facettes.filtrer(produits, facettes.selection(request.GET))
+    if requete and tri not in facettes.TRIS:
+        return recherche.page_recherche(requete, produits, curseur)
+    if requete:
+        produits = recherche.filtrer(produits, requete)
+    produits, ordre = facettes.trier(produits, tri)
+    produits, curseur_suivant = page_keyset(produits, curseur, ordre)
+    return produits, curseur_suivant, None
+
+
+def _contexte_deals(request, produits):
+    produits, curseur_suivant, total = _page_deals(request, produits)
+    params = request.GET.copy()
+    params.pop('curseur', None)
+    return {
+        'produits' : produits,
+        'curseur_suivant': curseur_suivant,
+        'requete': request.GET.get('q', '').strip(),
+        'total_resultats': total,
+        'facettes': facettes.blocs(params, facettes.selection(request.GET)),
+        'tri': request.GET.get('tri', ''),
+        'tris': facettes.LIBELLES_TRI,
+        'params_liste': params.urlencode(),
+    }
+
+
+@cache_page_anonyme('produits', 'site')
 def shop(request):
     produits = models.Produit.objects.filter(status=True)
-    datas = {
-        'produits' : produits
+    return render(request, 'shop.html', _contexte_deals(request, produits))
+
+
+def produits_page(request):
+    """Page suivante des cartes produits (défilement infini de shop.html)."""
+    slug = request.GET.get('categorie_slug')
+    if slug:
+        categorie, produits = _produits_categorie(slug)
+        if categorie is None:
+            return JsonResponse({'success': False, 'message': "Catégorie introuvable"}, status=404)
+    else:
+        produits = models.Produit.objects.filter(status=True)
+
+    produits, curseur_suivant, _ = _page_deals(request, produits)
+    data = {
+        'success': True,
+        'grille': render_to_string('partials/produits-grille.html', {'produits': produits}, request=request),
+        'liste': render_to_string('partials/produits-liste.html', {'produits': produits}, request=request),
+        'curseur': curseur_suivant,
     }
-    return render(request, 'shop.html', datas)
+    return JsonResponse(data, safe=False)
 
 
+@cache_page_anonyme('produits', 'site')
 def product_detail(request, slug):
     produit = get_object_or_404(Produit, slug=slug)
-    produits = Produit.objects.filter(categorie=produit.categorie).exclude(id=produit.id)[:3]
+    produits = similaires.similaires(produit)
 
     
     is_favorited = False
@@ -66,6 +130,13 @@ def cart(request):
 
 @login_required(login_url='login')
 def checkout(request):
+    # Ouvrir le paiement retient le stock du panier pour la durée de la réservation
+    panier = panier_existant(request)
+    if panier:
+        try:
+            reservations.reserver_panier(panier)
+        except ValueError as e:
+            return render(request, 'cart.html', {'erreur_stock': str(e)})
     datas = {}
     return render(request, 'checkout.html', datas)
 
@@ -83,24 +154,67 @@ def paiement_success(request):
         return redirect('index')
 
 
-def single(request, slug):
+def _produits_categorie(slug):
     try:
-        try:
-            categorie = models.CategorieProduit.objects.get(slug=slug)
-            produits = categorie.produit.all()
-        except:
-            categorie = models.CategorieEtablissement.objects.get(slug=slug)
-            produits = categorie.produit_etab.all()
-    except:
+        categorie = models.CategorieProduit.objects.get(slug=slug)
+        return categorie, categorie.produit.all()
+    except models.CategorieProduit.DoesNotExist:
+        pass
+    try:
+        categorie = models.CategorieEtablissement.objects.get(slug=slug)
+        return categorie, categorie.produit_etab.all()
+    except models.CategorieEtablissement.DoesNotExist:
+        return None, None
+
+
+@cache_page_anonyme('produits', 'site')
+def single(request, slug):
+    categorie, produits = _produits_categorie(slug)
+    if categorie is None:
         return redirect('shop')
 
-    datas = {
-        'produits' : produits,
-        'categorie' : categorie
-    }
+    datas = _contexte_deals(request, produits)
+    datas['categorie'] = categorie
     return render(request, 'shop.html', datas)
 
 
+def _commander(customer, cle, panier, transaction_id, notify_url, return_url):
+    """Initialise le paiement chez CinetPay puis passe la commande au montant annoncé."""
+    montant = (
+        customer_models.Panier.objects.filter(id=panier, customer=customer)
+        .values_list('total_remise', flat=True).first()
+    )
+    if montant is None:
+        return {'message': "Panier introuvable", 'success': False, 'payment_url': ""}
+
+    def initier():
+        # Appelé une fois la clé réservée et hors transaction : aucun verrou n'est tenu pendant que le fournisseur répond
+        return paiement.passerelle().initier(
+            transaction_id, montant, "Commande Cooldeal", notify_url=notify_url, return_url=return_url,
+            nom=customer.user.first_name, prenom=customer.user.last_name,
+        )
+
+    def traitement(paiement_cree):
+        try:
+            # Une seule transaction : total, stock et lignes, ou rien
+            passer_commande(
+                panier, customer, montant=montant,
+                payment_url=paiement_cree['payment_url'],
+                id_paiment=transaction_id,
+                transaction_id=transaction_id,
+                api_response_id=paiement_cree['api_response_id'],
+                payment_token=paiement_cree['payment_token'],
+            )
+        except ValueError as e:
+            return {'message': str(e), 'success': False, 'payment_url': ""}
+        return {'message': "Commande validée", 'success': True, 'payment_url': paiement_cree['payment_url']}
+
+    try:
+        return idempotence.executer(cle, customer, traitement, preparer=initier)
+    except paiement.ErreurPaiement as e:
+        return {'message': str(e), 'success': False, 'payment_url': ""}
+
+
 def post_paiement_details(request):
 
     postdata = json.loads(request.body.decode('utf-8'))
@@ -110,65 +224,35 @@ def post_paiement_details(request):
     panier = postdata['panier']
     user = request.user
 
-    url = ""
-    isSuccess = False
-
-    _ = isSuccess
     if user and panier is not None and transaction_id is not None and notify_url is not None and return_url is not None :
         try:
-            panier = customer_models.Panier.objects.get(id=panier, customer=user.customer)
-        except:
-            panier = None
-
-        if panier:
-            data = {
-                'amount': 100,
-                'currency': "XOF",
-                'transaction_id': transaction_id,
-                'description': "TRANSACTION DESCRIPTION",
-                'return_url': notify_url,
-                'notify_url': return_url,
-                'customer_name': user.first_name,
-                'customer_surname': user.last_name,
-            }
-
-            try:
-
-                commande = customer_models.Commande()
-                commande.customer = request.user.customer
-                commande.payment_url = 'payment_url'
-                commande.id_paiment = transaction_id
-                commande.transaction_id = transaction_id
-                commande.api_response_id = 'api_response_id'
-                commande.payment_token = 'payment_token'
-                commande.prix_total = panier.total_with_coupon
-                commande.save()
-
-                for i in customer_models.ProduitPanier.objects.filter(panier=panier):
-                    i.panier = None
-                    i.commande = commande
-                    i.save()
-                isSuccess = True
-                message = "Commande validée"
-                panier.delete()
-
-            except Exception as _:
-                isSuccess = False
-                message = "Une erreur s'est produite, merci de rééssayer"
-        else:
-            isSuccess = False
-            message = "Une erreur s'est produite"
+            customer = user.customer
+            cle = idempotence.cle(request, transaction_id)
+            # Une requête rejouée (même transaction_id ou Idempotency-Key) reçoit la première réponse
+            data = idempotence.reponse_enregistree(customer, cle) if cle else None
+            if data is None:
+                data = _commander(customer, cle, panier, transaction_id, notify_url, return_url)
+        except Exception as _:
+            data = {'message': "Une erreur s'est produite, merci de rééssayer", 'success': False, 'payment_url': ""}
     else:
-        isSuccess = False
-        message = "Une erreur s'est produite"
-    data = {
-        'message': message,
-        'success': isSuccess,
-        'payment_url' : url
-    }
+        data = {'message': "Une erreur s'est produite", 'success': False, 'payment_url': ""}
     return JsonResponse(data, safe=False)
 
 
+@csrf_exempt
+def paiement_notification(request):
+    """Notification du fournisseur : enregistrée ici, appliquée en arrière-plan (shop.notifications)."""
+    if request.method != 'POST':
+        # Le fournisseur vérifie que l'URL répond avant de l'appeler
+        return HttpResponse("OK")
+    transaction_id = request.POST.get('cpm_trans_id', '').strip()
+    site_id = settings.CINETPAY['SITE_ID']
+    if not transaction_id or len(transaction_id) > 100 or (site_id and request.POST.get('cpm_site_id') != site_id):
+        return HttpResponseBadRequest("Notification invalide")
+    notifications.enregistrer(transaction_id)
+    return HttpResponse("OK")
+
+
 @login_required
 def dashboard(request):
     
@@ -254,7 +338,7 @@ def article_detail(request):
     category_filter = request.GET.get("category", "")
 
     if search_query:
-        articles = articles.filter(nom__icontains=search_query)
+        articles = recherche.filtrer(articles, search_query)
 
     if category_filter:
         articles = articles.filter(categorie__nom=category_filter)
@@ -318,9 +402,7 @@ def supprimer_article(request, article_id):
     return render(request, "confirmer-suppression.html", {"article": article})
 
 
-@login_required
-def commande_reçu(request):
-    etablissement = get_object_or_404(Etablissement, user=request.user)
+def _commandes_reçu(request, etablissement):
     commandes_list = Commande.objects.filter(produit_commande__produit__etablissement=etablissement).distinct().order_by('-date_add')
 
     # 📌 Filtrage par client
@@ -347,6 +429,13 @@ def commande_reçu(request):
         commandes_list = commandes_list.filter(date_add__gte=date_min).order_by('-date_add')
     if date_max:
         commandes_list = commandes_list.filter(date_add__lte=date_max).order_by('-date_add')
+    return commandes_list
+
+
+@login_required
+def commande_reçu(request):
+    etablissement = get_object_or_404(Etablissement, user=request.user)
+    commandes_list = _commandes_reçu(request, etablissement)
 
     paginator = Paginator(commandes_list, 25)
     page_number = request.GET.get("page")
@@ -355,6 +444,21 @@ def commande_reçu(request):
     return render(request, "commande-reçu.html", {"commandes": commandes, "etablissement": etablissement})
 
 
+@login_required
+def commande_reçu_export(request):
+    """Archive ZIP des reçus des commandes filtrées (mêmes filtres que commande_reçu), diffusée au fil du rendu."""
+    etablissement = get_object_or_404(Etablissement, user=request.user)
+    commandes = _commandes_reçu(request, etablissement).select_related('customer__user')
+    logo_url = request.build_absolute_uri(SiteInfo.objects.latest('date_add').logo.url)
+
+    def detail_url(commande):
+        return request.build_absolute_uri(reverse('commande-reçu-detail', args=[commande.id]))
+
+    response = StreamingHttpResponse(export_recus.exporter(commandes, detail_url, logo_url), content_type='application/zip')
+    response['Content-Disposition'] = 'attachment; filename="Recus_%s.zip"' % timezone.localdate().isoformat()
+    return response
+
+
 @login_required
 def commande_reçu_detail(request, commande_id):
     etablissement = get_object_or_404(Etablissement, user=request.user)
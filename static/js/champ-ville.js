@@ -0,0 +1,43 @@
+// Autocomplétion des champs ville (website/templates/partials/champ-ville.html).
+// Délégation sur document : fonctionne aussi dans les formulaires rendus par Vue.
+(function () {
+    var attente = null;
+
+    function choisir(bloc, id) {
+        var champ = bloc.querySelector('.champ-ville-id');
+        champ.value = id;
+        // Met à jour un éventuel v-model
+        champ.dispatchEvent(new Event('input'));
+    }
+
+    document.addEventListener('input', function (event) {
+        var recherche = event.target;
+        if (!recherche.classList || !recherche.classList.contains('champ-ville-recherche')) { return; }
+        var bloc = recherche.closest('.champ-ville');
+        var liste = bloc.querySelector('datalist');
+
+        var options = liste.querySelectorAll('option');
+        for (var i = 0; i < options.length; i++) {
+            if (options[i].value === recherche.value) {
+                choisir(bloc, options[i].dataset.id);
+                return;
+            }
+        }
+        choisir(bloc, '');
+
+        clearTimeout(attente);
+        attente = setTimeout(function () {
+            fetch(recherche.dataset.url + '?q=' + encodeURIComponent(recherche.value))
+                .then(function (response) { return response.json(); })
+                .then(function (data) {
+                    liste.innerHTML = '';
+                    data.villes.forEach(function (ville) {
+                        var option = document.createElement('option');
+                        option.value = ville.nom;
+                        option.dataset.id = ville.id;
+                        liste.appendChild(option);
+                    });
+                });
+        }, 200);
+    });
+})();
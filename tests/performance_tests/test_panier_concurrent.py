@@ -0,0 +1,82 @@
+# tests/performance_tests/test_panier_concurrent.py
+# Benchmark de concurrence de l'ajout au panier
+# Plusieurs threads ajoutent le même produit au même panier en même temps : la
+# contrainte produit_panier_unique et l'upsert de customer.panier.ajouter_produit
+# doivent donner une seule ligne dont la quantité est la somme des ajouts
+# RELEVANT FILES: conftest.py, customer/panier.py, customer/views.py
+
+import pytest
+import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from customer.models import ProduitPanier
+from shop.models import Produit
+
+
+NAVIGATEUR = 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36'
+
+
+@pytest.fixture
+def produit_id(django_db_blocker):
+    """Premier produit actif de la base servie par le serveur de développement"""
+    with django_db_blocker.unblock():
+        produit = Produit.objects.filter(status=True).order_by('id').first()
+    if produit is None:
+        pytest.skip("Aucun produit actif dans la base")
+    return produit.id
+
+
+@pytest.mark.performance
+class TestPanierConcurrent:
+    """Ajouts simultanés du même produit depuis plusieurs onglets d'une même session"""
+
+    def test_add_to_cart_with_50_concurrent_requests(self, live_server_url, perf_helper, produit_id, django_db_blocker):
+        num_requests = 50
+        session = requests.Session()
+        # L'agent python-requests est traité comme un robot et n'aurait pas de panier
+        session.headers['User-Agent'] = NAVIGATEUR
+        # Pose le cookie CSRF, puis crée la session et un panier vide (supprimer un produit absent)
+        session.get(f"{live_server_url}/customer/cart/mini", timeout=30)
+        headers = {'X-CSRFToken': session.cookies.get('csrftoken', ''), 'User-Agent': NAVIGATEUR}
+        session.post(f"{live_server_url}/customer/cart/batch", headers=headers, timeout=30,
+                     json={'operations': [{'action': 'supprimer', 'produit': produit_id}]})
+        cookies = session.cookies.get_dict()
+        metrics = {'response_times': [], 'errors': [], 'success_count': 0, 'failure_count': 0}
+
+        def make_request():
+            return perf_helper.measure_response_time(
+                requests.post,
+                f"{live_server_url}/customer/cart/add/product",
+                json={'produit': produit_id, 'quantite': 1},
+                cookies=cookies,
+                headers=headers,
+                timeout=30
+            )
+
+        with ThreadPoolExecutor(max_workers=num_requests) as executor:
+            futures = [executor.submit(make_request) for _ in range(num_requests)]
+
+            for future in as_completed(futures):
+                result = future.result()
+                metrics['response_times'].append(result['response_time'])
+                if result['success'] and result['result'].ok and result['result'].json()['success']:
+                    metrics['success_count'] += 1
+                else:
+                    metrics['failure_count'] += 1
+                    metrics['errors'].append(result['error'] or result['result'].status_code)
+
+        stats = perf_helper.calculate_statistics(metrics)
+
+        print(f"\n=== Performance Stats add_to_cart ({num_requests} concurrent requests) ===")
+        print(f"Success rate: {stats['success_rate']:.2f}%")
+        print(f"Avg response time: {stats['avg_response_time']:.3f}s")
+        print(f"P95 response time: {stats['p95_response_time']:.3f}s")
+
+        with django_db_blocker.unblock():
+            lignes = list(ProduitPanier.objects.filter(
+                panier__session_id=cookies['sessionid'], produit_id=produit_id
+            ).values_list('quantite', flat=True))
+
+        # Jamais de doublon, et chaque ajout réussi est compté
+        assert len(lignes) == 1, "Concurrent adds must not duplicate the cart line"
+        assert lignes[0] == metrics['success_count'], "Every successful add must be counted"
@@ -1,29 +1,31 @@
-from shop import models
+from shop import categories as shop_categories
 from . import models as config_models
-from customer import models as customer_models
-from django.contrib.sessions.models import Session
-from cities_light.models import City
+from customer import panier as customer_panier
+from base import cache as cache_pages
+from django.utils.functional import SimpleLazyObject
 
 
 def categories(request):
-    cat = models.CategorieEtablissement.objects.filter(status=True)
-
-    return {'cat':cat}
+    # Arbre mis en cache : aucune requête en régime établi
+    return {'cat': SimpleLazyObject(shop_categories.arbre)}
 
 
 def site_infos(request):
-    try:
-        infos = config_models.SiteInfo.objects.latest('date_add')
-    except:
-        infos = None
-    return {'infos':infos}
-
-
-def cities(request):
+    def derniere():
+        try:
+            return config_models.SiteInfo.objects.latest('date_add')
+        except:
+            return None
+    # Requête faite seulement si un fragment de base.html n'est pas en cache
+    return {'infos': SimpleLazyObject(derniere)}
 
-    cities = City.objects.all()
 
-    return {'cities': cities}
+def versions_cache(request):
+    # Clés des fragments {% cache %} de base.html : changent quand un admin modifie les données
+    return {
+        'version_site': cache_pages.version('site'),
+        'version_categories': cache_pages.version('categories'),
+    }
 
 
 def galeries(request):
@@ -39,30 +41,5 @@ def horaires(request):
 
 
 def cart(request):
-    carts = ""
-    try:
-        if not request.session.exists(request.session.session_key):
-            request.session.create()
-        session_id = Session.objects.get(session_key=request.session.session_key)
-        if request.user.is_authenticated:
-            try:
-                customer = customer_models.Customer.objects.get(user=request.user)
-                carts = customer_models.Panier.objects.get(customer=customer, session_id=session_id)
-            except Exception as e:
-
-                customer = customer_models.Customer.objects.get(user=request.user)
-                carts = customer_models.Panier()
-                carts.session_id = session_id
-                carts.customer = customer
-                carts.save()
-        else:
-            try:
-                carts = customer_models.Panier.objects.get(session_id=session_id)
-            except Exception as e:
-
-                carts = customer_models.Panier()
-                carts.session_id = session_id
-                carts.save()
-    except:
-        pass
-    return {'cart':carts}
\ No newline at end of file
+    # Lecture seule : la session et le Panier ne sont créés qu'au premier ajout (add_to_cart)
+    return {'cart': SimpleLazyObject(lambda: customer_panier.panier_existant(request))}
@@ -1,3 +1,95 @@
-from django.test import TestCase
+from django.test import TestCase, Client
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.urls import reverse
+from cities_light.models import City, Country
 
-# Create your tests here.
+from . import villes
+from .models import Horaire
+
+
+class WebsiteFragmentsTest(TestCase):
+    """Tests des fragments mis en cache du gabarit base.html"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        User.objects.create_user(username="client", password="password123")
+        # Connecté : la page entière n'est pas mise en cache, seuls les fragments le sont
+        self.client.login(username="client", password="password123")
+        Horaire.objects.create(titre="Lundi", description="8h - 18h", status=True)
+
+    def _tables_lues(self):
+        with CaptureQueriesContext(connection) as contexte:
+            response = self.client.get(reverse('index'))
+        return response, ' '.join(requete['sql'] for requete in contexte.captured_queries)
+
+    def test_fragments_sans_requete(self):
+        """Au deuxième rendu, pied de page et menus ne relisent ni horaires, ni galerie, ni catégories"""
+        response, _ = self._tables_lues()
+        self.assertContains(response, 'Lundi')
+        response, sql = self._tables_lues()
+        self.assertContains(response, 'Lundi')
+        for table in ('website_horaire', 'website_galerie', 'website_siteinfo', 'shop_categorieetablissement'):
+            self.assertNotIn(table, sql)
+
+    def test_fragment_invalide_par_l_admin(self):
+        """Modifier un horaire change la version du tag site et donc le fragment"""
+        self._tables_lues()
+        Horaire.objects.create(titre="Dimanche", description="Fermé", status=True)
+        response, sql = self._tables_lues()
+        self.assertContains(response, 'Dimanche')
+        self.assertIn('website_horaire', sql)
+
+
+class WebsiteVillesTest(TestCase):
+    """Tests de l'autocomplétion des villes"""
+
+    def setUp(self):
+        villes.invalider()
+        self.pays = Country.objects.create(name="Côte d'Ivoire", code2='CI', code3='CIV')
+        self.abidjan = City.objects.create(name="Abidjan", country=self.pays, population=4700000)
+        self.bassam = City.objects.create(name="Grand-Bassam", country=self.pays, population=85000)
+        self.abengourou = City.objects.create(name="Abengourou", country=self.pays, population=135000)
+        self.bouake = City.objects.create(
+            name="Bouaké", country=self.pays, population=740000, alternate_names="Bwake;Bouake"
+        )
+
+    def test_prefixe(self):
+        """Les villes sont trouvées par préfixe, les plus peuplées d'abord"""
+        self.assertEqual(
+            [v['id'] for v in villes.chercher("ab")],
+            [self.abidjan.id, self.abengourou.id],
+        )
+
+    def test_accents_et_noms_alternatifs(self):
+        """La recherche ignore accents et casse et couvre les noms alternatifs"""
+        self.assertEqual([v['id'] for v in villes.chercher("BOUAKÉ")], [self.bouake.id])
+        self.assertEqual([v['id'] for v in villes.chercher("bwa")], [self.bouake.id])
+
+    def test_mot_du_nom(self):
+        """Un mot au milieu du nom suffit"""
+        self.assertEqual([v['id'] for v in villes.chercher("bassam")], [self.bassam.id])
+
+    def test_index_invalide(self):
+        """Ajouter une ville reconstruit l'index"""
+        self.assertEqual(villes.chercher("yamou"), [])
+        yamoussoukro = City.objects.create(name="Yamoussoukro", country=self.pays, population=200000)
+        self.assertEqual([v['id'] for v in villes.chercher("yamou")], [yamoussoukro.id])
+
+    def test_endpoint(self):
+        """L'API renvoie les suggestions en JSON, sans requête SQL une fois l'index chargé"""
+        villes.index()
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('villes'), {'q': 'abi'})
+        data = response.json()
+        self.assertTrue(data['success'])
+        self.assertEqual(data['villes'], [{'id': self.abidjan.id, 'nom': self.abidjan.display_name or "Abidjan"}])
+
+    def test_inscription_sans_liste_des_villes(self):
+        """La page d'inscription n'embarque plus une option par ville"""
+        response = self.client.get(reverse('guests_signup'))
+        self.assertContains(response, 'champ-ville')
+        self.assertNotContains(response, 'Abengourou')
@@ -1,26 +1,35 @@
 from django.shortcuts import render
+from django.http import JsonResponse
+from django.views.decorators.cache import cache_control
 from . import models
 from shop import models as shop_models
+from shop import promotions
+from base.cache import cache_page_anonyme
+from . import villes as index_villes
 
 
 # Create your views here.
+@cache_page_anonyme('produits', 'website', 'site')
 def index(request):
     about = models.About.objects.filter(status=True)[:1]
     partenaires = models.Partenaire.objects.filter(status=True)[:5]
     bannieres = models.Banniere.objects.filter(status=True)[:4]
     appreciations = models.Appreciation.objects.filter(status=True)
     produits = shop_models.Produit.objects.filter(super_deal=True)[:3]
+    deals_fin_proche = promotions.deals_fin_proche()
     datas = {
         'about': about,
         'partenaires': partenaires,
         'appreciations': appreciations,
         'produits': produits,
+        'deals_fin_proche': deals_fin_proche,
         'bannieres': bannieres,
     }
 
     return render(request, 'index.html', datas)
 
 
+@cache_page_anonyme('website', 'site')
 def about(request):
     about = models.About.objects.filter(status=True)[:1]
     why_choose = models.WhyChooseUs.objects.filter(status=True)[:3]
@@ -29,4 +38,14 @@ def about(request):
         'why_choose': why_choose,
 
     }
-    return render(request, 'about-us.html', datas)
\ No newline at end of file
+    return render(request, 'about-us.html', datas)
+
+
+@cache_control(public=True, max_age=60 * 60)
+def villes(request):
+    """Suggestions de villes pour les champs ville des formulaires (?q=début du nom)."""
+    data = {
+        'success': True,
+        'villes': index_villes.chercher(request.GET.get('q', '')),
+    }
+    return JsonResponse(data, safe=False)
@@ -0,0 +1,92 @@
+"""
+Autocomplétion des villes.
+
+Index de préfixes en mémoire, construit une fois par worker à partir de
+cities_light.City (nom, noms alternatifs et traductions) : une recherche est une
+dichotomie dans une liste triée, sans requête SQL.
+"""
+import bisect
+import re
+import threading
+import unicodedata
+
+from django.db.models.signals import post_delete, post_save
+
+from cities_light.models import City
+
+
+NOMBRE_SUGGESTIONS = 10
+
+# Entrées parcourues au plus pour un préfixe très court ("a")
+MAX_PARCOURUES = 2000
+
+_index = None
+_verrou = threading.Lock()
+
+
+def normaliser(texte):
+    texte = unicodedata.normalize('NFKD', texte or '')
+    texte = ''.join(c for c in texte if not unicodedata.combining(c)).lower()
+    return ' '.join(re.findall(r'\w+', texte))
+
+
+def _noms(ville):
+    noms = {ville['name']}
+    noms.update(re.split(r'[;,]', ville['alternate_names'] or ''))
+    for traductions in (ville['translations'] or {}).values():
+        noms.update([traductions] if isinstance(traductions, str) else traductions)
+    return {nom for nom in noms if nom and nom.strip()}
+
+
+def _construire():
+    entrees = set()
+    villes = {}
+    for ville in City.objects.values('id', 'name', 'display_name', 'alternate_names', 'translations', 'population'):
+        villes[ville['id']] = {
+            'id': ville['id'],
+            'nom': ville['display_name'] or ville['name'],
+            'population': ville['population'] or 0,
+        }
+        for nom in _noms(ville):
+            mots = normaliser(nom).split(' ')
+            # "bassam" retrouve aussi Grand-Bassam
+            for debut in range(len(mots)):
+                entrees.add((' '.join(mots[debut:]), ville['id']))
+    entrees = sorted(entrees)
+    return [cle for cle, _ in entrees], [ville_id for _, ville_id in entrees], villes
+
+
+def index():
+    global _index
+    if _index is None:
+        with _verrou:
+            if _index is None:
+                _index = _construire()
+    return _index
+
+
+def invalider(**kwargs):
+    global _index
+    _index = None
+
+
+def chercher(texte, limite=NOMBRE_SUGGESTIONS):
+    """Villes dont un nom (ou un mot du nom) commence par texte, les plus peuplées d'abord."""
+    prefixe = normaliser(texte)
+    if not prefixe:
+        return []
+    cles, ids, villes = index()
+    trouvees = set()
+    position = bisect.bisect_left(cles, prefixe)
+    fin = min(len(cles), position + MAX_PARCOURUES)
+    while position < fin and cles[position].startswith(prefixe):
+        trouvees.add(ids[position])
+        position += 1
+    resultats = sorted((villes[i] for i in trouvees), key=lambda v: (-v['population'], v['nom']))
+    return [{'id': v['id'], 'nom': v['nom']} for v in resultats[:limite]]
+
+
+def connecter_signaux():
+    # Chaque worker a son index : les autres se mettront à jour à leur redémarrage
+    post_save.connect(invalider, sender=City, dispatch_uid='villes:save')
+    post_delete.connect(invalider, sender=City, dispatch_uid='villes:delete')